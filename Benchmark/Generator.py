@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from collections import OrderedDict
+
+# Bumped whenever the generated content changes, generated DBs of other versions are not reused.
+GENERATOR_VERSION = 1
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'Model', 'DataAccessor', 'DbTableAccessorUnittest.db')
+
+START_DATE = datetime.date(2000, 1, 1)
+GROUP_COUNT = 300
+ROOT_GROUP_COUNT = 12
+MAX_LEVEL = 7
+WORD_COUNT = 400
+RECORDS_PER_DAY = (2, 10)
+SYLLABLES = ('ka', 'ri', 'mo', 'su', 'te', 'na', 'lo', 'pi', 'ye', 'go', 'ba', 'chi', 'zu', 'ne', 'ro', 'wa')
+
+
+def get_path(dir_path, years, seed):
+    return os.path.join(dir_path, "Synthetic-v%d-%dy-%d.db" % (GENERATOR_VERSION, years, seed))
+
+
+def generate(path, years, seed=0):
+    """
+    Create a DB of daily records and sleeps over years, the same content for the same years and seed.
+    Schema is copied from the unittest fixture, so migrations are applied when the app opens it.
+    Returns counts of the rows.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            _create_schema(connection)
+            groups = _insert_groups(connection, rng)
+            words = _get_words(rng)
+            days = (_add_years(START_DATE, years) - START_DATE).days
+            for day in range(days):
+                date = START_DATE + datetime.timedelta(days=day)
+                date_id = day + 1
+                connection.execute('INSERT INTO Timeline (id, date) VALUES (?, ?)', (date_id, date.isoformat()))
+                _insert_records(connection, rng, date_id, groups, words)
+                _insert_sleeps(connection, rng, date)
+        return get_counts(connection)
+    finally:
+        connection.close()
+
+
+def get_counts(connection):
+    return OrderedDict(
+        (table, connection.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0])
+        for table in ('Timeline', 'RecordGroup', 'GroupRelation', 'BasicRecord', 'ExtraRecord', 'Sleep'))
+
+
+def _create_schema(connection):
+    fixture = sqlite3.connect(FIXTURE_PATH)
+    try:
+        statements = [sql for sql, in fixture.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END")]
+    finally:
+        fixture.close()
+    for sql in statements:
+        connection.execute(sql)
+
+
+def _get_groups(rng):
+    """ (id, description, parent id or None), parents are often the latest groups, which makes deep chains. """
+    groups = []
+    levels = {}
+    for group_id in range(1, GROUP_COUNT + 1):
+        candidates = ([id_ for id_, _, _ in groups[-20:] if levels[id_] < MAX_LEVEL - 1] or
+                      [id_ for id_, _, _ in groups if levels[id_] < MAX_LEVEL - 1])
+        parent_id = None if group_id <= ROOT_GROUP_COUNT or not candidates else rng.choice(candidates)
+        levels[group_id] = 0 if parent_id is None else levels[parent_id] + 1
+        groups.append((group_id, "Group %03d" % group_id, parent_id))
+    return groups
+
+
+def _get_words(rng):
+    return sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(WORD_COUNT)})
+
+
+def _insert_groups(connection, rng):
+    groups = _get_groups(rng)
+    connection.executemany('INSERT INTO RecordGroup (id, description) VALUES (?, ?)',
+                           [(id_, description) for id_, description, _ in groups])
+    connection.executemany('INSERT INTO GroupRelation (parent_id, child_id) VALUES (?, ?)',
+                           [(parent_id, id_) for id_, _, parent_id in groups if parent_id is not None])
+    # Few groups are used most of the time.
+    return [id_ for id_, _, _ in groups], [1 / rank for rank in range(1, len(groups) + 1)]
+
+
+def _insert_records(connection, rng, date_id, groups, words):
+    group_ids, weights = groups
+    for group_id in rng.choices(group_ids, weights, k=rng.randint(*RECORDS_PER_DAY)):
+        basic_id = connection.execute('INSERT INTO BasicRecord (date_id, group_id) VALUES (?, ?)',
+                                      (date_id, group_id)).lastrowid
+        extras = [('description', rng.choice(words)) for _ in range(rng.choice((0, 1, 1, 1, 2)))]
+        if rng.random() < 0.3:
+            extras.append(('magnitude', str(rng.randint(1, 50))))
+        if rng.random() < 0.2:
+            extras.append(('time', str(rng.choice((0.5, 1, 1.5, 2, 3)))))
+        if rng.random() < 0.1:
+            extras.append(('distance', str(round(rng.uniform(1, 20), 1))))
+        connection.executemany('INSERT INTO ExtraRecord (basic_id, key, value) VALUES (?, ?, ?)',
+                               [(basic_id, key, value) for key, value in extras])
+
+
+def _insert_sleeps(connection, rng, date):
+    """ A night sleep starting around midnight, and sometimes a nap. """
+    midnight = datetime.datetime.combine(date, datetime.time())
+    start = midnight + datetime.timedelta(minutes=rng.randint(-120, 150))
+    sessions = [(start, start + datetime.timedelta(minutes=rng.randint(300, 540)))]
+    if rng.random() < 0.2:
+        start = midnight + datetime.timedelta(hours=13, minutes=rng.randint(0, 60))
+        sessions.append((start, start + datetime.timedelta(minutes=rng.randint(20, 90))))
+    connection.executemany('INSERT INTO Sleep (start, end) VALUES (?, ?)',
+                           [(start.isoformat(' '), end.isoformat(' ')) for start, end in sessions])
+
+
+def _add_years(date, years):
+    return date.replace(year=date.year + years)
+
+
+class _GeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_reproducible(self):
+        paths = [os.path.join(self.dir.name, name) for name in ('a.db', 'b.db')]
+        counts = [generate(path, 1, seed=3) for path in paths]
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(366, counts[0]['Timeline'])
+        self.assertEqual(GROUP_COUNT - ROOT_GROUP_COUNT, counts[0]['GroupRelation'])
+
+        dumps = []
+        for path in paths:
+            connection = sqlite3.connect(path)
+            dumps.append(list(connection.iterdump()))
+            connection.close()
+        self.assertEqual(dumps[0], dumps[1])
+
+    def test_levels(self):
+        parents = {id_: parent_id for id_, _, parent_id in _get_groups(random.Random(0))}
+
+        def get_level(group_id):
+            return 0 if parents[group_id] is None else get_level(parents[group_id]) + 1
+        levels = [get_level(id_) for id_ in parents]
+        self.assertEqual(MAX_LEVEL - 1, max(levels))
+
+
+if __name__ == "__main__":
+    unittest.main()
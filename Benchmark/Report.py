@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import unittest
+from collections import namedtuple
+
+Comparison = namedtuple('Comparison', ['dataset', 'name', 'baseline_ms', 'current_ms', 'ratio'])
+
+
+def get_ms(result):
+    """ Median of repeated runs, or the only run. """
+    return result.get('median_ms', result['min_ms'])
+
+
+def compare(baseline, current):
+    """ Comparison of each benchmark on each dataset in both reports, ratio > 1 is slower than baseline. """
+    comparisons = []
+    for dataset, data in current['datasets'].items():
+        baseline_results = baseline['datasets'].get(dataset, {}).get('results', {})
+        for name, result in data['results'].items():
+            if name in baseline_results:
+                baseline_ms, current_ms = get_ms(baseline_results[name]), get_ms(result)
+                ratio = current_ms / baseline_ms if baseline_ms else float('inf')
+                comparisons.append(Comparison(dataset, name, baseline_ms, current_ms, ratio))
+    return comparisons
+
+
+def format_results(report):
+    lines = []
+    for dataset, data in report['datasets'].items():
+        lines.append("%s: %s" % (dataset, ", ".join("%s %d" % count for count in data['counts'].items())))
+        lines.extend("  %-56s %10.1f ms" % (name, get_ms(result)) for name, result in data['results'].items())
+        lines.extend("  %-56s %10.1f KB retained, %10.1f KB peak" % (name, memory['retained_kb'], memory['peak_kb'])
+                     for name, memory in data.get('memory', {}).items())
+    return lines
+
+
+def format_comparisons(comparisons, threshold):
+    lines = []
+    for comparison in comparisons:
+        if comparison.ratio > threshold:
+            mark = "slower"
+        elif comparison.ratio < 1 / threshold:
+            mark = "faster"
+        else:
+            mark = ""
+        lines.append("%-4s %-56s %10.1f -> %10.1f ms  x%.2f %s" % (comparison + (mark,)))
+    return lines
+
+
+class _CompareTest(unittest.TestCase):
+    @staticmethod
+    def create_report(**results):
+        return {'datasets': {'1y': {'counts': {}, 'results': {
+            name: {'min_ms': ms, 'median_ms': ms} for name, ms in results.items()}}}}
+
+    def test_compare(self):
+        comparisons = compare(self.create_report(a=10.0, b=20.0, c=1.0), self.create_report(a=15.0, b=10.0, d=1.0))
+        self.assertEqual([Comparison('1y', 'a', 10.0, 15.0, 1.5), Comparison('1y', 'b', 20.0, 10.0, 0.5)],
+                         comparisons)
+        lines = format_comparisons(comparisons, threshold=1.25)
+        self.assertTrue(lines[0].endswith("slower"))
+        self.assertTrue(lines[1].endswith("faster"))
+
+    def test_single_run(self):
+        self.assertEqual(3.0, get_ms({'min_ms': 3.0, 'runs': 1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Timings of models, summarizers, table models, aliasing and inserts on one DB.
+Run by BenchmarkMain in a process per DB, since the DB is opened when Model is imported.
+"""
+import argparse
+import atexit
+import datetime
+import importlib.util
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+# parallel is serial on a single CPU unless record_summary.parallel.workers is set.
+RECORD_SUMMARY_ENGINES = ('python', 'sql', 'parallel') + (('numpy',) if importlib.util.find_spec('numpy') else ())
+ALIAS_GROUP_COUNT = 60
+INSERT_COUNT = 100
+BULK_INSERT_COUNT = 1000
+
+
+def measure(function, repeat, warmup=1):
+    for _ in range(warmup):
+        function()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return OrderedDict((
+        ('min_ms', min(seconds) * 1000),
+        ('median_ms', statistics.median(seconds) * 1000),
+        ('max_ms', max(seconds) * 1000),
+        ('runs', repeat),
+    ))
+
+
+def measure_memory(function):
+    """ Memory allocated by function and retained by its result, and the peak while running it. """
+    tracemalloc.start()
+    try:
+        result = function()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return OrderedDict((('retained_kb', retained / 1024), ('peak_kb', peak / 1024)))
+
+
+def run(db_path, repeat):
+    """ Open the DB at db_path, which is modified by inserts, returns timings and memory of all benchmarks. """
+    os.environ['LIFERECORDER_DB_PATH'] = db_path
+    os.environ['LIFERECORDER_QUERY_INSTRUMENT'] = '0'
+    started = time.perf_counter()
+    from PyQt5.QtCore import QCoreApplication
+    import Model.TableViewModel  # opens the DB, applies migrations and builds the rollup
+    from Model.DataAccessor.Configure import config
+    # Engines are measured on their own, the cache has its benchmarks in a temporary dir.
+    config.config['summary_cache'] = dict(config['summary_cache'], enabled=False)
+    results = OrderedDict([('startup', OrderedDict((('min_ms', (time.perf_counter() - started) * 1000),
+                                                     ('runs', 1))))])
+
+    application = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    for name, (function, repeat_) in get_benchmarks().items():
+        results[name] = measure(function, repeat_ or repeat, warmup=0 if repeat_ == 1 else 1)
+    memory = OrderedDict((name, measure_memory(function)) for name, function in get_memory_benchmarks().items())
+    del application
+    return OrderedDict((('results', results), ('memory', memory)))
+
+
+def get_benchmarks():
+    """ {name: (function, repeat or None for the default)} """
+    from Model.DbTableModel.BaseModel import DurationType
+    from Model.DbTableModel.RecordModel import RecordDurationModel
+    from Model.DbTableModel.SleepModel import SleepDurationModel
+    from Model.TableViewModel import RecordDurationTableModel, SleepDurationTableModel, SleepTableModel
+    from Model.Utility import DateFilter
+
+    benchmarks = OrderedDict()
+    for engine in RECORD_SUMMARY_ENGINES:
+        for duration in DurationType:
+            benchmarks['RecordDurationModel.get_data[%s,%s]' % (engine, duration.value)] = (
+                _with_engine(engine, lambda duration=duration: list(RecordDurationModel.get_data(duration))), None)
+    if 'numpy' in RECORD_SUMMARY_ENGINES:
+        # Columns are loaded once and reused by the benchmarks above.
+        def get_data_uncached():
+            RecordDurationModel.update_cache()
+            return list(RecordDurationModel.get_data(DurationType.DAILY))
+        benchmarks['RecordDurationModel.get_data[numpy,Daily,uncached]'] = (
+            _with_engine('numpy', get_data_uncached), None)
+    benchmarks.update(_get_summary_cache_benchmarks())
+    for duration in DurationType:
+        benchmarks['SleepDurationModel.get_data[%s]' % duration.value] = (
+            lambda duration=duration: list(SleepDurationModel.get_data(duration)), None)
+
+    # Default date filters are relative to today, all dates are shown instead.
+    table_models = OrderedDict((
+        ('RecordDurationTableModel', type('RecordDurationTableModel', (RecordDurationTableModel,),
+                                          {'DEFAULT_DATE_FILTER': DateFilter.Type.NO})),
+        ('SleepDurationTableModel', type('SleepDurationTableModel', (SleepDurationTableModel,),
+                                         {'DEFAULT_DATE_FILTER': DateFilter.Type.NO})),
+        ('SleepTableModel', SleepTableModel),
+    ))
+    for name, model_class in table_models.items():
+        benchmarks['%s()' % name] = (model_class, None)
+    for name, model_class in table_models.items():
+        benchmarks['%s.data[all cells]' % name] = (_get_cells_reader(model_class()), 1)
+    for name, model_class in table_models.items():
+        # Text of cells is cached on the first read by the warmup.
+        benchmarks['%s.data[all cells,repaint]' % name] = (_get_cells_reader(model_class()), None)
+
+    benchmarks['AliasEngine.rephrase[all descriptions]'] = (_get_alias_benchmark(), None)
+    benchmarks.update(_get_insert_benchmarks())
+    return benchmarks
+
+
+def get_memory_benchmarks():
+    from Model.DbTableModel.BaseModel import DurationType
+    from Model.DbTableModel.RecordModel import RecordDurationModel
+
+    return OrderedDict(
+        ('RecordDurationModel.get_data[%s,%s]' % (engine, duration.value),
+         _with_engine(engine, lambda duration=duration: RecordDurationModel.get_data(duration)))
+        for engine in RECORD_SUMMARY_ENGINES for duration in DurationType)
+
+
+def _with_engine(engine, function):
+    from Model.DataAccessor.Configure import config
+
+    def run_with_engine():
+        config.config['record_summary'] = dict(config['record_summary'], engine=engine)
+        return function()
+    return run_with_engine
+
+
+def _get_summary_cache_benchmarks():
+    """ Summaries read from the cache files, and with the periods of an added record computed again. """
+    from Model.DataAccessor.Configure import config
+    from Model.DbTableModel.BaseModel import DurationType
+    from Model.DataAccessor.DbTableAccessor import Timeline, fn
+    from Model.DbTableModel.RecordModel import RecordDurationModel, RecordUtility, ExtraRecordType
+
+    cache_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, cache_dir, ignore_errors=True)
+    group_id = next(iter(RecordUtility.Group.get_ids()))
+    last_date = Timeline.select(fn.MAX(Timeline.date)).scalar()
+    if isinstance(last_date, str):
+        last_date = datetime.datetime.strptime(last_date, "%Y-%m-%d").date()
+    # As the default date filter of one month, relative to the last record instead of today.
+    date_start = last_date - datetime.timedelta(days=30)
+
+    def with_cache(function):
+        def run_with_cache():
+            config.config['summary_cache'] = dict(config['summary_cache'], enabled=True, dir=cache_dir)
+            try:
+                return function()
+            finally:
+                config.config['summary_cache'] = dict(config['summary_cache'], enabled=False)
+        return run_with_cache
+
+    def get_data_added(duration):
+        RecordUtility.Basic.create_with_extras(last_date, group_id,
+                                               [(ExtraRecordType.DESCRIPTION, 'benchmark')])
+        return list(RecordDurationModel.get_data(duration))
+
+    benchmarks = OrderedDict()
+    for duration in DurationType:
+        benchmarks['RecordDurationModel.get_data[cache,%s]' % duration.value] = (
+            with_cache(lambda duration=duration: list(RecordDurationModel.get_data(duration))), None)
+        benchmarks['RecordDurationModel.get_data[cache,%s,1 month]' % duration.value] = (
+            with_cache(lambda duration=duration: list(RecordDurationModel.get_data(
+                duration, RecordDurationModel.get_period_cutoff(duration, date_start)))), None)
+    benchmarks['RecordDurationModel.get_data[cache,Daily,added]'] = (
+        with_cache(lambda: get_data_added(DurationType.DAILY)), None)
+    return benchmarks
+
+
+def _get_cells_reader(model):
+    from PyQt5.QtCore import QModelIndex, Qt
+    while model.canFetchMore(QModelIndex()):
+        model.fetchMore(QModelIndex())
+
+    def read_cells():
+        for row in range(model.rowCount()):
+            for column in range(model.columnCount()):
+                model.data(model.index(row, column), Qt.DisplayRole)
+    return read_cells
+
+
+def _get_alias_benchmark():
+    """ Rules of literals and patterns on groups with many descriptions, compiled and applied to all. """
+    from Model.AliasUtility import AliasEngine
+    from Model.DataAccessor.DbTableAccessor import BasicRecord, ExtraRecord
+    from Model.DbTableModel.RecordModel import RecordUtility
+
+    rows = list(ExtraRecord
+                .select(BasicRecord.group_id, ExtraRecord.value)
+                .join(BasicRecord)
+                .where(ExtraRecord.key == 'description')
+                .tuples())
+    words = sorted({description for _, description in rows})
+    rng = random.Random(0)
+    group_rules = {}
+    for group_id in range(1, ALIAS_GROUP_COUNT + 1):
+        rules = OrderedDict()
+        for index in range(5):
+            rules['Alias %d-%d' % (group_id, index)] = rng.sample(words, rng.randint(1, 4))
+        rules['Pattern %d' % group_id] = ['^%s.*' % rng.choice(words)[:2]]
+        group_rules[group_id] = rules
+
+    def rephrase_all():
+        engine = AliasEngine(group_rules, RecordUtility.Group.get_hierarchy())
+        for group_id, description in rows:
+            engine.rephrase(group_id, description)
+    return rephrase_all
+
+
+def _get_insert_benchmarks():
+    """ Inserts on dates after the existing ones, so they never conflict. """
+    from Model.DataAccessor.DbTableAccessor import Timeline, fn
+    from Model.DbTableModel.RecordModel import RecordUtility, RecordRow, ExtraRecordType
+    from Model.DbTableModel.SleepModel import SleepUtility
+
+    last_date = Timeline.select(fn.MAX(Timeline.date)).scalar()
+    if isinstance(last_date, str):
+        last_date = datetime.datetime.strptime(last_date, "%Y-%m-%d").date()
+    days = itertools.count(1)
+    group_ids = list(RecordUtility.Group.get_ids())
+
+    def create_with_extras():
+        date = last_date + datetime.timedelta(days=next(days))
+        for index in range(INSERT_COUNT):
+            RecordUtility.Basic.create_with_extras(
+                date, group_ids[index % len(group_ids)],
+                [(ExtraRecordType.DESCRIPTION, 'benchmark %d' % index), (ExtraRecordType.MAGNITUDE, '1')])
+
+    def create_many():
+        date = last_date + datetime.timedelta(days=next(days))
+        RecordUtility.Basic.create_many(
+            RecordRow(date, group_ids[index % len(group_ids)],
+                      ((ExtraRecordType.DESCRIPTION, 'benchmark %d' % index), (ExtraRecordType.MAGNITUDE, '1')))
+            for index in range(BULK_INSERT_COUNT))
+
+    def create_sleeps():
+        start = datetime.datetime.combine(last_date + datetime.timedelta(days=next(days)), datetime.time())
+        for index in range(INSERT_COUNT):
+            session = start + datetime.timedelta(minutes=index * 10)
+            SleepUtility.create_by_datetime(session, session + datetime.timedelta(minutes=5))
+
+    return OrderedDict((
+        ('RecordUtility.Basic.create_with_extras[x%d]' % INSERT_COUNT, (create_with_extras, None)),
+        ('RecordUtility.Basic.create_many[x%d]' % BULK_INSERT_COUNT, (create_many, None)),
+        ('SleepUtility.create_by_datetime[x%d]' % INSERT_COUNT, (create_sleeps, None)),
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run benchmarks on a DB, results are printed in JSON.")
+    parser.add_argument('db_path', help="Modified by the insert benchmarks.")
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+    json.dump(run(arguments.db_path, arguments.repeat), sys.stdout)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+from Benchmark import Generator, Report
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_dataset(data_dir, years, seed):
+    """ Path and counts of the synthetic DB, generated unless it exists. """
+    path = Generator.get_path(data_dir, years, seed)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print("Generating %s..." % path, file=sys.stderr)
+        Generator.generate(path + '.tmp', years, seed)
+        os.replace(path + '.tmp', path)
+    connection = sqlite3.connect(path)
+    try:
+        return path, Generator.get_counts(connection)
+    finally:
+        connection.close()
+
+
+def run_suite(path, repeat):
+    """ Run the suite on a copy of the DB in a new process, since the DB is opened on importing Model. """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        copy_path = os.path.join(temp_dir, os.path.basename(path))
+        shutil.copyfile(path, copy_path)
+        output = subprocess.run([sys.executable, '-m', 'Benchmark.Suite', copy_path, '--repeat', str(repeat)],
+                                cwd=PROJECT_DIR, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8'), object_pairs_hook=OrderedDict)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Benchmark LifeRecorder on synthetic DBs.")
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 20], help="Sizes of the synthetic DBs.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'LifeRecorderBenchmark'),
+                        help="Where the synthetic DBs are generated and reused.")
+    parser.add_argument('--output', help="Write the results in JSON, e.g. to be a baseline.")
+    parser.add_argument('--baseline', help="Compare with the results of a former run.")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Ratio to baseline reported as slower, and its inverse as faster.")
+    return parser
+
+
+def main(arguments):
+    report = OrderedDict((
+        ('environment', OrderedDict((
+            ('python', platform.python_version()),
+            ('sqlite', sqlite3.sqlite_version),
+            ('platform', platform.platform()),
+        ))),
+        ('seed', arguments.seed),
+        ('datasets', OrderedDict()),
+    ))
+    for years in arguments.years:
+        path, counts = get_dataset(arguments.data_dir, years, arguments.seed)
+        report['datasets']['%dy' % years] = OrderedDict([('counts', counts)])
+        report['datasets']['%dy' % years].update(run_suite(path, arguments.repeat))
+
+    print("\n".join(Report.format_results(report)))
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline, encoding='utf-8') as file:
+            baseline = json.load(file, object_pairs_hook=OrderedDict)
+        comparisons = Report.compare(baseline, report)
+        print("\nCompared with %s:" % arguments.baseline)
+        print("\n".join(Report.format_comparisons(comparisons, arguments.threshold)))
+        return 1 if any(comparison.ratio > arguments.threshold for comparison in comparisons) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(create_parser().parse_args()))
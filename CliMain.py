@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+
+from Model.DbTableModel.SleepModel import SleepUtility
+from Model.DbTableModel.RecordModel import RecordUtility
+from Model.DataAccessor.DbTableAccessor import db, log_pragmas, push_working_copy, dump_query_report
+from Model.DataAccessor.Configure import config
+from Model.DataAccessor import Migration
+from Model import ImportUtility
+from Model.TimeUtility import str_timedelta
+
+
+def rebuild_sleep_rollup(args):
+    count = SleepUtility.rebuild_rollup()
+    print("SleepRollup rebuilt, %d rows." % count)
+
+
+def migrate(args):
+    # Pending migrations have been applied while connecting.
+    print("Schema version: %d" % Migration.get_version(db))
+    if args.report:
+        print("\n".join(Migration.get_query_plan_report(db.database)))
+
+
+def realias(args):
+    def print_change(extra_id, old, new):
+        print("%d: %s -> %s" % (extra_id, old, new))
+
+    report = RecordUtility.Alias.realias(dry_run=args.dry_run, on_change=print_change if args.dry_run else None)
+    print("%d descriptions scanned, %d %s in %.2fs (%.0f rows/s)." % (
+        report.scanned, report.changed, "to change" if args.dry_run else "changed",
+        report.seconds, report.scanned / report.seconds if report.seconds else 0))
+
+
+def import_records(args):
+    report = ImportUtility.import_records(args.path)
+    for error in report.errors:
+        print("Line %d: %s" % error)
+    print("%d records imported, %d rows failed in %.2fs (%.0f rows/s)." % (
+        report.imported, len(report.errors), report.seconds,
+        report.imported / report.seconds if report.seconds else 0))
+
+
+def import_sleeps(args):
+    report = ImportUtility.import_sleeps(args.path)
+    for error in report.errors:
+        print("Line %d: %s" % error)
+    for feedback in report.feedback:
+        print("{0}:  +{1}  -->  {2}".format(
+            feedback['date'], str_timedelta(feedback['growth']), str_timedelta(feedback['after'])))
+    print("%d sleeps imported on %d dates, %d rows failed in %.2fs." % (
+        report.imported, len(report.feedback), len(report.errors), report.seconds))
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Maintenance commands of LifeRecorder.")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    rebuild = commands.add_parser('rebuild-sleep-rollup', help="Recompute table SleepRollup from table Sleep.")
+    rebuild.set_defaults(func=rebuild_sleep_rollup)
+
+    migration = commands.add_parser('migrate', help="Apply pending schema migrations.")
+    migration.add_argument('--report', action='store_true',
+                           help="Print query plans of hot queries before and after the migrations.")
+    migration.set_defaults(func=migrate)
+
+    alias = commands.add_parser('realias', help="Rephrase existing descriptions by the current Alias.json.")
+    alias.add_argument('--dry-run', action='store_true', help="Print the changes without writing them.")
+    alias.set_defaults(func=realias)
+
+    importer = commands.add_parser('import-records', help="Import records from a CSV or JSON lines file.")
+    importer.add_argument('path', help="Columns are date, group (description or id) and keys of extras.")
+    importer.set_defaults(func=import_records)
+
+    sleep_importer = commands.add_parser('import-sleep', help="Import sleeps from a CSV or JSON lines file.")
+    sleep_importer.add_argument('path', help="Columns are start and end, all rows are imported or none.")
+    sleep_importer.set_defaults(func=import_sleeps)
+
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = create_parser().parse_args()
+    # Logged to stderr, apart from the output of commands.
+    logging.basicConfig(level=logging.INFO)
+    log_pragmas()
+    arguments.func(arguments)
+    push_working_copy()
+    dump_query_report()
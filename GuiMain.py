@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import logging
 import sys
 from collections import OrderedDict
 
@@ -7,6 +8,12 @@ from Ui.MainPanel import *
 from Ui.Utility.Window import *
 from Ui.Utility.Panel import *
 from Model.DataAccessor.Configure import config
+from Model import DbWriter
+from Model.DbTableModel.RecordModel import RecordUtility
+from Model.DataAccessor import DbTableAccessor
+from Model.DataAccessor.DbTableAccessor import (
+    log_pragmas, push_working_copy, push_working_copy_in_background, dump_query_report)
+from PyQt5.QtCore import QTimer, Qt
 
 
 class MainWindow(BaseMainWindow, BaseConfigLoader):
@@ -96,8 +103,25 @@ class DataViewPanel(BaseVBoxPanel, HBoxMenuable, PanelChangeable):
         )
 
 
+def reload_alias(state):
+    # Alias.json edited while the window is inactive is applied to records added after.
+    if state == Qt.ApplicationActive:
+        RecordUtility.Alias.reload()
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    log_pragmas()
     app = QApplication(sys.argv)
+    # Pushed after the writer finishes pending writes, and after any push in background.
+    app.aboutToQuit.connect(DbWriter.shutdown)
+    app.aboutToQuit.connect(push_working_copy)
+    app.aboutToQuit.connect(dump_query_report)
+    app.applicationStateChanged.connect(reload_alias)
+    push_timer = QTimer()
+    if DbTableAccessor.working_copy is not None:
+        push_timer.timeout.connect(push_working_copy_in_background)
+        push_timer.start(config['working_copy']['push_seconds'] * 1000)
 
     window = MainWindow()
     window.show()
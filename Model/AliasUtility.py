@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import unittest
+
+_SPECIAL_CHARS = set('.^$*+?{}[]|()')
+
+
+def get_literal(rule):
+    """ The text matched by rule if it is a plain string, otherwise None. """
+    literal = []
+    chars = iter(rule)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            if not char or char.isalnum():
+                return None
+        elif char in _SPECIAL_CHARS:
+            return None
+        literal.append(char)
+    return ''.join(literal) if literal else None
+
+
+def is_overlapped(text_a, text_b):
+    """ Whether the two texts can share characters in any string, ignoring case. """
+    text_a, text_b = text_a.lower(), text_b.lower()
+    if text_a in text_b or text_b in text_a:
+        return True
+    return any(text_a.endswith(text_b[:size]) or text_b.endswith(text_a[:size])
+               for size in range(1, min(len(text_a), len(text_b))))
+
+
+class AliasEngine(object):
+    """
+    Rephrases descriptions by the rules of a group and then its ancestors, as if the rules are applied one by one.
+    Rules of each group are compiled once, on its first use.
+    """
+    def __init__(self, group_rules, hierarchy):
+        """
+        :param group_rules: {group_id: {name: [rule, ...]}}
+        :param hierarchy: RecordUtility.Hierarchy
+        """
+        self._group_rules = group_rules
+        self._hierarchy = hierarchy
+        self._steps = {}
+
+    def rephrase(self, group_id, description):
+        result = description
+        for pattern, replace in self.get_steps(group_id):
+            result = pattern.sub(replace, result)
+        return result
+
+    def get_steps(self, group_id):
+        """ Compiled (pattern, name or function) of the group, built on first use. """
+        try:
+            return self._steps[group_id]
+        except KeyError:
+            chain = [group_id] + self._hierarchy.get_ancestor_ids(group_id)
+            rules = [(name, rules) for id_ in chain for name, rules in self._group_rules.get(id_, {}).items()]
+            self._steps[group_id] = self._compile(rules)
+            return self._steps[group_id]
+
+    @classmethod
+    def _compile(cls, rules):
+        steps = []
+        run = []
+        for name, patterns in rules:
+            literals = [get_literal(pattern) for pattern in patterns]
+            if patterns and None not in literals and cls._is_mergeable(run, name, literals):
+                run.append((name, literals))
+                continue
+
+            steps.extend(cls._compile_literals(run))
+            if patterns and None not in literals:
+                run = [(name, literals)]
+            else:
+                run = []
+                steps.append((re.compile("|".join(patterns), flags=re.IGNORECASE), name))
+        steps.extend(cls._compile_literals(run))
+        return steps
+
+    @staticmethod
+    def _is_mergeable(run, name, literals):
+        """
+        Applying the run and then the rule at once equals applying them one by one,
+        if the literal of the rule overlaps neither a former literal nor a former name.
+        """
+        return not any(is_overlapped(literal, former)
+                       for former_name, former_literals in run
+                       for former in former_literals + [former_name]
+                       for literal in literals)
+
+    @staticmethod
+    def _compile_literals(run):
+        if not run:
+            return []
+        elif len(run) == 1:
+            name, literals = run[0]
+            return [(re.compile("|".join(map(re.escape, literals)), flags=re.IGNORECASE), name)]
+
+        names = [name for name, _ in run]
+        pattern = "|".join("(?P<_%d>%s)" % (index, "|".join(map(re.escape, literals)))
+                           for index, (_, literals) in enumerate(run))
+        return [(re.compile(pattern, flags=re.IGNORECASE), lambda match: names[int(match.lastgroup[1:])])]
+
+
+class _AliasEngineTest(unittest.TestCase):
+    class Hierarchy(object):
+        PARENTS = {2: 1, 3: 2}
+
+        def get_ancestor_ids(self, group_id):
+            ancestors = []
+            while group_id in self.PARENTS:
+                group_id = self.PARENTS[group_id]
+                ancestors.append(group_id)
+            return ancestors
+
+    @staticmethod
+    def rephrase_one_by_one(group_rules, group_ids, description):
+        for group_id in group_ids:
+            for name, rules in group_rules.get(group_id, {}).items():
+                description = re.sub("|".join(rules), name, description, flags=re.IGNORECASE)
+        return description
+
+    def assertRephrase(self, group_rules, group_ids, description):
+        engine = AliasEngine(group_rules, self.Hierarchy())
+        expect = self.rephrase_one_by_one(group_rules, group_ids, description)
+        self.assertEqual(expect, engine.rephrase(group_ids[0], description))
+
+    def test_literals_merged(self):
+        group_rules = {1: {'Alpha': ['aa', 'AL'], 'Beta': ['bb', '\\+b']}}
+        self.assertEqual(1, len(AliasEngine(group_rules, self.Hierarchy()).get_steps(1)))
+        self.assertRephrase(group_rules, [1], "aa, al+B and bb")
+
+    def test_chained_rules(self):
+        # The second rule rephrases the result of the first one.
+        group_rules = {1: {'xyz': ['q'], 'W': ['y']}}
+        self.assertEqual(2, len(AliasEngine(group_rules, self.Hierarchy()).get_steps(1)))
+        self.assertRephrase(group_rules, [1], "q and y")
+
+    def test_overlapped_rules(self):
+        group_rules = {1: {'A': ['abc'], 'B': ['cd']}}
+        self.assertEqual(2, len(AliasEngine(group_rules, self.Hierarchy()).get_steps(1)))
+        self.assertRephrase(group_rules, [1], "abcd")
+
+    def test_pattern_rules(self):
+        group_rules = {1: {'A': ['a+'], 'B': ['b'], 'C': ['c']}}
+        self.assertEqual(2, len(AliasEngine(group_rules, self.Hierarchy()).get_steps(1)))
+        self.assertRephrase(group_rules, [1], "aaa b c")
+
+    def test_ancestor_rules(self):
+        group_rules = {1: {'One': ['1']}, 3: {'Three': ['3'], '1': ['x']}}
+        self.assertRephrase(group_rules, [3, 2, 1], "3 x 1")
+        self.assertRephrase(group_rules, [2, 1], "3 x 1")
+
+    def test_get_literal(self):
+        self.assertEqual('+N', get_literal('\\+N'))
+        self.assertEqual('蕊蕊', get_literal('蕊蕊'))
+        self.assertIsNone(get_literal('\\d'))
+        self.assertIsNone(get_literal('a|b'))
+        self.assertIsNone(get_literal(''))
+
+    def test_is_overlapped(self):
+        self.assertTrue(is_overlapped('abc', 'CD'))
+        self.assertTrue(is_overlapped('b', 'abc'))
+        self.assertFalse(is_overlapped('abc', 'abx'))
+        self.assertFalse(is_overlapped('ab', 'cd'))
+
+
+if __name__ == "__main__":
+    unittest.main()
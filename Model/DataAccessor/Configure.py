@@ -1,12 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import tempfile
 import unittest
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
 from Model.DataAccessor.JsonAccessor.JsonAccessor import load_json, save_json
 
 
+DATABASE_PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+DATABASE_PRESETS = {
+    # Defaults of SQLite, except waiting for locks.
+    'safe': {
+        'journal_mode': 'delete', 'synchronous': 'full', 'cache_size': -2000,
+        'mmap_size': 0, 'temp_store': 'default', 'busy_timeout': 5000,
+    },
+    # WAL needs all connections on the same host, only for a DB not shared by syncing.
+    'fast-local': {
+        'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -64000,
+        'mmap_size': 268435456, 'temp_store': 'memory', 'busy_timeout': 5000,
+    },
+    # Single DB file for the sync client, and waiting long while it holds the file.
+    'synced-folder': {
+        'journal_mode': 'delete', 'synchronous': 'full', 'cache_size': -16000,
+        'mmap_size': 0, 'temp_store': 'memory', 'busy_timeout': 30000,
+    },
+}
+
+
 class Configure(object):
     def __init__(self, dir_path):
         super(Configure, self).__init__()
@@ -30,10 +51,51 @@ class Configure(object):
         save_json(self.dir_path + "ConfigUser.json", self.config)
 
     def __getitem__(self, name):
+        """ The user section merged over the default one, so values missing from the user one are the default. """
         try:
-            return self.config[name]
+            value = self.config[name]
         except KeyError:
             return self.default_config[name]
+        return _merge(self.default_config.get(name), value)
+
+    def get_database_pragmas(self):
+        """ Pragmas of the preset in section database, overridden by its pragmas. """
+        section = self['database']
+        preset = section['preset']
+        try:
+            pragmas = OrderedDict((name, DATABASE_PRESETS[preset][name]) for name in DATABASE_PRAGMAS)
+        except KeyError:
+            raise ValueError("Unknown database preset: %s" % preset)
+
+        for name, value in section['pragmas'].items():
+            if name not in pragmas:
+                raise ValueError("Unsupported database pragma: %s" % name)
+            pragmas[name] = value
+        return pragmas
+
+
+class AliasConfigure(object):
+    """ Alias rules of each group, reloaded when the file has been modified. """
+    def __init__(self, path):
+        super(AliasConfigure, self).__init__()
+        self.path = path
+        self.mtime = None
+        self.group_rules = defaultdict(dict)
+
+        self.reload()
+
+    def reload(self):
+        """ Returns True if the rules are reloaded. """
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+
+        self.group_rules = _convert_alias_group_rules(load_json(self.path))
+        self.mtime = mtime
+        return True
+
+    def __getitem__(self, group_id):
+        return self.group_rules[group_id]
 
 
 def get_matched_dir(path, project_dir_name="LifeRecorder"):
@@ -72,6 +134,106 @@ class _Test(unittest.TestCase):
             self.assert_get_matched_dir(self.EXPECT, project_dir_name="AAA")
 
 
+class _AliasConfigureTest(unittest.TestCase):
+    RAW = {'set': {'groups': [3], 'rule_categories': {'common': {'Name': ['nick']}}}}
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        save_json(self.path, self.RAW)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_reload_on_modified(self):
+        alias = AliasConfigure(self.path)
+        self.assertEqual({'Name': ['nick']}, alias[3])
+        self.assertFalse(alias.reload())
+
+        save_json(self.path, {'set': {'groups': [3], 'rule_categories': {'common': {'Other': ['o']}}}})
+        os.utime(self.path, ns=(alias.mtime + 1, alias.mtime + 1))
+        self.assertTrue(alias.reload())
+        self.assertEqual({'Other': ['o']}, alias[3])
+        self.assertEqual({}, alias[4])
+
+
+class _SectionTest(unittest.TestCase):
+    DEFAULT = {'working_copy': {'enabled': False, 'dir': '', 'push_seconds': 300},
+               'record_summary': {'engine': 'python', 'parallel': {'workers': 0, 'shard': 'year'}},
+               'db_path': 'Life.db'}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dir_path = self.dir.name + os.sep
+        save_json(self.dir_path + "ConfigDefault.json", self.DEFAULT)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_partial_sections(self):
+        save_json(self.dir_path + "ConfigUser.json", {'working_copy': {'enabled': True},
+                                                      'record_summary': {'parallel': {'workers': 2}},
+                                                      'db_path': 'Other.db'})
+        config_ = Configure(self.dir_path)
+        self.assertEqual({'enabled': True, 'dir': '', 'push_seconds': 300}, config_['working_copy'])
+        self.assertEqual({'engine': 'python', 'parallel': {'workers': 2, 'shard': 'year'}}, config_['record_summary'])
+        self.assertEqual('Other.db', config_['db_path'])
+        # The user config is saved as it is.
+        self.assertEqual({'enabled': True}, config_.config['working_copy'])
+
+    def test_missing(self):
+        config_ = Configure(self.dir_path)
+        self.assertEqual(self.DEFAULT['working_copy'], config_['working_copy'])
+        with self.assertRaises(KeyError):
+            config_['window']
+
+
+class _DatabasePragmasTest(unittest.TestCase):
+    DEFAULT = {'database': {'preset': 'synced-folder', 'pragmas': {}}}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dir_path = self.dir.name + os.sep
+        save_json(self.dir_path + "ConfigDefault.json", self.DEFAULT)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def get_pragmas(self, user_database=None):
+        if user_database is not None:
+            save_json(self.dir_path + "ConfigUser.json", {'database': user_database})
+        return Configure(self.dir_path).get_database_pragmas()
+
+    def test_default(self):
+        self.assertEqual(DATABASE_PRESETS['synced-folder'], dict(self.get_pragmas()))
+        self.assertEqual(list(DATABASE_PRAGMAS), list(self.get_pragmas()))
+
+    def test_user_preset_and_pragmas(self):
+        pragmas = self.get_pragmas({'preset': 'fast-local', 'pragmas': {'cache_size': -8000}})
+        self.assertEqual('wal', pragmas['journal_mode'])
+        self.assertEqual(-8000, pragmas['cache_size'])
+
+        pragmas = self.get_pragmas({'pragmas': {'busy_timeout': 100}})
+        self.assertEqual('delete', pragmas['journal_mode'])
+        self.assertEqual(100, pragmas['busy_timeout'])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.get_pragmas({'preset': 'fastest'})
+        with self.assertRaises(ValueError):
+            self.get_pragmas({'pragmas': {'foreign_keys': 1}})
+
+
+def _merge(default, value):
+    """ value with each missing key of dicts in it taken from default, recursively. """
+    if not isinstance(default, dict) or not isinstance(value, dict):
+        return value
+    merged = dict(default)
+    for key, each in value.items():
+        merged[key] = _merge(default.get(key), each)
+    return merged
+
+
 def _convert_alias_group_rules(raw_alias):
     result = defaultdict(dict)
     for rule_set in raw_alias.values():
@@ -91,5 +253,4 @@ else:
 
     config = Configure(dir_path)
 
-    raw = load_json(dir_path + "Alias.json")
-    group_alias_rules = _convert_alias_group_rules(raw)
+    group_alias_rules = AliasConfigure(dir_path + "Alias.json")
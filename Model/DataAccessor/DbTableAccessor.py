@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
 from peewee import *
 import datetime
+import logging
+import os
+import shutil
+import threading
 import unittest
 
 from Model.DataAccessor.DbAccessor.DbOrmAccessor import db, BaseModel
 from Model.DataAccessor.Configure import config
+from Model.DataAccessor.Migration import migrate
+from Model.DataAccessor.WorkingCopy import WorkingCopy, ConflictError
+from Model.DataAccessor import QueryInstrument
+
+ENV_DB_PATH = 'LIFERECORDER_DB_PATH'
+ENV_QUERY_INSTRUMENT = 'LIFERECORDER_QUERY_INSTRUMENT'
+ENV_QUERY_REPORT = 'LIFERECORDER_QUERY_REPORT'
+UNITTEST_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DbTableAccessorUnittest.db')
+
+working_copy = None
+_push_thread = None
 
 
 class Timeline(BaseModel):
@@ -30,6 +45,30 @@ class SleepDateView(BaseModel):
     count = IntegerField()
 
 
+class SleepRollup(BaseModel):
+    """
+    Sleep of each period, created by migration 2 and maintained by the triggers of table Sleep.
+    Daily: total/min/max of sessions, count of sessions, dated as SleepDateView.
+    Weekly and Monthly: total/min/max of daily totals, count of days.
+    """
+    period = TextField()  # value of DurationType
+    date = DateField()  # first date of the period
+    total = IntegerField()  # seconds
+    count = IntegerField()
+    minimum = IntegerField()
+    maximum = IntegerField()
+
+    class Meta:
+        indexes = (
+            (('period', 'date'), True),
+        )
+
+
+class RecordRevision(BaseModel):
+    """ A single row, counted up by triggers of migration 3 on every edit or delete of records and dates. """
+    revision = IntegerField()
+
+
 class RecordGroup(BaseModel):
     description = TextField(unique=True)
     alias = TextField(null=True)
@@ -87,6 +126,95 @@ class ExtraRecord(BaseModel):
         return "%s:%s" % (self.key[0:3], self.value)
 
 
+MODELS = (Timeline, Flesh, Sleep, SleepRollup, RecordRevision, RecordGroup, GroupRelation, BasicRecord, ExtraRecord)
+
+
+def open_unittest_copy(dir_path):
+    """ Migrated copy of the unittest DB in dir_path, for tests writing to a DB, e.g. with MODELS bound to it. """
+    path = os.path.join(dir_path, os.path.basename(UNITTEST_DB_PATH))
+    shutil.copyfile(UNITTEST_DB_PATH, path)
+    database = SqliteDatabase(path)
+    migrate(database)
+    return database
+
+
+def get_effective_pragmas(database, names):
+    return [(name, database.execute_sql('PRAGMA %s' % name).fetchone()[0]) for name in names]
+
+
+def log_pragmas():
+    """ Log the pragmas in effect, which may differ from config if SQLite refused. """
+    pragmas = get_effective_pragmas(db, config.get_database_pragmas())
+    logging.getLogger(__name__).info(
+        "SQLite %s: %s", db.database, ", ".join("%s=%s" % pragma for pragma in pragmas))
+
+
+def get_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'LifeRecorder')
+
+
+def get_working_copy_dir():
+    return config['working_copy']['dir'] or get_cache_dir()
+
+
+def push_working_copy():
+    """ Push the working copy if enabled, returns whether pushed. Failures are logged and retried on next push. """
+    if _push_thread is not None:
+        _push_thread.join()
+    return _push()
+
+
+def push_working_copy_in_background():
+    """
+    Push on another thread with its own connection, so the backup and hashing never block the GUI.
+    Returns whether started, skipped if the last push is still running.
+    """
+    global _push_thread
+    if working_copy is None or (_push_thread is not None and _push_thread.is_alive()):
+        return False
+    _push_thread = threading.Thread(target=_push_on_thread, name='push_working_copy', daemon=True)
+    _push_thread.start()
+    return True
+
+
+def _push_on_thread():
+    try:
+        _push()
+    finally:
+        db.close()
+
+
+def _push():
+    if working_copy is None:
+        return False
+    try:
+        pushed = working_copy.push(db.connection())
+    except (ConflictError, OSError) as ex:
+        logging.getLogger(__name__).warning("Working copy not pushed: %s", ex)
+        return False
+    if pushed:
+        logging.getLogger(__name__).info("Working copy pushed to %s", working_copy.remote_path)
+    return pushed
+
+
+def is_query_instrument_enabled():
+    """ Environment variable overrides config, 0 or empty to disable. """
+    if ENV_QUERY_INSTRUMENT in os.environ:
+        return os.environ[ENV_QUERY_INSTRUMENT] not in ('', '0')
+    return config['query_instrument']['enabled']
+
+
+def dump_query_report():
+    """ Write the report of instrumented queries if enabled, returns its path. """
+    if not QueryInstrument.instrument.enabled:
+        return None
+    path = (os.environ.get(ENV_QUERY_REPORT) or config['query_instrument']['report_path'] or
+            config.dir_path + "QueryReport.json")
+    QueryInstrument.instrument.dump(path)
+    logging.getLogger(__name__).info("Query report written to %s", path)
+    return path
+
+
 _test_data = {
     'record_group': ['讀書', '數學', '國文', '古典文學', '運動', '打坐']
 }
@@ -194,5 +322,15 @@ class _TableOperationTest(unittest.TestCase):
 if __name__ == "__main__":
     unittest.main()
 else:
-    db.init(config['db_path'])
+    # A DB given by the environment is used as is, e.g. by benchmarks.
+    db_path = os.environ.get(ENV_DB_PATH) or config['db_path']
+    if config['working_copy']['enabled'] and not os.environ.get(ENV_DB_PATH):
+        # Queries run on the local copy, raises ConflictError if both copies have changed since last sync.
+        working_copy = WorkingCopy(db_path, get_working_copy_dir())
+        db_path = working_copy.checkout()
+    # Pragmas are applied on every connection.
+    db.init(db_path, pragmas=list(config.get_database_pragmas().items()))
+    if is_query_instrument_enabled():
+        QueryInstrument.instrument.install(db)
     db.connect()
+    migrate(db)
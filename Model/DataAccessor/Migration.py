@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import unittest
+from collections import OrderedDict, namedtuple
+
+from peewee import SqliteDatabase
+
+# Schema version is kept in PRAGMA user_version,
+#   version N means the first N migrations have been applied.
+# Steps are SQL, or callables of the database for those depending on the schema.
+Migration = namedtuple('Migration', ['description', 'upgrade', 'downgrade'])
+
+# Sleeps belong to the date 14 hours before their end, as in SleepDateView.
+# Periods are values of DurationType, Weekly and Monthly rows summarize the daily totals.
+SLEEP_DATE = "strftime('%Y-%m-%d', {sleep}.end, '-14 hours')"
+SLEEP_PERIODS = (
+    ('Weekly', "date({date}, '-6 days', 'weekday 1')", "'+7 days'"),
+    ('Monthly', "date({date}, 'start of month')", "'+1 month'"),
+)
+SLEEP_ROLLUP_COLUMNS = 'SleepRollup (period, date, total, count, minimum, maximum)'
+
+REBUILD_SLEEP_ROLLUP = (
+    'DELETE FROM SleepRollup',
+    "INSERT INTO {0} SELECT 'Daily', {1} AS day, SUM(seconds), COUNT(*), MIN(seconds), MAX(seconds) "
+    "FROM (SELECT end, strftime('%s', end) - strftime('%s', start) AS seconds FROM Sleep) AS Sleep "
+    "GROUP BY day".format(SLEEP_ROLLUP_COLUMNS, SLEEP_DATE.format(sleep='Sleep')),
+) + tuple(
+    "INSERT INTO {0} SELECT '{1}', {2} AS start, SUM(total), COUNT(*), MIN(total), MAX(total) "
+    "FROM SleepRollup WHERE period = 'Daily' GROUP BY start".format(
+        SLEEP_ROLLUP_COLUMNS, period, get_start.format(date='date'))
+    for period, get_start, _ in SLEEP_PERIODS)
+
+
+def get_sleep_rollup_updates(sleep):
+    """ Statements summarizing again the periods of the sleep, NEW or OLD in a trigger. """
+    date = SLEEP_DATE.format(sleep=sleep)
+    statements = [
+        "DELETE FROM SleepRollup WHERE period = 'Daily' AND date = %s" % date,
+        # Sleeps of the date end in [date 14:00, date + 1 14:00), ranges use the index of end.
+        "INSERT INTO {0} SELECT * FROM (SELECT 'Daily', {1}, SUM(seconds), COUNT(*) AS count, MIN(seconds), "
+        "MAX(seconds) FROM (SELECT strftime('%s', end) - strftime('%s', start) AS seconds FROM Sleep "
+        "WHERE end >= datetime({1}, '+14 hours') AND end < datetime({1}, '+38 hours'))) WHERE count > 0".format(
+            SLEEP_ROLLUP_COLUMNS, date),
+    ]
+    for period, get_start, length in SLEEP_PERIODS:
+        start = get_start.format(date=date)
+        statements.append("DELETE FROM SleepRollup WHERE period = '%s' AND date = %s" % (period, start))
+        statements.append(
+            "INSERT INTO {0} SELECT * FROM (SELECT '{1}', {2}, SUM(total), COUNT(*) AS count, MIN(total), "
+            "MAX(total) FROM SleepRollup WHERE period = 'Daily' AND date >= {2} AND date < date({2}, {3})) "
+            "WHERE count > 0".format(SLEEP_ROLLUP_COLUMNS, period, start, length))
+    return statements
+
+
+def get_record_revision_triggers():
+    """ Triggers counting edits and deletes of records, which are not told by their max ids and counts. """
+    increment = ('UPDATE RecordRevision SET revision = revision + 1',)
+    return tuple(
+        create_trigger('%s_revision_%s' % (table.lower(), event.split()[0].lower()), '%s ON %s' % (event, table),
+                       increment)
+        for table, events in (('BasicRecord', ('UPDATE', 'DELETE')), ('ExtraRecord', ('UPDATE', 'DELETE')),
+                              ('Timeline', ('UPDATE OF date', 'DELETE')))
+        for event in events)
+
+
+def is_indexed(database, table, column, excluded=None):
+    """ Whether an index of table other than excluded starts with column, so lookups by column can use it. """
+    for row in database.execute_sql('PRAGMA index_list("%s")' % table).fetchall():
+        name = row[1]
+        if name != excluded:
+            first = database.execute_sql('PRAGMA index_info("%s")' % name).fetchone()
+            if first is not None and first[2] == column:
+                return True
+    return False
+
+
+def create_index_if_uncovered(name, table, column):
+    """ Step creating index name on column unless another index covers it, e.g. the unique one of peewee. """
+    def create(database):
+        if not is_indexed(database, table, column, excluded=name):
+            database.execute_sql('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (name, table, column))
+    return create
+
+
+def drop_index_if_covered(name, table, column):
+    def drop(database):
+        if is_indexed(database, table, column, excluded=name):
+            database.execute_sql('DROP INDEX IF EXISTS %s' % name)
+    return drop
+
+
+# Indexes of single columns, which peewee creates as unique ones for fields of unique=True.
+SINGLE_COLUMN_INDEXES = (
+    ('idx_timeline_date', 'Timeline', 'date'),
+    ('idx_sleep_start', 'Sleep', 'start'),
+    ('idx_sleep_end', 'Sleep', 'end'),
+)
+
+
+def create_trigger(name, event, statements):
+    return 'CREATE TRIGGER IF NOT EXISTS %s AFTER %s BEGIN %s; END' % (name, event, '; '.join(statements))
+
+
+MIGRATIONS = (
+    Migration(
+        description="Indexes of date, group, record and sleep lookups.",
+        # Prefixed not to be taken for the unique indexes peewee names e.g. timeline_date, which are kept,
+        # and only created without them.
+        upgrade=tuple(create_index_if_uncovered(*index) for index in SINGLE_COLUMN_INDEXES) + (
+            'CREATE INDEX IF NOT EXISTS idx_basicrecord_date_id_group_id ON BasicRecord (date_id, group_id)',
+            'CREATE INDEX IF NOT EXISTS basicrecord_group_id ON BasicRecord (group_id)',
+            'CREATE INDEX IF NOT EXISTS idx_extrarecord_basic_id_key_value ON ExtraRecord (basic_id, key, value)',
+            'CREATE INDEX IF NOT EXISTS idx_grouprelation_parent_id_child_id ON GroupRelation (parent_id, child_id)',
+            'CREATE INDEX IF NOT EXISTS idx_grouprelation_child_id_parent_id ON GroupRelation (child_id, parent_id)',
+            # Covered by the composite ones above.
+            'DROP INDEX IF EXISTS basicrecord_date_id',
+            'DROP INDEX IF EXISTS extrarecord_basic_id',
+            'DROP INDEX IF EXISTS grouprelation_parent_id',
+            'DROP INDEX IF EXISTS grouprelation_child_id',
+        ),
+        downgrade=(
+            'CREATE INDEX IF NOT EXISTS basicrecord_date_id ON BasicRecord (date_id)',
+            'CREATE INDEX IF NOT EXISTS extrarecord_basic_id ON ExtraRecord (basic_id)',
+            'CREATE INDEX IF NOT EXISTS grouprelation_parent_id ON GroupRelation (parent_id)',
+            'CREATE INDEX IF NOT EXISTS grouprelation_child_id ON GroupRelation (child_id)',
+            'DROP INDEX IF EXISTS idx_timeline_date',
+            'DROP INDEX IF EXISTS idx_basicrecord_date_id_group_id',
+            'DROP INDEX IF EXISTS idx_extrarecord_basic_id_key_value',
+            'DROP INDEX IF EXISTS idx_grouprelation_parent_id_child_id',
+            'DROP INDEX IF EXISTS idx_grouprelation_child_id_parent_id',
+            'DROP INDEX IF EXISTS idx_sleep_start',
+            'DROP INDEX IF EXISTS idx_sleep_end',
+        ),
+    ),
+    Migration(
+        description="Sleep of each period, built from Sleep and kept up to date by its triggers.",
+        upgrade=(
+            'CREATE TABLE IF NOT EXISTS SleepRollup (id INTEGER NOT NULL PRIMARY KEY, period TEXT NOT NULL, '
+            'date DATE NOT NULL, total INTEGER NOT NULL, count INTEGER NOT NULL, minimum INTEGER NOT NULL, '
+            'maximum INTEGER NOT NULL)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS sleeprollup_period_date ON SleepRollup (period, date)',
+            create_trigger('sleep_rollup_insert', 'INSERT ON Sleep', get_sleep_rollup_updates('NEW')),
+            create_trigger('sleep_rollup_delete', 'DELETE ON Sleep', get_sleep_rollup_updates('OLD')),
+            create_trigger('sleep_rollup_update', 'UPDATE OF start, end ON Sleep',
+                           get_sleep_rollup_updates('OLD') + get_sleep_rollup_updates('NEW')),
+        ) + REBUILD_SLEEP_ROLLUP,
+        downgrade=(
+            'DROP TRIGGER IF EXISTS sleep_rollup_insert',
+            'DROP TRIGGER IF EXISTS sleep_rollup_delete',
+            'DROP TRIGGER IF EXISTS sleep_rollup_update',
+            'DROP TABLE IF EXISTS SleepRollup',
+        ),
+    ),
+    Migration(
+        description="Revision of records, counted by triggers on edits and deletes.",
+        upgrade=(
+            'CREATE TABLE IF NOT EXISTS RecordRevision (id INTEGER NOT NULL PRIMARY KEY, '
+            'revision INTEGER NOT NULL)',
+            'INSERT OR IGNORE INTO RecordRevision (id, revision) VALUES (1, 0)',
+        ) + get_record_revision_triggers(),
+        downgrade=tuple(
+            'DROP TRIGGER IF EXISTS %s_revision_%s' % (table, event)
+            for table in ('basicrecord', 'extrarecord', 'timeline') for event in ('update', 'delete')
+        ) + ('DROP TABLE IF EXISTS RecordRevision',),
+    ),
+    Migration(
+        description="Indexes of single columns created beside the unique ones of the same columns.",
+        upgrade=tuple(drop_index_if_covered(*index) for index in SINGLE_COLUMN_INDEXES),
+        # Version 1 creates them only without the unique ones.
+        downgrade=(),
+    ),
+)
+
+# Queries run per date, record or group by the models.
+HOT_QUERIES = OrderedDict((
+    ('Timeline of date', "SELECT id FROM Timeline WHERE date = '2018-08-13'"),
+    ('BasicRecord of date', "SELECT id, group_id FROM BasicRecord WHERE date_id = 1"),
+    ('BasicRecord of group', "SELECT id FROM BasicRecord WHERE group_id = 1"),
+    ('ExtraRecord of record', "SELECT key, value FROM ExtraRecord WHERE basic_id = 1"),
+    ('parent of group', "SELECT parent_id FROM GroupRelation WHERE child_id = 1"),
+    ('children of group', "SELECT child_id FROM GroupRelation WHERE parent_id = 1"),
+    ('Sleep by start', "SELECT id FROM Sleep WHERE start = '2018-08-14 01:10:00'"),
+    ('Sleep by end', "SELECT id FROM Sleep WHERE end = '2018-08-14 08:20:00'"),
+))
+
+
+def get_version(database):
+    return database.execute_sql('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(database, target=len(MIGRATIONS)):
+    """
+    Upgrade or downgrade to version target, each version in its own transaction.
+    Returns the versions passed, empty when already at target.
+    """
+    version = get_version(database)
+    passed = []
+    while version != target:
+        if version < target:
+            statements, version = MIGRATIONS[version].upgrade, version + 1
+        else:
+            statements, version = MIGRATIONS[version - 1].downgrade, version - 1
+
+        with database.atomic():
+            for sql in statements:
+                if callable(sql):
+                    sql(database)
+                else:
+                    database.execute_sql(sql)
+            database.execute_sql('PRAGMA user_version = %d' % version)
+        passed.append(version)
+    return passed
+
+
+def explain_hot_queries(database):
+    return OrderedDict(
+        (name, [row[-1] for row in database.execute_sql('EXPLAIN QUERY PLAN ' + sql).fetchall()])
+        for name, sql in HOT_QUERIES.items())
+
+
+def get_query_plan_report(path):
+    """ Query plans before and after all migrations, compared on an in-memory copy of the DB at path. """
+    database = SqliteDatabase(':memory:')
+    source = sqlite3.connect(path)
+    try:
+        source.backup(database.connection())
+    finally:
+        source.close()
+
+    migrate(database, 0)
+    before = explain_hot_queries(database)
+    migrate(database)
+    after = explain_hot_queries(database)
+    database.close()
+
+    lines = []
+    for name in HOT_QUERIES:
+        lines.append(name)
+        lines.extend("  before: " + detail for detail in before[name])
+        lines.extend("  after:  " + detail for detail in after[name])
+    return lines
+
+
+class _MigrateTest(unittest.TestCase):
+    SCHEMA = (
+        'CREATE TABLE Timeline (id INTEGER NOT NULL PRIMARY KEY, date DATE NOT NULL)',
+        'CREATE TABLE Sleep (id INTEGER NOT NULL PRIMARY KEY, start DATETIME NOT NULL, end DATETIME NOT NULL)',
+        'CREATE TABLE GroupRelation (id INTEGER NOT NULL PRIMARY KEY, parent_id INTEGER NOT NULL, '
+        'child_id INTEGER NOT NULL)',
+        'CREATE TABLE BasicRecord (id INTEGER NOT NULL PRIMARY KEY, date_id INTEGER NOT NULL, '
+        'group_id INTEGER NOT NULL)',
+        'CREATE TABLE ExtraRecord (id INTEGER NOT NULL PRIMARY KEY, basic_id INTEGER NOT NULL, '
+        'key TEXT NOT NULL, value TEXT NOT NULL)',
+        'CREATE INDEX extrarecord_basic_id ON ExtraRecord (basic_id)',
+    )
+
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        for sql in self.SCHEMA:
+            self.database.execute_sql(sql)
+
+    def tearDown(self):
+        self.database.close()
+
+    def get_index_names(self):
+        return {row[0] for row in self.database.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    def test_migrate(self):
+        self.assertEqual(0, get_version(self.database))
+        self.assertEqual(list(range(1, len(MIGRATIONS) + 1)), migrate(self.database))
+        self.assertEqual(len(MIGRATIONS), get_version(self.database))
+        self.assertIn('idx_sleep_start', self.get_index_names())
+        self.assertNotIn('extrarecord_basic_id', self.get_index_names())
+
+    def test_migrate_idempotent(self):
+        migrate(self.database)
+        indexes = self.get_index_names()
+        self.assertEqual([], migrate(self.database))
+        self.assertEqual(indexes, self.get_index_names())
+
+    def test_downgrade(self):
+        migrate(self.database)
+        self.assertEqual(list(reversed(range(len(MIGRATIONS)))), migrate(self.database, 0))
+        # basicrecord_group_id is kept, existing DBs were created with it.
+        self.assertEqual({'extrarecord_basic_id', 'basicrecord_date_id', 'basicrecord_group_id',
+                          'grouprelation_parent_id', 'grouprelation_child_id'}, self.get_index_names())
+
+    def get_column_indexes(self, table, column):
+        return [row[1] for row in self.database.execute_sql('PRAGMA index_list("%s")' % table).fetchall()
+                if self.database.execute_sql('PRAGMA index_info("%s")' % row[1]).fetchone()[2] == column]
+
+    def test_unique_indexes_kept(self):
+        """ DBs created by peewee have unique indexes named after the columns, no other index duplicates them. """
+        unique = {'timeline_date': 'Timeline (date)', 'sleep_start': 'Sleep (start)', 'sleep_end': 'Sleep (end)'}
+        for name, columns in unique.items():
+            self.database.execute_sql('CREATE UNIQUE INDEX %s ON %s' % (name, columns))
+        migrate(self.database)
+        for name, table, column in SINGLE_COLUMN_INDEXES:
+            self.assertEqual(['%s_%s' % (table.lower(), column)], self.get_column_indexes(table, column))
+        migrate(self.database, 0)
+        self.assertTrue(set(unique) < self.get_index_names())
+
+    def test_duplicated_indexes_dropped(self):
+        """ Those created by version 1 beside the unique ones are dropped by the last version. """
+        migrate(self.database, len(MIGRATIONS) - 1)
+        self.database.execute_sql('CREATE UNIQUE INDEX timeline_date ON Timeline (date)')
+        self.assertEqual({'idx_timeline_date', 'timeline_date'}, set(self.get_column_indexes('Timeline', 'date')))
+        migrate(self.database)
+        self.assertEqual(['timeline_date'], self.get_column_indexes('Timeline', 'date'))
+        self.assertEqual(['idx_sleep_start'], self.get_column_indexes('Sleep', 'start'))
+
+    def test_hot_queries_use_index(self):
+        migrate(self.database)
+        for name, details in explain_hot_queries(self.database).items():
+            self.assertTrue(any('INDEX' in detail for detail in details), name)
+
+
+class _SleepRollupTest(unittest.TestCase):
+    FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DbTableAccessorUnittest.db')
+
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        source = sqlite3.connect(self.FIXTURE_PATH)
+        try:
+            source.backup(self.database.connection())
+        finally:
+            source.close()
+        migrate(self.database)
+
+    def tearDown(self):
+        self.database.close()
+
+    def get_rollup(self, period):
+        return self.database.execute_sql(
+            'SELECT date, total, count, minimum, maximum FROM SleepRollup WHERE period = ? ORDER BY date',
+            (period,)).fetchall()
+
+    def get_rollups(self):
+        return [self.get_rollup(period) for period in ('Daily', 'Weekly', 'Monthly')]
+
+    def assert_rebuilt(self):
+        """ Rollup kept by the triggers is the same as built again, and as SleepDateView. """
+        rollups = self.get_rollups()
+        with self.database.atomic():
+            for sql in REBUILD_SLEEP_ROLLUP:
+                self.database.execute_sql(sql)
+        self.assertEqual(self.get_rollups(), rollups)
+        view = self.database.execute_sql('SELECT date, duration, count FROM SleepDateView ORDER BY date').fetchall()
+        self.assertEqual(view, [(date, '%02d:%02d' % (total // 3600, total % 3600 // 60), count)
+                                for date, total, count, _, _ in rollups[0]])
+
+    def test_same_as_view(self):
+        self.assertEqual(7, len(self.get_rollup('Daily')))
+        self.assert_rebuilt()
+        daily = self.get_rollup('Daily')
+        self.assertEqual([('2018-08-13', sum(row[1] for row in daily), 7, 23100, 31800)], self.get_rollup('Weekly'))
+        self.assertEqual([('2018-08-01', sum(row[1] for row in daily), 7, 23100, 31800)], self.get_rollup('Monthly'))
+
+    def test_afternoon_end(self):
+        """ Sleeps ending between 14:00 and 17:00 are on their own date, as in SleepDateView. """
+        self.database.execute_sql(
+            "INSERT INTO Sleep (start, end) VALUES ('2018-08-21 14:10:00', '2018-08-21 15:00:00')")
+        self.assertEqual(('2018-08-21', 3000, 1, 3000, 3000), self.get_rollup('Daily')[-1])
+        self.assert_rebuilt()
+
+    def test_triggers(self):
+        self.database.execute_sql(
+            "INSERT INTO Sleep (start, end) VALUES ('2018-08-31 23:00:00', '2018-09-01 07:00:00')")
+        self.assertEqual(('2018-08-31', 28800, 1, 28800, 28800), self.get_rollup('Daily')[-1])
+        self.assertEqual(('2018-08-27', 28800, 1, 28800, 28800), self.get_rollup('Weekly')[-1])
+        self.assert_rebuilt()
+
+        self.database.execute_sql("UPDATE Sleep SET end = '2018-08-14 09:20:00' WHERE id = 0")
+        self.database.execute_sql("UPDATE Sleep SET start = '2018-09-01 00:00:00' WHERE start = '2018-08-31 23:00:00'")
+        self.assert_rebuilt()
+
+        self.database.execute_sql("DELETE FROM Sleep WHERE id IN (6, 7)")
+        self.database.execute_sql("DELETE FROM Sleep WHERE start = '2018-09-01 00:00:00'")
+        self.assertEqual(['2018-08-13'], [row[0] for row in self.get_rollup('Weekly')])
+        self.assert_rebuilt()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+import datetime
+import functools
+import json
+import threading
+import time
+import unittest
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from peewee import SqliteDatabase
+
+NO_SCOPE = '(none)'
+
+
+class _Query(object):
+    """ Statements of the same SQL in a scope, many of them in one call is a sign of N+1. """
+    __slots__ = ('count', 'seconds', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class _Statement(object):
+    __slots__ = ('sql', 'params', 'seconds', 'rows', 'thread', 'query')
+
+    def __init__(self, sql, params, query):
+        self.sql = sql
+        self.params = params
+        self.seconds = 0.0
+        self.rows = 0
+        self.thread = threading.current_thread().name
+        self.query = query
+
+
+class _Scope(object):
+    __slots__ = ('calls', 'statements', 'queries')
+
+    def __init__(self):
+        self.calls = 0
+        self.statements = []
+        self.queries = OrderedDict()  # sql: _Query
+
+
+class _CountingCursor(object):
+    """ Counts rows and time of fetching, SQLite steps through the rows while fetching them. """
+    def __init__(self, cursor, statement, instrument):
+        self._cursor = cursor
+        self._statement = statement
+        self._instrument = instrument
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._instrument.add(self._statement, 0 if row is None else 1, time.perf_counter() - started)
+        return row
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(*args)
+        self._instrument.add(self._statement, len(rows), time.perf_counter() - started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._instrument.add(self._statement, len(rows), time.perf_counter() - started)
+        return rows
+
+
+class QueryInstrument(object):
+    """
+    Records SQL, parameters, duration and row count of statements executed by Database.execute_sql,
+    grouped by the scope entered on the executing thread.
+    Statements on cursors taken directly from the database are not recorded.
+    """
+    MAX_STATEMENTS = 1000  # per scope, queries are still summarized beyond it
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._scopes = OrderedDict()
+        self._database = None
+
+    @property
+    def enabled(self):
+        return self._database is not None
+
+    def install(self, database):
+        if self.enabled:
+            raise RuntimeError("Already installed on %s." % self._database.database)
+        self._database = database
+        execute_sql = database.execute_sql
+
+        def instrumented_execute_sql(sql, params=None, *args, **kwargs):
+            return self._execute(execute_sql, sql, params, *args, **kwargs)
+        database.execute_sql = instrumented_execute_sql
+
+    def uninstall(self):
+        if self.enabled:
+            del self._database.execute_sql
+            self._database = None
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+
+    def get_scope_path(self):
+        """ Names of the entered scopes on this thread, joined by '/'. """
+        stack = getattr(self._local, 'stack', None)
+        return "/".join(stack) if stack else NO_SCOPE
+
+    @contextmanager
+    def scope(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        try:
+            with self._lock:
+                self._get_scope(self.get_scope_path()).calls += 1
+            yield
+        finally:
+            stack.pop()
+
+    @contextmanager
+    def _restore_scope(self, path):
+        """ Enter the scope path captured on another thread, without counting a call. """
+        stack = self._local.__dict__.setdefault('stack', [])
+        saved = stack[:]
+        stack[:] = [] if path == NO_SCOPE else [path]
+        try:
+            yield
+        finally:
+            stack[:] = saved
+
+    def bind_scope(self, function):
+        """ Function running in the current scope, on whatever thread it is called. """
+        if not self.enabled:
+            return function
+        path = self.get_scope_path()
+
+        @functools.wraps(function)
+        def bound(*args, **kwargs):
+            with self._restore_scope(path):
+                return function(*args, **kwargs)
+        return bound
+
+    def add(self, statement, rows, seconds):
+        with self._lock:
+            statement.rows += rows
+            statement.seconds += seconds
+            statement.query.rows += rows
+            statement.query.seconds += seconds
+
+    def _execute(self, execute_sql, sql, params, *args, **kwargs):
+        with self._lock:
+            scope = self._get_scope(self.get_scope_path())
+            query = scope.queries.setdefault(sql, _Query())
+            query.count += 1
+            statement = _Statement(sql, params, query)
+            if len(scope.statements) < self.MAX_STATEMENTS:
+                scope.statements.append(statement)
+
+        started = time.perf_counter()
+        try:
+            cursor = execute_sql(sql, params, *args, **kwargs)
+        finally:
+            self.add(statement, 0, time.perf_counter() - started)
+        # rowcount is the changed rows of DML, and -1 of queries whose rows are counted while fetching.
+        self.add(statement, max(cursor.rowcount, 0), 0)
+        return _CountingCursor(cursor, statement, self)
+
+    def _get_scope(self, path):
+        try:
+            return self._scopes[path]
+        except KeyError:
+            self._scopes[path] = _Scope()
+            return self._scopes[path]
+
+    def get_report(self):
+        """ Scopes ordered by their time, each with its queries ordered by count and its statements. """
+        with self._lock:
+            scopes = []
+            for path, scope in self._scopes.items():
+                count = sum(query.count for query in scope.queries.values())
+                scopes.append(OrderedDict((
+                    ('scope', path),
+                    ('calls', scope.calls),
+                    ('statements', count),
+                    ('statements_per_call', count / scope.calls if scope.calls else None),
+                    ('ms', sum(query.seconds for query in scope.queries.values()) * 1000),
+                    ('rows', sum(query.rows for query in scope.queries.values())),
+                    ('queries', [
+                        OrderedDict((('sql', sql), ('count', query.count),
+                                     ('ms', query.seconds * 1000), ('rows', query.rows)))
+                        for sql, query in sorted(scope.queries.items(), key=lambda item: -item[1].count)]),
+                    ('log', [
+                        OrderedDict((('sql', statement.sql), ('params', statement.params),
+                                     ('ms', statement.seconds * 1000), ('rows', statement.rows),
+                                     ('thread', statement.thread)))
+                        for statement in scope.statements]),
+                )))
+        scopes.sort(key=lambda scope: -scope['ms'])
+        return OrderedDict((
+            ('generated', datetime.datetime.now().isoformat()),
+            ('database', self._database.database if self.enabled else None),
+            ('scopes', scopes),
+        ))
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.get_report(), file, ensure_ascii=False, indent=2, default=str)
+
+
+instrument = QueryInstrument()
+
+
+def scope(name):
+    """ Group statements executed within it on this thread under name. """
+    return instrument.scope(name)
+
+
+def scoped(function):
+    """ Run the function in a scope named by its qualified name, e.g. FilterProxyModel.set_duration. """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with instrument.scope(function.__qualname__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def bind_scope(function):
+    return instrument.bind_scope(function)
+
+
+class _QueryInstrumentTest(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.database.execute_sql('CREATE TABLE Timeline (id INTEGER PRIMARY KEY, date TEXT)')
+        self.instrument = QueryInstrument()
+        self.instrument.install(self.database)
+
+    def tearDown(self):
+        self.instrument.uninstall()
+        self.database.close()
+
+    def get_scopes(self):
+        return {scope['scope']: scope for scope in self.instrument.get_report()['scopes']}
+
+    def test_scopes(self):
+        with self.instrument.scope('add'):
+            for date in ('2018-08-14', '2018-08-15', '2018-08-16'):
+                self.database.execute_sql('INSERT INTO Timeline (date) VALUES (?)', (date,))
+        for _ in range(2):
+            with self.instrument.scope('show'):
+                with self.instrument.scope('fetch'):
+                    self.assertEqual(3, len(self.database.execute_sql('SELECT * FROM Timeline').fetchall()))
+        self.database.execute_sql('SELECT 1')
+
+        scopes = self.get_scopes()
+        self.assertEqual(['(none)', 'add', 'show', 'show/fetch'], sorted(scopes))
+        self.assertEqual((1, 3, 3), (scopes['add']['calls'], scopes['add']['statements'], scopes['add']['rows']))
+        self.assertEqual(('2018-08-16',), scopes['add']['log'][2]['params'])
+        self.assertEqual((2, 2, 6, 1.0), (scopes['show/fetch']['calls'], scopes['show/fetch']['statements'],
+                                          scopes['show/fetch']['rows'], scopes['show/fetch']['statements_per_call']))
+        self.assertEqual(0, scopes['show']['statements'])
+        self.assertEqual(2, scopes['show/fetch']['queries'][0]['count'])
+
+    def test_rows_of_iterated_cursor(self):
+        self.database.execute_sql("INSERT INTO Timeline (date) VALUES ('2018-08-14'), ('2018-08-15')")
+        with self.instrument.scope('read'):
+            self.assertEqual(2, len(list(self.database.execute_sql('SELECT * FROM Timeline'))))
+        self.assertEqual(2, self.get_scopes()['read']['rows'])
+
+    def test_bind_scope(self):
+        with self.instrument.scope('add'):
+            function = self.instrument.bind_scope(lambda: self.database.execute_sql('SELECT 1'))
+        thread = threading.Thread(target=function)
+        thread.start()
+        thread.join()
+        self.assertEqual((1, 1), (self.get_scopes()['add']['calls'], self.get_scopes()['add']['statements']))
+
+    def test_uninstalled(self):
+        self.instrument.uninstall()
+        with self.instrument.scope('add'):
+            self.database.execute_sql('SELECT 1')
+        self.assertEqual([], self.instrument.get_report()['scopes'])
+
+
+if __name__ == "__main__":
+    unittest.main()
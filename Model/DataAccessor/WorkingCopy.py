@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+
+class ConflictError(Exception):
+    pass
+
+
+class WorkingCopy(object):
+    """
+    Local copy of a DB file in a synced folder, queries run on the copy and changes are pushed back.
+    The state of the last sync is kept beside the copy, pushing is refused if the remote changed since then.
+    Contents are compared by the hash of their backup, which is the same for the same content.
+    """
+    def __init__(self, remote_path, local_dir):
+        super().__init__()
+        self.remote_path = remote_path
+        self.local_path = os.path.join(local_dir, os.path.basename(remote_path))
+        self.state_path = self.local_path + '.sync.json'
+
+    def checkout(self):
+        """
+        Copy the remote to local, unless the local one has changes not pushed yet.
+        Returns the path of the local copy, raises ConflictError if both have changed.
+        The local copy is used if the remote is missing, e.g. while the synced folder is not mounted,
+        raises FileNotFoundError if neither exists.
+        """
+        if not os.path.exists(self.remote_path):
+            if not os.path.exists(self.local_path):
+                raise FileNotFoundError("%s is missing and no working copy of it is in %s, "
+                                        "check db_path and working_copy.dir of the config." % (
+                                            self.remote_path, os.path.dirname(self.local_path)))
+            logging.getLogger(__name__).warning("%s is missing, working copy %s is used.",
+                                                self.remote_path, self.local_path)
+            return self.local_path
+
+        state = self._load_state()
+        if state is not None and os.path.exists(self.local_path):
+            local_changed = self._get_snapshot_sha1(self.local_path) != state['snapshot_sha1']
+            remote_changed = not self._is_remote_unchanged(state)
+            if local_changed and remote_changed:
+                raise ConflictError("Both %s and %s have changed since last sync." % (
+                    self.local_path, self.remote_path))
+            elif local_changed or not remote_changed:
+                return self.local_path
+
+        os.makedirs(os.path.dirname(self.local_path), exist_ok=True)
+        remote = self._get_fingerprint(self.remote_path)
+        temp_path = self._backup_file(self.remote_path, os.path.dirname(self.local_path))
+        if self._get_fingerprint(self.remote_path) != remote:
+            os.remove(temp_path)
+            raise ConflictError("%s changed while copying." % self.remote_path)
+        os.replace(temp_path, self.local_path)
+        self._save_state(remote, self._get_sha1(self.local_path))
+        return self.local_path
+
+    def push(self, connection):
+        """
+        Push the content of connection to the remote if changed, returns whether pushed.
+        Raises ConflictError if the remote changed since last sync, the content is kept beside the local copy.
+        Once conflicted, raises at once without pushing until the conflict file is removed.
+        """
+        state = self._load_state()
+        conflict_path = state.get('conflict_path')
+        if conflict_path is not None and os.path.exists(conflict_path):
+            raise ConflictError("%s changed since last sync, not pushed until %s is resolved and removed." % (
+                self.remote_path, conflict_path))
+
+        snapshot_path = self._backup(connection, os.path.dirname(self.local_path))
+        try:
+            snapshot_sha1 = self._get_sha1(snapshot_path)
+            if snapshot_sha1 == state['snapshot_sha1']:
+                return False
+            if not self._is_remote_unchanged(state):
+                conflict_path = "%s.conflict-%s.db" % (
+                    os.path.splitext(self.local_path)[0], datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+                os.replace(snapshot_path, conflict_path)
+                self._save_state(state['remote'], state['snapshot_sha1'], conflict_path)
+                raise ConflictError("%s changed since last sync, local content is kept in %s." % (
+                    self.remote_path, conflict_path))
+
+            # Replaced at once, the remote is never partially written.
+            remote_dir, remote_name = os.path.split(self.remote_path)
+            handle, temp_path = tempfile.mkstemp(prefix='.%s.' % remote_name, dir=remote_dir)
+            with os.fdopen(handle, 'wb') as temp, open(snapshot_path, 'rb') as snapshot:
+                shutil.copyfileobj(snapshot, temp)
+                temp.flush()
+                os.fsync(temp.fileno())
+            shutil.copymode(self.remote_path, temp_path)
+            os.replace(temp_path, self.remote_path)
+            self._save_state(self._get_fingerprint(self.remote_path), snapshot_sha1)
+            return True
+        finally:
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+    def _is_remote_unchanged(self, state):
+        remote = self._get_fingerprint(self.remote_path, with_sha1=False)
+        if (remote['mtime_ns'], remote['size']) == (state['remote']['mtime_ns'], state['remote']['size']):
+            return True
+        return self._get_sha1(self.remote_path) == state['remote']['sha1']
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _save_state(self, remote, snapshot_sha1, conflict_path=None):
+        state = {'remote': remote, 'snapshot_sha1': snapshot_sha1}
+        if conflict_path is not None:
+            state['conflict_path'] = conflict_path
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(temp_path, self.state_path)
+
+    @classmethod
+    def _get_fingerprint(cls, path, with_sha1=True):
+        stat = os.stat(path)
+        fingerprint = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        if with_sha1:
+            fingerprint['sha1'] = cls._get_sha1(path)
+        return fingerprint
+
+    @classmethod
+    def _get_snapshot_sha1(cls, path):
+        snapshot_path = cls._backup_file(path, os.path.dirname(path))
+        try:
+            return cls._get_sha1(snapshot_path)
+        finally:
+            os.remove(snapshot_path)
+
+    @classmethod
+    def _backup_file(cls, path, dir_path):
+        connection = sqlite3.connect(path)
+        try:
+            return cls._backup(connection, dir_path)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _backup(connection, dir_path):
+        """ Backup to a temp file in dir_path, returns its path. """
+        handle, path = tempfile.mkstemp(suffix='.db', dir=dir_path)
+        os.close(handle)
+        target = sqlite3.connect(path)
+        try:
+            connection.backup(target)
+        finally:
+            target.close()
+        return path
+
+    @staticmethod
+    def _get_sha1(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+
+class _WorkingCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.remote_path = os.path.join(self.dir.name, 'remote', 'Life.db')
+        os.makedirs(os.path.dirname(self.remote_path))
+        self.execute(self.remote_path, 'CREATE TABLE Timeline (id INTEGER PRIMARY KEY, date TEXT)',
+                     "INSERT INTO Timeline (date) VALUES ('2018-08-14')")
+        self.copy = WorkingCopy(self.remote_path, os.path.join(self.dir.name, 'local'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    @staticmethod
+    def execute(path, *statements):
+        connection = sqlite3.connect(path)
+        for sql in statements:
+            connection.execute(sql)
+        connection.commit()
+        connection.close()
+
+    @staticmethod
+    def count(path):
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute('SELECT COUNT(*) FROM Timeline').fetchone()[0]
+        finally:
+            connection.close()
+
+    def push(self):
+        connection = sqlite3.connect(self.copy.local_path)
+        try:
+            return self.copy.push(connection)
+        finally:
+            connection.close()
+
+    def test_checkout_and_push(self):
+        local_path = self.copy.checkout()
+        self.assertEqual(1, self.count(local_path))
+        self.assertFalse(self.push())
+
+        self.execute(local_path, "INSERT INTO Timeline (date) VALUES ('2018-08-15')")
+        self.assertTrue(self.push())
+        self.assertEqual(2, self.count(self.remote_path))
+        self.assertFalse(self.push())
+        self.assertEqual(['Life.db'], os.listdir(os.path.dirname(self.remote_path)))
+
+    def test_checkout_keeps_local_changes(self):
+        local_path = self.copy.checkout()
+        self.execute(local_path, "INSERT INTO Timeline (date) VALUES ('2018-08-15')")
+        self.assertEqual(local_path, self.copy.checkout())
+        self.assertEqual(2, self.count(local_path))
+
+    def test_checkout_remote_changes(self):
+        self.copy.checkout()
+        self.execute(self.remote_path, "INSERT INTO Timeline (date) VALUES ('2018-08-16')")
+        self.assertEqual(2, self.count(self.copy.checkout()))
+
+    def test_checkout_missing_remote(self):
+        local_path = self.copy.checkout()
+        self.execute(local_path, "INSERT INTO Timeline (date) VALUES ('2018-08-15')")
+        os.remove(self.remote_path)
+        with self.assertLogs(__name__, 'WARNING'):
+            self.assertEqual(local_path, self.copy.checkout())
+        self.assertEqual(2, self.count(local_path))
+
+        os.remove(local_path)
+        with self.assertRaisesRegex(FileNotFoundError, 'working_copy.dir'):
+            self.copy.checkout()
+
+    def test_conflict(self):
+        local_path = self.copy.checkout()
+        self.execute(local_path, "INSERT INTO Timeline (date) VALUES ('2018-08-15')")
+        self.execute(self.remote_path, "INSERT INTO Timeline (date) VALUES ('2018-08-16')")
+
+        with self.assertRaises(ConflictError):
+            self.push()
+        self.assertEqual(2, self.count(self.remote_path))
+        with self.assertRaises(ConflictError):
+            self.copy.checkout()
+        self.assertEqual(2, self.count(local_path))
+
+    def test_conflict_stops_pushing(self):
+        local_path = self.copy.checkout()
+        self.execute(local_path, "INSERT INTO Timeline (date) VALUES ('2018-08-15')")
+        self.execute(self.remote_path, "INSERT INTO Timeline (date) VALUES ('2018-08-16')")
+        for _ in range(3):
+            with self.assertRaises(ConflictError):
+                self.push()
+        local_dir = os.path.dirname(local_path)
+        conflict_names = [name for name in os.listdir(local_dir) if '.conflict-' in name]
+        self.assertEqual(1, len(conflict_names))
+        self.assertEqual(2, self.count(os.path.join(local_dir, conflict_names[0])))
+
+        # Resolved by merging the conflict file to the remote, then removing it with the local copy.
+        os.remove(os.path.join(local_dir, conflict_names[0]))
+        os.remove(local_path)
+        self.assertEqual(2, self.count(self.copy.checkout()))
+        self.execute(local_path, "INSERT INTO Timeline (date) VALUES ('2018-08-17')")
+        self.assertTrue(self.push())
+        self.assertEqual(3, self.count(self.remote_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
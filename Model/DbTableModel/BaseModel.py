@@ -4,6 +4,7 @@ from enum import Enum
 from collections import OrderedDict
 import unittest
 
+from Model.TimeUtility import get_next_week_start, get_next_month_start
 from Model.DataAccessor.DbTableAccessor import fn
 
 
@@ -19,10 +20,26 @@ class BaseModel(object):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def get_column_keys(cls, *args):
+        """ Passed to get_record_attr per column, same as the names by default. """
+        return cls.get_column_names(*args)
+
     @classmethod
     def get_data(cls, *args):
         return cls._select()
 
+    @classmethod
+    def get_data_chunk(cls, last_id, size, *args, descending=False):
+        """ Keyset pagination of get_data, at most size records with id after last_id, or before it if descending. """
+        if descending:
+            query = cls.get_data(*args).order_by(cls.ACCESSOR.id.desc()).limit(size)
+            return query if last_id is None else query.where(cls.ACCESSOR.id < last_id)
+        query = cls.get_data(*args).order_by(cls.ACCESSOR.id).limit(size)
+        if last_id is not None:
+            query = query.where(cls.ACCESSOR.id > last_id)
+        return query
+
     @classmethod
     def get_record_attr(cls, record, attr):
         return getattr(record, attr)
@@ -78,6 +95,18 @@ class DurationalColumnModel(BaseModel):
         else:
             raise NotImplementedError
 
+    @staticmethod
+    def get_period_cutoff(duration, date_start):
+        """ The earliest date of periods which start on or after date_start. """
+        if date_start is None or duration is DurationType.DAILY:
+            return date_start
+        elif duration is DurationType.WEEKLY:
+            return get_next_week_start(date_start)
+        elif duration is DurationType.MONTHLY:
+            return get_next_month_start(date_start)
+        else:
+            raise KeyError
+
 
 class DurationModel(DurationalColumnModel):
     # Used on get_columns_definition, _get_select_group_conditions.
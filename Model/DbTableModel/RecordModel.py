@@ -1,27 +1,91 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from collections import OrderedDict
-from enum import Enum
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, groupby
 import datetime
-import re
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+import unittest.mock
+import weakref
 
-from Model.TimeUtility import get_week_start, get_month_start
+try:
+    import numpy as np
+except ImportError:  # optional, only used by the 'numpy' engine of record_summary
+    np = None
+
+from Model.TimeUtility import get_week_start, get_month_start, get_next_month_start
+from Model.SummaryUtility import ExtraRecordType, SummaryCell, DescriptionSummarizer, summarize_shard
+from Model import SummaryUtility
 from Model import Utility
-from Model.DbTableModel.BaseModel import BaseModel, DurationType, DurationalColumnModel
-from Model.DataAccessor.DbTableAccessor import DoesNotExist
+from Model.AliasUtility import AliasEngine
+from Model.DbTableModel.BaseModel import BaseModel, DurationType, DurationalColumnModel, Func
+from Model.DataAccessor.DbTableAccessor import DoesNotExist, JOIN, Case, Window, fn, get_cache_dir
 from Model.DataAccessor.DbTableAccessor import RecordGroup, GroupRelation, BasicRecord, ExtraRecord, Timeline
-from Model.DataAccessor.Configure import group_alias_rules
+from Model.DataAccessor.DbTableAccessor import RecordRevision, MODELS, open_unittest_copy
+from Model.DataAccessor.Configure import config, group_alias_rules
+from Model.DataAccessor.QueryInstrument import QueryInstrument
 
 
 class RecordUtility(object):
     class Group(object):
         # cache, should be updated on DB changed
         _record_groups = {group.id: group for group in RecordGroup.select()}
+        _description_ids = {group.description: id_ for id_, group in _record_groups.items()}
+        # cache of RecordUtility.Hierarchy, loaded on first use
+        _hierarchy = None
 
         @classmethod
-        def update_cache(cls):
-            cls._record_groups = {group.id: group for group in RecordGroup.select()}
+        def update_cache(cls, cache=None):
+            """
+            :param cache: returned by load_cache, e.g. on the writer thread so the GUI thread doesn't query.
+                          None to load it here.
+            """
+            groups, hierarchy = cls.load_cache() if cache is None else cache
+            cls._record_groups = {group.id: group for group in groups}
+            cls._description_ids = {group.description: id_ for id_, group in cls._record_groups.items()}
+            cls._hierarchy = hierarchy
+            RecordUtility.Alias.update_cache()
+
+        @classmethod
+        def load_cache(cls):
+            """ (RecordGroup rows, Hierarchy) read from DB, only set by update_cache. """
+            return list(RecordGroup.select()), cls._load_hierarchy()
+
+        @classmethod
+        def get_hierarchy(cls):
+            if cls._hierarchy is None:
+                cls._hierarchy = cls._load_hierarchy()
+            return cls._hierarchy
+
+        @staticmethod
+        def _load_hierarchy():
+            relations = (GroupRelation
+                         .select(GroupRelation.parent, GroupRelation.child)
+                         .order_by(GroupRelation.id)
+                         .tuples())
+            return RecordUtility.Hierarchy(relations)
+
+        @classmethod
+        def get_group(cls, group_id):
+            return cls._record_groups[group_id]
+
+        @classmethod
+        def get_groups(cls):
+            return cls._record_groups.values()
+
+        @classmethod
+        def get_ids(cls):
+            return cls._record_groups.keys()
 
         @classmethod
         def get_description(cls):
@@ -34,18 +98,26 @@ class RecordUtility(object):
 
         @classmethod
         def get_id_by_description(cls, description):
-            try:
-                return next((id_ for id_, record in cls._record_groups.items()
-                             if record.description == description))
-            except StopIteration:
-                raise KeyError(description)
+            return cls._description_ids[description]
 
         @classmethod
         def get_parent(cls, current_id):
-            return cls._record_groups[current_id].parent
+            parent_id = cls.get_hierarchy().get_parent_id(current_id)
+            return None if parent_id is None else cls._record_groups[parent_id]
+
+        @classmethod
+        def get_children(cls, current_id):
+            return tuple(cls._record_groups[id_] for id_ in cls.get_hierarchy().get_children_ids(current_id))
 
         @classmethod
         def add(cls, description, parent_id=-1):
+            group = cls.create(description, parent_id)
+            cls.update_cache()
+            return group
+
+        @classmethod
+        def create(cls, description, parent_id=-1):
+            """ Insert the group without updating the cache, which is left to the caller. """
             with RecordGroup.atomic() as transaction:
                 try:
                     group = RecordGroupModel.create(description=description)
@@ -54,14 +126,93 @@ class RecordUtility(object):
                 except ValueError as ex:
                     transaction.rollback()
                     raise ex
-            cls.update_cache()
             return group
 
         @classmethod
         def _add_relation(cls, parent_id, child_group):
             GroupRelation.create(parent=parent_id, child=child_group)
 
+    class Hierarchy(object):
+        """ Index of parent and children among RecordGroup, built from GroupRelation once. """
+        def __init__(self, relations):
+            """
+            :param relations: (parent_id, child_id) in the order of GroupRelation.
+            """
+            self._parent = {}
+            self._children = defaultdict(list)
+            for parent_id, child_id in relations:
+                self._parent.setdefault(child_id, parent_id)  # Except at most one parent
+                self._children[parent_id].append(child_id)
+
+            self._level = {}
+            for group_id in self._children.keys() | self._parent.keys():
+                self._level[group_id] = len(self.get_ancestor_ids(group_id))
+
+        def get_parent_id(self, group_id):
+            return self._parent.get(group_id)
+
+        def get_children_ids(self, group_id):
+            return tuple(self._children.get(group_id, ()))
+
+        def get_level(self, group_id):
+            """ Base-group is level 0. """
+            return self._level.get(group_id, 0)
+
+        def get_ancestor_ids(self, group_id):
+            """ From parent to base-group. """
+            ancestors = []
+            parent_id = self._parent.get(group_id)
+            while parent_id is not None and parent_id not in ancestors:
+                ancestors.append(parent_id)
+                parent_id = self._parent.get(parent_id)
+            return ancestors
+
+        def get_descendant_ids(self, group_id):
+            """ In the pre-order as shown in a tree. """
+            descendants = []
+            stack = list(reversed(self._children.get(group_id, ())))
+            while stack:
+                current = stack.pop()
+                descendants.append(current)
+                stack.extend(reversed(self._children.get(current, ())))
+            return descendants
+
     class Basic:
+        # Records inserted per transaction by create_many.
+        BULK_CHUNK = 100
+        # ExtraRecord rows per insert, 3 variables each are under the 999 of SQLite before 3.32.
+        EXTRA_CHUNK = 300
+        # Weak references of bound methods called with RecordRow committed by create_with_extras and create_many.
+        _listeners = []
+
+        @classmethod
+        def add_listener(cls, method):
+            """
+            method([RecordRow, ...]) is called after the records are committed, on the thread creating them.
+            Extras are (key, value) as stored. Only a weak reference is kept, so it can't be a function.
+            """
+            cls._listeners.append(weakref.WeakMethod(method))
+
+        @classmethod
+        def remove_listener(cls, method):
+            cls._listeners[:] = [listener for listener in cls._listeners if listener() not in (None, method)]
+
+        @classmethod
+        def _notify(cls, rows):
+            listeners = [listener() for listener in cls._listeners]
+            listeners = [listener for listener in listeners if listener is not None]
+            if listeners:
+                Utility.on_commit(lambda: [listener(rows) for listener in listeners])
+
+        @staticmethod
+        def get_version():
+            """
+            (max id, count) of BasicRecord and ExtraRecord, and the RecordRevision of edits and deletes.
+            Changed by records added, edited or removed, also by other programs.
+            """
+            return tuple(model.select(fn.MAX(model.id), fn.COUNT(model.id)).tuples().get()
+                         for model in (BasicRecord, ExtraRecord)) + (RecordRevision.get_by_id(1).revision,)
+
         @staticmethod
         def create(date, group_id):
             date_id = Utility.get_or_create_date_id(date)
@@ -69,16 +220,56 @@ class RecordUtility(object):
 
         @staticmethod
         def create_with_extras(date, group_id, extras):
-            with RecordGroup.atomic() as txn:
+            with Utility.atomic() as txn:
                 try:
                     basic_id = RecordUtility.Basic.create(date, group_id)
-                    for extra in extras:
-                        RecordUtility.Extra.create(basic_id, extra[0], extra[1])
+                    created = [RecordUtility.Extra.create(basic_id, extra[0], extra[1]) for extra in extras]
+                    RecordUtility.Basic._notify([RecordRow(
+                        date.date if isinstance(date, Timeline) else date, group_id,
+                        tuple((extra.key, extra.value) for extra in created))])
                     return basic_id
                 except ValueError as ex:
                     txn.rollback()
                     raise ex
 
+        @staticmethod
+        def _insert_basics(rows):
+            """
+            Insert (date_id, group_id) in one statement, returns ids of them in order.
+            Ids are returned by SQLite 3.35 or later, otherwise taken as consecutive up to the last rowid,
+            which is wrong only once the max rowid is used.
+            """
+            query = BasicRecord.insert_many(rows, fields=[BasicRecord.date_id, BasicRecord.group_id])
+            if sqlite3.sqlite_version_info >= (3, 35, 0):
+                return [id_ for id_, in query.returning(BasicRecord.id).tuples().execute()]
+            last_id = query.execute()
+            return list(range(last_id - len(rows) + 1, last_id + 1))
+
+        @classmethod
+        def create_many(cls, records):
+            """
+            Insert RecordRow of (date, group_id, ((ExtraRecordType, value), ...)), which should be validated.
+            Each chunk of BULK_CHUNK records is inserted in its own transaction. Returns the number of records.
+            """
+            records = list(records)
+            date_ids = Utility.get_or_create_date_ids(record.date for record in records)
+
+            for index in range(0, len(records), cls.BULK_CHUNK):
+                chunk = records[index:index + cls.BULK_CHUNK]
+                stored = [RecordRow(record.date, record.group_id, tuple(
+                    (key.value, RecordUtility.Extra.normalize(record.group_id, key, value))
+                    for key, value in record.extras)) for record in chunk]
+                with Utility.atomic():
+                    basic_ids = cls._insert_basics([(date_ids[record.date], record.group_id) for record in stored])
+                    extras = [(basic_id, key, value)
+                              for basic_id, record in zip(basic_ids, stored) for key, value in record.extras]
+                    for extra_index in range(0, len(extras), cls.EXTRA_CHUNK):
+                        ExtraRecord.insert_many(extras[extra_index:extra_index + cls.EXTRA_CHUNK],
+                                                fields=[ExtraRecord.basic_id, ExtraRecord.key,
+                                                        ExtraRecord.value]).execute()
+                    cls._notify(stored)
+            return len(records)
+
     class Extra:
         @classmethod
         def create(cls, basic_id, key, value):
@@ -90,26 +281,111 @@ class RecordUtility(object):
             if not isinstance(key, ExtraRecordType):
                 raise TypeError('key: ', key)
 
+            value = cls.normalize(basic.group_id_id, key, value)
+            return ExtraRecord.create(basic_id=basic_id, key=key.value, value=value)
+
+        @classmethod
+        def normalize(cls, group_id, key, value):
+            """ The value to be saved. """
             value = value.strip()
             if key is ExtraRecordType.DESCRIPTION:
-                value = cls._rephrase_alias(basic.group_id_id, value)
-            return ExtraRecord.create(basic_id=basic_id, key=key.value, value=value)
+                value = cls._rephrase_alias(group_id, value)
+            return value
 
         @staticmethod
         def _rephrase_alias(group_id, description):
-            result = description
+            # rephrase by my rules and then ancestors's rules
+            return RecordUtility.Alias.get_engine().rephrase(group_id, description)
 
-            # rephrase by my row_rules
-            for name, rules in group_alias_rules[group_id].items():
-                pattern = re.compile("|".join(rules), flags=re.IGNORECASE)
-                result = pattern.sub(name, result)
+    class Alias(object):
+        REALIAS_CHUNK = 1000
+        # Descriptions updated per statement, 3 variables each are under the 999 of SQLite before 3.32.
+        UPDATE_CHUNK = 300
+        # cache of AliasEngine, rebuilt on Alias.json or groups changed
+        _engine = None
 
-            try:
-                # rephrase by ancestors's row_rules
-                parent_id = RecordUtility.Group.get_parent(group_id).id
-                return RecordUtility.Extra._rephrase_alias(parent_id, result)
-            except AttributeError:
-                return result
+        @classmethod
+        def get_engine(cls):
+            if cls._engine is None:
+                cls._engine = AliasEngine(group_alias_rules.group_rules, RecordUtility.Group.get_hierarchy())
+            return cls._engine
+
+        @classmethod
+        def reload(cls):
+            """
+            Reload Alias.json if it has been modified, checked once per operation e.g. an import,
+            descriptions within it are rephrased by the same engine.
+            """
+            if group_alias_rules.reload():
+                cls._engine = None
+
+        @classmethod
+        def update_cache(cls):
+            cls._engine = None
+
+        @classmethod
+        def realias(cls, dry_run=False, on_change=None):
+            """
+            Rephrase existing descriptions by the current rules, written back in one transaction.
+            Descriptions are streamed in chunks of REALIAS_CHUNK.
+            :param on_change: called with (extra_id, old, new) of each changed description.
+            """
+            cls.reload()
+            engine = cls.get_engine()
+            group_ids = [id_ for id_ in RecordUtility.Group.get_ids() if engine.get_steps(id_)]
+
+            started = time.perf_counter()
+            scanned = changed = 0
+            last_id = 0
+            database = ExtraRecord._meta.database
+            with database.atomic():
+                while True:
+                    rows = cls._get_description_chunk(group_ids, last_id)
+                    if not rows:
+                        break
+                    scanned += len(rows)
+                    last_id = rows[-1][0]
+
+                    changes = list(cls._rephrase_rows(engine, rows))
+                    changed += len(changes)
+                    if on_change is not None:
+                        for change in changes:
+                            on_change(*change)
+                    if changes and not dry_run:
+                        for change_index in range(0, len(changes), cls.UPDATE_CHUNK):
+                            cls._update_values(changes[change_index:change_index + cls.UPDATE_CHUNK])
+            if changed and not dry_run:
+                RecordDurationModel.update_cache()
+            return RealiasReport(scanned, changed, time.perf_counter() - started)
+
+        @classmethod
+        def _get_description_chunk(cls, group_ids, last_id):
+            """ (extra_id, group_id, description) of groups in group_ids after last_id. """
+            return list(ExtraRecord
+                        .select(ExtraRecord.id, BasicRecord.group_id, ExtraRecord.value)
+                        .join(BasicRecord)
+                        .where((ExtraRecord.id > last_id) &
+                               (ExtraRecord.key == ExtraRecordType.DESCRIPTION.value) &
+                               (BasicRecord.group_id.in_(group_ids)))
+                        .order_by(ExtraRecord.id)
+                        .limit(cls.REALIAS_CHUNK)
+                        .tuples())
+
+        @staticmethod
+        def _update_values(changes):
+            """ Set the new value of each (extra_id, old, new) in one statement. """
+            ids = [id_ for id_, _, _ in changes]
+            (ExtraRecord
+             .update(value=Case(ExtraRecord.id, [(id_, new) for id_, _, new in changes]))
+             .where(ExtraRecord.id.in_(ids))
+             .execute())
+
+        @staticmethod
+        def _rephrase_rows(engine, rows):
+            for id_, group_id, description in rows:
+                rephrased = engine.rephrase(group_id, description)
+                if rephrased != description:
+                    yield id_, description, rephrased
 
 
 class RecordGroupModel(BaseModel):
@@ -123,36 +399,104 @@ class RecordGroupModel(BaseModel):
     def get_data(cls, *args):
         return super().get_data(*args).order_by(RecordGroup.id)
 
+    @classmethod
+    def get_record_attr(cls, record, attr):
+        if attr == 'parent':
+            return RecordUtility.Group.get_parent(record.id)
+        elif attr == 'children':
+            return RecordUtility.Group.get_children(record.id)
+        else:  # default
+            return super().get_record_attr(record, attr)
+
 
 class RecordDurationModel(DurationalColumnModel):
     ACCESSOR = Timeline
 
     @classmethod
     def get_column_names(cls, duration):
+        return cls._get_date_columns(duration) + list(RecordUtility.Group.get_description())
+
+    @classmethod
+    def get_column_keys(cls, duration):
+        """ Group columns are keyed by group id, in the order of get_column_names. """
+        return cls._get_date_columns(duration) + list(RecordUtility.Group.get_ids())
+
+    @staticmethod
+    def _get_date_columns(duration):
         if duration is DurationType.DAILY:
-            columns = ['date']
+            return ['date']
         elif duration is DurationType.WEEKLY:
-            columns = ['monday', 'sunday']
+            return ['monday', 'sunday']
         elif duration is DurationType.MONTHLY:
-            columns = ['month']
+            return ['month']
         else:
             raise KeyError
-        columns.extend(RecordUtility.Group.get_description())
-        return columns
 
     @classmethod
-    def get_data(cls, duration):
-        raw_data = cls._get_data_with_record()
+    def get_data(cls, duration, date_start=None):
+        """ Only periods start on or after date_start are summarized. """
+        cutoff = cls.get_period_cutoff(duration, date_start)
+        if _SummaryCache.is_enabled():
+            return _SummaryCache.summarize(duration, cutoff)
+
+        engine = config['record_summary']['engine']
+        if engine == 'numpy' and np is None:
+            logging.getLogger(__name__).warning("NumPy is not installed, records are summarized in python.")
+            engine = 'python'
+        if engine == 'sql':
+            return _Summarizer.summarize_cells(duration, _SqlAggregator.get_cells(duration, cutoff))
+        elif engine == 'numpy':
+            return _NumpyAggregator.summarize(duration, cutoff)
+        elif engine == 'parallel':
+            return _ParallelSummarizer.summarize(duration, cutoff)
+
+        raw_data = cls._get_data_with_record(cutoff)
         return _Summarizer.summarize(duration, raw_data)
 
+    @staticmethod
+    def update_cache():
+        """ Should be called on records changed without adding new ones, e.g. descriptions rephrased. """
+        _NumpyAggregator.update_cache()
+        _SummaryCache.clear()
+
+    @staticmethod
+    def get_period(duration, date):
+        """ The date of the period that date is summarized in, as records of get_data are keyed. """
+        return _Summarizer._get_duration_summarizer(duration).get_period(date)
+
+    @staticmethod
+    def create_record(period):
+        """ An empty record of get_data, RecordRow in the period are summarized by its add(). """
+        return _Summarizer.DateSummarizer(period)
+
     @classmethod
-    def _get_data_with_record(cls):
-        timeline = cls._select()
-        return (datum for datum in timeline if (len(datum.record) > 0))
+    def _get_data_with_record(cls, date_start=None):
+        """ Records since date_start as RecordRow, fetched by one joined query in timeline order. """
+        query = (BasicRecord
+                 .select(Timeline.date, BasicRecord.id, BasicRecord.group_id, ExtraRecord.key, ExtraRecord.value)
+                 .join(Timeline)
+                 .switch(BasicRecord)
+                 .join(ExtraRecord, JOIN.LEFT_OUTER)
+                 .order_by(Timeline.id, BasicRecord.id, ExtraRecord.id)
+                 .tuples())
+        if date_start is not None:
+            query = query.where(Timeline.date >= date_start)
+        return cls._group_by_record(query)
+
+    @staticmethod
+    def _group_by_record(rows):
+        """
+        :param rows: (date, basic_id, group_id, key, value), sorted by basic_id within each date.
+        """
+        for (date, _, group_id), record_rows in groupby(rows, key=lambda row: row[0:3]):
+            extras = tuple((key, value) for _, _, _, key, value in record_rows if key is not None)
+            yield RecordRow(date, group_id, extras)
 
     @classmethod
     def get_record_attr(cls, record, attr):
-        if attr == 'date' or attr == 'monday' or attr == 'month':
+        if isinstance(attr, int):  # group id from get_column_keys
+            return record.get(attr)
+        elif attr == 'date' or attr == 'monday' or attr == 'month':
             return record.date
         elif attr == 'sunday':
             return record.date + datetime.timedelta(days=6)
@@ -160,22 +504,46 @@ class RecordDurationModel(DurationalColumnModel):
             return getattr(record, attr)
 
 
+RealiasReport = namedtuple('RealiasReport', ['scanned', 'changed', 'seconds'])
+RecordRow = namedtuple('RecordRow', ['date', 'group_id', 'extras'])
+# Arrays of a value of each record, description_lists and description_keys are indexed by their ids.
+RecordColumns = namedtuple('RecordColumns', [
+    'date', 'group_id', 'description_id', 'description_key_id', 'magnitude', 'scale', 'time', 'distance',
+    'description_lists', 'description_keys'])
+
+
 class _Summarizer(object):
     @staticmethod
-    def summarize(duration, timelines):
+    def summarize(duration, rows):
+        return _Summarizer._get_duration_summarizer(duration)(rows)
+
+    @staticmethod
+    def summarize_cells(duration, cells):
+        """ Build from SummaryCell which are already totaled, in the order of their first record. """
+        summarizer = _Summarizer._get_duration_summarizer(duration)(())
+        for cell in cells:
+            summarizer.add_cell(cell)
+        return summarizer
+
+    @staticmethod
+    def _get_duration_summarizer(duration):
         if duration is DurationType.DAILY:
-            return _Summarizer.DailySummarizer(timelines)
+            return _Summarizer.DailySummarizer
         elif duration is DurationType.WEEKLY:
-            return _Summarizer.WeeklySummarizer(timelines)
+            return _Summarizer.WeeklySummarizer
         elif duration is DurationType.MONTHLY:
-            return _Summarizer.MonthlySummarizer(timelines)
+            return _Summarizer.MonthlySummarizer
         else:
             raise KeyError
 
     class BaseDurationSummarizer(dict):
-        def __init__(self, timelines):
+        def __init__(self, rows):
             super().__init__()
-            self.summarize(timelines)
+            self.summarize(rows)
+
+        @staticmethod
+        def get_period(date):
+            return date
 
         def __missing__(self, date):
             self[date] = _Summarizer.DateSummarizer(date)
@@ -184,196 +552,1086 @@ class _Summarizer(object):
         def __iter__(self):
             return iter(self.values())
 
-        def summarize(self, timelines):
-            for timeline in timelines:
-                self.summarize_date(timeline.date, timeline.record)
+        def summarize(self, rows):
+            for row in rows:
+                self[row.date].add(row)
 
-        def summarize_date(self, date, records):
-            for record in records:
-                self[date].add(record)
+        def add_cell(self, cell):
+            summarizer = _Summarizer.DescriptionSummarizer.from_totals(
+                cell.descriptions, cell.volume, cell.times, cell.time, cell.distance)
+            self[cell.period][cell.group_id].merge(summarizer)
 
     class DailySummarizer(BaseDurationSummarizer):
         pass
 
     class WeeklySummarizer(BaseDurationSummarizer):
+        @staticmethod
+        def get_period(date):
+            return get_week_start(date)
+
         def __getitem__(self, date):
-            date = get_week_start(date)
-            return super().__getitem__(date)
+            return super().__getitem__(self.get_period(date))
 
     class MonthlySummarizer(BaseDurationSummarizer):
+        @staticmethod
+        def get_period(date):
+            return get_month_start(date)
+
         def __getitem__(self, date):
-            date = get_month_start(date)
-            return super().__getitem__(date)
+            return super().__getitem__(self.get_period(date))
 
     class DateSummarizer(dict):
+        __slots__ = ('date',)
+
         def __init__(self, date):
             super().__init__()
             self.date = date
 
-        def __missing__(self, group):
-            if group.id not in self:
-                self[group.id] = _Summarizer.GroupSummarizer(group)
-            return self[group.id]
+        def __missing__(self, group_id):
+            self[group_id] = _Summarizer.GroupSummarizer(RecordUtility.Group.get_group(group_id))
+            return self[group_id]
 
-        def add(self, record):
-            self[record.group_id].add(record.extra)
+        def add(self, row):
+            self[row.group_id].add(row.extras)
 
         def __getattr__(self, attr):
             try:
                 group_id = RecordUtility.Group.get_id_by_description(attr)
-                return self[group_id]
-            except AttributeError:
-                return None
+            except KeyError:
+                raise AttributeError(attr)
+            return self.get(group_id)
 
     class GroupSummarizer(object):
-        @staticmethod
-        def _dictionarize_extra(extras):
-            # init dict_
-            dict_ = {
-                ExtraRecordType.DESCRIPTION: [],
-                ExtraRecordType.MAGNITUDE: 0,
-                ExtraRecordType.SCALE: 1,
-                ExtraRecordType.TIME: 0,
-                ExtraRecordType.DISTANCE: 0
-            }
-
-            # apply extras
-            for extra in extras:
-                type_ = ExtraRecordType.from_value(extra.key)
-                if type_ == ExtraRecordType.DESCRIPTION:
-                    dict_[type_].append(extra.value)
-                else:
-                    dict_[type_] = extra.value
-            return dict_
+        __slots__ = ('group', 'description_groups')
 
         def __init__(self, group):
             super().__init__()
             self.group = group
-            self.description_groups = []
+            # {DescriptionSummarizer.key: DescriptionSummarizer}, in the order of their first record.
+            self.description_groups = {}
 
         def add(self, extras):
-            extra_dict = self._dictionarize_extra(extras)
-            extra = _Summarizer.DescriptionSummarizer(extra_dict)
+            self.merge(_Summarizer.DescriptionSummarizer.from_extras(extras))
 
-            try:
-                matched = next(filter(lambda old: old == extra, self.description_groups))
+        def merge(self, extra):
+            key = extra.key
+            matched = self.description_groups.get(key)
+            if matched is None:
+                self.description_groups[key] = extra
+            else:
                 matched += extra
-            except StopIteration:
-                self.description_groups.append(extra)
 
         def __repr__(self):
-            return '.  '.join(str(each) for each in self.description_groups)
+            return '.  '.join(str(each) for each in self.description_groups.values())
 
-    class DescriptionSummarizer(object):
-        def __init__(self, extra_dict):
-            super().__init__()
+    DescriptionSummarizer = DescriptionSummarizer
 
-            self.times = 0
-            self.descriptions = extra_dict[ExtraRecordType.DESCRIPTION]
 
-            magnitude = float(extra_dict[ExtraRecordType.MAGNITUDE])
-            scale = float(extra_dict[ExtraRecordType.SCALE])
-            volume = magnitude * scale
-            self.volume = volume
+class _SqlAggregator(object):
+    """
+    Totals records by period, group and description set inside SQLite,
+    the same as _Summarizer does, so only the output cells reach python.
+    Orders of descriptions and records are given by window functions, not by orders of subqueries.
+    """
+    SEPARATOR = '\x1f'
+    # Timeline.id * ORDER_SHIFT + BasicRecord.id, keeps the record order used by _Summarizer.
+    ORDER_SHIFT = 2 ** 32
 
-            self.others = {}
-            for type_ in (ExtraRecordType.DISTANCE, ExtraRecordType.TIME):
-                self.others[type_] = float(extra_dict[type_])
+    @classmethod
+    def get_cells(cls, duration, date_start=None):
+        records = cls._get_record_query(duration, date_start)
+        cell = [records.c.period, records.c.group_id, records.c.description_key]
+        # Descriptions of the first record of each cell, which are the same on all rows of the cell.
+        ranked = (records.select_from(
+            *cell, records.c.volume, records.c.time, records.c.distance, records.c.order_key,
+            fn.FIRST_VALUE(records.c.descriptions).over(
+                partition_by=cell, order_by=[records.c.order_key]).alias('descriptions'))
+            .alias('ranked'))
+        is_times = Case(None, ((
+            (ranked.c.volume == 0) & (ranked.c.time == 0) & (ranked.c.distance == 0), 1),), 0)
+        first = fn.MIN(ranked.c.order_key)
+
+        query = (ranked.select_from(
+            ranked.c.period, ranked.c.group_id, fn.MIN(ranked.c.descriptions),
+            fn.SUM(ranked.c.volume), fn.SUM(is_times), fn.SUM(ranked.c.time), fn.SUM(ranked.c.distance), first)
+            .group_by(ranked.c.period, ranked.c.group_id, ranked.c.description_key)
+            .order_by(first)
+            .tuples())
+
+        for period, group_id, descriptions, volume, times, time, distance, _ in query:
+            yield SummaryCell(
+                datetime.datetime.strptime(period, '%Y-%m-%d').date(), group_id,
+                descriptions.split(cls.SEPARATOR) if descriptions else [],
+                float(volume), times, float(time), float(distance))
 
-            self.time()
+    @classmethod
+    def _get_record_query(cls, duration, date_start):
+        """ One row per BasicRecord since date_start with its period, description set and numeric extras. """
+        descriptions = cls._get_description_query()
+        numbers = cls._get_number_query()
+
+        query = (BasicRecord.select(
+            cls._get_period(duration).alias('period'),
+            BasicRecord.group_id.alias('group_id'),
+            fn.COALESCE(descriptions.c.description_key, '').alias('description_key'),
+            descriptions.c.descriptions.alias('descriptions'),
+            (fn.COALESCE(numbers.c.magnitude, 0) * fn.COALESCE(numbers.c.scale, 1)).alias('volume'),
+            fn.COALESCE(numbers.c.time, 0).alias('time'),
+            fn.COALESCE(numbers.c.distance, 0).alias('distance'),
+            (Timeline.id * cls.ORDER_SHIFT + BasicRecord.id).alias('order_key'))
+            .join(Timeline)
+            .join(descriptions, JOIN.LEFT_OUTER, on=(descriptions.c.basic_id == BasicRecord.id))
+            .join(numbers, JOIN.LEFT_OUTER, on=(numbers.c.basic_id == BasicRecord.id)))
+        if date_start is not None:
+            query = query.where(Timeline.date >= date_start)
+        return query.alias('records')
 
-        def __eq__(self, other):
-            if len(self.descriptions) != len(other.descriptions):
-                return False
-            return all((desc_ in other.descriptions for desc_ in self.descriptions))
-
-        def __ne__(self, other):
-            return not self.__eq__(other)
-
-        def __iadd__(self, other):
-            self.volume += other.volume
-            self.times += other.times
-            for key in self.others.keys():
-                self.others[key] += other.others[key]
-            return self
-
-        def time(self):
-            if self.volume == 0 and not any(self.others.values()):
-                self.times += 1
-
-        def __str__(self):
-            if self.volume > 0 and self.times > 0:
-                count = "(%.1f+%d)" % (self.volume, self.times)
-            elif self.volume > 0:
-                count = "%.1f" % self.volume
-            elif any(self.others.values()):
-                count = ", ".join(["{0}{1}".format(type_.value[0:3], value)
-                                  for type_, value in self.others.items() if value > 0])
-            else:  # self.times > 0
-                count = "%d" % self.times
-
-            if self.descriptions:
-                return count + "*" + repr(self.descriptions)
+    @staticmethod
+    def _get_period(duration):
+        if duration is DurationType.DAILY:
+            return fn.DATE(Timeline.date)
+        elif duration is DurationType.WEEKLY:
+            return Func.week_start(Timeline.date)
+        elif duration is DurationType.MONTHLY:
+            return Func.month_start(Timeline.date)
+        else:
+            raise KeyError
+
+    @classmethod
+    def _get_description_query(cls):
+        """
+        One row per BasicRecord with descriptions, which are joined in the order of ExtraRecord.id.
+        Its description_key is the number of descriptions and their distinct values sorted,
+        equal for records of the same DescriptionSummarizer.get_key.
+        """
+        numbered = (ExtraRecord.select(
+            ExtraRecord.basic_id, ExtraRecord.id, ExtraRecord.value,
+            fn.ROW_NUMBER().over(partition_by=[ExtraRecord.basic_id, ExtraRecord.value],
+                                 order_by=[ExtraRecord.id]).alias('repeat'))
+            .where(ExtraRecord.key == ExtraRecordType.DESCRIPTION.value)
+            .alias('numbered'))
+
+        def concat(value, *order):
+            # Rows of the whole record are joined in the order of the window, skipping NULL.
+            return fn.GROUP_CONCAT(value, cls.SEPARATOR).over(
+                partition_by=[numbered.c.basic_id], order_by=order,
+                start=Window.preceding(), end=Window.following(), frame_type=Window.ROWS)
+
+        distinct_value = Case(None, ((numbered.c.repeat == 1, numbered.c.value),))
+        joined = (numbered.select_from(
+            numbered.c.basic_id,
+            concat(numbered.c.value, numbered.c.id).alias('descriptions'),
+            (fn.COUNT(numbered.c.id).over(partition_by=[numbered.c.basic_id]).cast('TEXT').concat(cls.SEPARATOR)
+             .concat(concat(distinct_value, numbered.c.value, numbered.c.id))).alias('description_key'))
+            .alias('joined'))
+        # Values are the same on all rows of a record.
+        return (joined.select_from(
+            joined.c.basic_id, fn.MIN(joined.c.descriptions).alias('descriptions'),
+            fn.MIN(joined.c.description_key).alias('description_key'))
+            .group_by(joined.c.basic_id)
+            .alias('descriptions'))
+
+    @staticmethod
+    def _get_number_query():
+        latest_ids = (ExtraRecord
+                      .select(fn.MAX(ExtraRecord.id))
+                      .where(ExtraRecord.key != ExtraRecordType.DESCRIPTION.value)
+                      .group_by(ExtraRecord.basic_id, ExtraRecord.key))
+        # The last extra of each key.
+        latest = (ExtraRecord
+                  .select(ExtraRecord.basic_id, ExtraRecord.key, ExtraRecord.value)
+                  .where(ExtraRecord.id.in_(latest_ids))
+                  .alias('latest'))
+
+        def pick(type_):
+            return fn.SUM(Case(latest.c.key, ((type_.value, latest.c.value.cast('REAL')),))).alias(type_.value)
+
+        return (latest.select_from(
+            latest.c.basic_id, *(pick(type_) for type_ in (
+                ExtraRecordType.MAGNITUDE, ExtraRecordType.SCALE, ExtraRecordType.TIME, ExtraRecordType.DISTANCE)))
+            .group_by(latest.c.basic_id)
+            .alias('numbers'))
+
+
+class _NumpyAggregator(object):
+    """
+    Totals records by period, group and description set on columns of all records loaded into NumPy arrays,
+    the same as _Summarizer does. Columns are kept until records are added or removed,
+    so every duration and date filter is computed from them without querying again.
+    """
+    # julianday() of the day before date.fromordinal(1), julianday() - it is the ordinal of a date.
+    JULIAN_DAY_OF_ORDINAL_0 = 1721424.5
+    UNIX_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+    # cache of (token, RecordColumns)
+    _cache = (None, None)
+
+    @classmethod
+    def update_cache(cls):
+        cls._cache = (None, None)
+
+    @classmethod
+    def summarize(cls, duration, date_start=None):
+        """
+        The same as _Summarizer.summarize of records since date_start.
+        Totals are distinct cells, so they are set without looking up equal description sets.
+        """
+        columns = cls.get_columns()
+        summarizer = _Summarizer._get_duration_summarizer(duration)(())
+        for period, group_id, description_id, key_id, volume, times, time, distance in cls.get_totals(
+                columns, duration, date_start):
+            date_summarizer = summarizer.get(period)
+            if date_summarizer is None:
+                date_summarizer = summarizer[period]
+            group_summarizer = date_summarizer.get(group_id)
+            if group_summarizer is None:
+                group_summarizer = date_summarizer[group_id]
+            group_summarizer.description_groups[columns.description_keys[key_id]] = \
+                _Summarizer.DescriptionSummarizer.from_totals(
+                    columns.description_lists[description_id], volume, times, time, distance)
+        return summarizer
+
+    @classmethod
+    def get_columns(cls):
+        token = RecordUtility.Basic.get_version()
+        cached_token, columns = cls._cache
+        if columns is None or token != cached_token:
+            columns = cls._load()
+            cls._cache = (token, columns)
+        return columns
+
+    @classmethod
+    def _load(cls):
+        """ Tables are read in the order they are stored and without joins, which is faster than sorting in SQLite. """
+        database = BasicRecord._meta.database
+        timeline = Timeline.select(
+            Timeline.id, (fn.JULIANDAY(Timeline.date) - cls.JULIAN_DAY_OF_ORDINAL_0).cast('INTEGER'))
+        records = BasicRecord.select(BasicRecord.id, BasicRecord.date_id, BasicRecord.group_id)
+        extras = ExtraRecord.select(ExtraRecord.basic_id, ExtraRecord.key, ExtraRecord.value).order_by(ExtraRecord.id)
+        # Rows are taken raw from the cursor, converting each value by peewee takes most of the time otherwise.
+        return cls.build_columns(database.execute(timeline).fetchall(), database.execute(records).fetchall(),
+                                 database.execute(extras))
+
+    @staticmethod
+    def build_columns(timeline, records, extras):
+        """
+        :param timeline: (date_id, date ordinal)
+        :param records: (basic_id, date_id, group_id)
+        :param extras: (basic_id, key, value) in the order of ExtraRecord.id.
+        """
+        timeline = np.array(timeline, dtype=np.int64).reshape(-1, 2)
+        records = np.array(records, dtype=np.int64).reshape(-1, 3)
+        ordinals = np.zeros(max(timeline[:, 0].max(initial=0), records[:, 1].max(initial=0)) + 1, dtype=np.int64)
+        ordinals[timeline[:, 0]] = timeline[:, 1]
+        # In the order of _Summarizer, by date id and then basic id, without records of missing dates.
+        records = records[np.lexsort((records[:, 0], records[:, 1]))]
+        records = records[ordinals[records[:, 1]] > 0]
+        positions = {basic_id: position for position, basic_id in enumerate(records[:, 0].tolist())}
+
+        # The last value of each numeric key is taken, as DescriptionSummarizer.from_extras does.
+        descriptions = {}
+        numbers = {ExtraRecordType.MAGNITUDE.value: {}, ExtraRecordType.SCALE.value: {},
+                   ExtraRecordType.TIME.value: {}, ExtraRecordType.DISTANCE.value: {}}
+        for basic_id, key, value in extras:
+            if key == ExtraRecordType.DESCRIPTION.value:
+                descriptions.setdefault(basic_id, []).append(value)
+            else:
+                numbers[key][basic_id] = value
+
+        # Descriptions of a record in order, and their key, are interned to ids of equal ones.
+        description_lists = [[]]
+        description_ids = {(): 0}
+        key_ids = {_Summarizer.DescriptionSummarizer.get_key(()): 0}
+        described = ([], [], [])  # positions, description ids, key ids
+        for basic_id, values in descriptions.items():
+            position = positions.get(basic_id)
+            if position is None:
+                continue
+            values = tuple(values)
+            id_ = description_ids.get(values)
+            if id_ is None:
+                id_ = description_ids[values] = len(description_lists)
+                description_lists.append(list(values))
+            described[0].append(position)
+            described[1].append(id_)
+            described[2].append(key_ids.setdefault(_Summarizer.DescriptionSummarizer.get_key(values), len(key_ids)))
+        description_id = np.zeros(len(records), dtype=np.int64)
+        description_key_id = np.zeros(len(records), dtype=np.int64)
+        description_id[described[0]] = described[1]
+        description_key_id[described[0]] = described[2]
+
+        number_columns = []
+        for key, default in ((ExtraRecordType.MAGNITUDE.value, 0), (ExtraRecordType.SCALE.value, 1),
+                             (ExtraRecordType.TIME.value, 0), (ExtraRecordType.DISTANCE.value, 0)):
+            column = np.full(len(records), default, dtype=np.float64)
+            values = [(positions[basic_id], float(value))
+                      for basic_id, value in numbers[key].items() if basic_id in positions]
+            if values:
+                indices, values = zip(*values)
+                column[list(indices)] = values
+            number_columns.append(column)
+
+        return RecordColumns(
+            ordinals[records[:, 1]], records[:, 2].copy(), description_id, description_key_id, *number_columns,
+            description_lists=description_lists, description_keys=list(key_ids))
+
+    @classmethod
+    def get_totals(cls, columns, duration, date_start=None):
+        """
+        (period, group_id, description_id, key_id, volume, times, time, distance) of each cell,
+        in the order of their first record. Totals are added in the order of records as _Summarizer does.
+        """
+        if date_start is None:
+            selected = slice(None)
+        else:
+            selected = np.flatnonzero(columns.date >= date_start.toordinal())
+        period = cls.get_period(duration, columns.date[selected])
+        group_id = columns.group_id[selected]
+        description_key_id = columns.description_key_id[selected]
+        volume = columns.magnitude[selected] * columns.scale[selected]
+        time = columns.time[selected]
+        distance = columns.distance[selected]
+        if not len(period):
+            return
+
+        _, period_index = np.unique(period, return_inverse=True)
+        groups, group_index = np.unique(group_id, return_inverse=True)
+        cell_key = (period_index * len(groups) + group_index) * len(columns.description_keys) + description_key_id
+        _, first, cell_index = np.unique(cell_key, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        first = first[order]
+
+        def total(weights):
+            return np.bincount(cell_index, weights=weights, minlength=len(order))[order].tolist()
+        is_times = (volume == 0) & (time == 0) & (distance == 0)
+        first_period = period[first].tolist()
+        dates = {ordinal: datetime.date.fromordinal(ordinal) for ordinal in set(first_period)}
+        yield from zip(
+            [dates[ordinal] for ordinal in first_period], group_id[first].tolist(),
+            columns.description_id[selected][first].tolist(), description_key_id[first].tolist(),
+            total(volume), np.bincount(cell_index, weights=is_times)[order].astype(np.int64).tolist(),
+            total(time), total(distance))
+
+    @classmethod
+    def get_period(cls, duration, ordinals):
+        """ Date ordinals of the periods of date ordinals, as _Summarizer keys them. """
+        if duration is DurationType.DAILY:
+            return ordinals
+        elif duration is DurationType.WEEKLY:
+            # date.fromordinal(1) is a Monday.
+            return ordinals - (ordinals - 1) % 7
+        elif duration is DurationType.MONTHLY:
+            days = (ordinals - cls.UNIX_EPOCH_ORDINAL).astype('datetime64[D]')
+            return days.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + cls.UNIX_EPOCH_ORDINAL
+        else:
+            raise KeyError
+
+
+class _ParallelSummarizer(object):
+    """
+    Summarizes shards of the timeline, each year or month since date_start, in worker processes reading the DB
+    by their own read-only connections, and merges their periods in the order of their first record.
+    Workers are new interpreters running SummaryUtility.run_worker, which doesn't import the DB models,
+    so neither the DB nor the GUI is loaded again as multiprocessing would by importing __main__,
+    and nothing is forked from a process with Qt and writer threads.
+    A week across two shards is merged from both, so its totals may differ from serial ones in rounding.
+    """
+    WORKER = 'from Model.SummaryUtility import run_worker; run_worker()'
+
+    @classmethod
+    def summarize(cls, duration, date_start=None):
+        settings = config['record_summary']['parallel']
+        shards = cls.get_shards(date_start, settings['shard'])
+        workers = min(settings['workers'] or os.cpu_count() or 1, len(shards))
+        path = BasicRecord._meta.database.database
+        days = (shards[-1][1] - shards[0][0]).days if shards else 0
+        if workers < 2 or days < settings['min_days'] or not cls.is_available(path):
+            return cls.summarize_serial(duration, date_start)
+
+        queries = [cls._get_shard_query(start, end).sql() for start, end in shards]
+        try:
+            # Threads only wait for the workers, shards are dealt round-robin so each has recent and old ones.
+            with ThreadPoolExecutor(workers) as executor:
+                periods = list(chain.from_iterable(chain.from_iterable(executor.map(
+                    functools.partial(cls.run_worker, path, duration),
+                    [queries[index::workers] for index in range(workers)]))))
+        except (OSError, subprocess.CalledProcessError, pickle.UnpicklingError, EOFError) as ex:
+            logging.getLogger(__name__).warning("Records are summarized serially, workers failed: %s", ex)
+            return cls.summarize_serial(duration, date_start)
+
+        periods.sort(key=lambda period: period[0])
+        return _Summarizer.summarize_cells(duration, chain.from_iterable(cells for _, cells in periods))
+
+    @classmethod
+    def run_worker(cls, path, duration, queries):
+        """ Results of summarize_shard of the queries, by a worker process. """
+        # The worker imports Model from the directory containing it, wherever the program is started from.
+        root = os.path.dirname(os.path.dirname(os.path.abspath(SummaryUtility.__file__)))
+        process = subprocess.run([sys.executable, '-c', cls.WORKER], cwd=root, check=True,
+                                 input=pickle.dumps((path, duration.value, queries), pickle.HIGHEST_PROTOCOL),
+                                 stdout=subprocess.PIPE)
+        return pickle.loads(process.stdout)
+
+    @staticmethod
+    def summarize_serial(duration, date_start=None):
+        return _Summarizer.summarize(duration, RecordDurationModel._get_data_with_record(date_start))
+
+    @staticmethod
+    def is_available(path):
+        # A frozen executable isn't a python interpreter to run the worker.
+        return not getattr(sys, 'frozen', False) and os.path.isfile(path)
+
+    @classmethod
+    def get_shards(cls, date_start, shard):
+        """ Shards of dates since date_start in the timeline. """
+        dates = Timeline.select(Timeline.date)
+        if date_start is not None:
+            dates = dates.where(Timeline.date >= date_start)
+        first, last = dates.order_by(Timeline.date).first(), dates.order_by(Timeline.date.desc()).first()
+        return [] if first is None else cls.split(first.date, last.date, shard)
+
+    @staticmethod
+    def split(first, last, shard):
+        """ [start, end) from first to last date, split at the start of each year or month. """
+        shards = []
+        start = first
+        while start <= last:
+            if shard == 'year':
+                end = datetime.date(start.year + 1, 1, 1)
+            elif shard == 'month':
+                end = get_next_month_start(start + datetime.timedelta(days=1))
             else:
-                return count
+                raise ValueError("Unknown shard: %s" % shard)
+            shards.append((start, end))
+            start = end
+        return shards
+
+    @staticmethod
+    def _get_shard_query(date_start, date_end):
+        return (BasicRecord
+                .select(Timeline.id, Timeline.date, BasicRecord.id, BasicRecord.group_id,
+                        ExtraRecord.key, ExtraRecord.value)
+                .join(Timeline)
+                .switch(BasicRecord)
+                .join(ExtraRecord, JOIN.LEFT_OUTER)
+                .where((Timeline.date >= date_start) & (Timeline.date < date_end))
+                .order_by(Timeline.id, BasicRecord.id, ExtraRecord.id))
+
+
+class _SummaryCache(object):
+    """
+    Cells of each period of all records, kept in a file per DB and duration so they are not computed on every start.
+    Files are keyed by RecordUtility.Basic.get_version(): if records were only added since, just the periods of the
+    added ones are computed again, otherwise all of them, by the python summarizer on a read-only connection.
+    Edits and deletes are told by the revision, even those made by other programs, e.g. on a synced DB.
+    Cells of each period are pickled on their own, so only those of the periods shown are unpickled.
+    """
+    # Bumped whenever the content of files changes, files of other formats are computed again.
+    FORMAT = 2
+
+    @staticmethod
+    def is_enabled():
+        return config['summary_cache']['enabled'] and os.path.isfile(BasicRecord._meta.database.database)
 
+    @classmethod
+    def summarize(cls, duration, date_start=None):
+        periods = cls.get_periods(duration)
+        return _Summarizer.summarize_cells(duration, chain.from_iterable(
+            pickle.loads(cells) for period, (_, cells) in periods.items()
+            if date_start is None or period >= date_start))
+
+    @classmethod
+    def get_periods(cls, duration):
+        """ {period: (order of its first record, pickled [SummaryCell, ...])} in the order of their first record. """
+        path = cls.get_path(duration)
+        version = RecordUtility.Basic.get_version()
+        cached = cls._load(path)
+        if cached is not None and cached['version'] == version:
+            return cached['periods']
+
+        if cached is not None and cls._is_added_only(cached['version'], version):
+            periods = cached['periods']
+            dates = cls._get_added_dates(cached['version'])
+            if dates:
+                get_period = _Summarizer._get_duration_summarizer(duration).get_period
+                periods = cls._update(periods, duration, get_period(min(dates)),
+                                      cls._get_period_end(duration, get_period(max(dates))))
+        else:
+            periods = cls._update(OrderedDict(), duration, datetime.date.min, datetime.date.max)
+        cls._save(path, {'format': cls.FORMAT, 'version': version, 'periods': periods})
+        return periods
 
-class ExtraRecordType(Enum):
-    DESCRIPTION = 'description'
-    MAGNITUDE = 'magnitude'
-    SCALE = 'scale'
-    TIME = 'time'
-    DISTANCE = 'distance'
+    @staticmethod
+    def _update(periods, duration, start, end):
+        """ Periods with those in [start, end) computed again. """
+        query = _ParallelSummarizer._get_shard_query(start, end).sql()
+        periods = OrderedDict((period, cells) for period, cells in periods.items() if not start <= period < end)
+        for first, cells in summarize_shard(BasicRecord._meta.database.database, duration.value, query):
+            periods[cells[0].period] = (first, pickle.dumps(cells, pickle.HIGHEST_PROTOCOL))
+        return OrderedDict(sorted(periods.items(), key=lambda item: item[1][0]))
 
     @staticmethod
-    def from_value(value):
-        for type_ in ExtraRecordType:
-            if value == type_.value:
-                return type_
-        raise KeyError
+    def _is_added_only(cached, current):
+        """ Whether rows of ids after the cached max ids are all the rows added since, and nothing was edited. """
+        if cached[2] != current[2]:
+            return False
+        for model, (cached_max, cached_count), (_, count) in zip((BasicRecord, ExtraRecord), cached, current):
+            if model.select().where(model.id > (cached_max or 0)).count() != count - cached_count:
+                return False
+        return True
 
+    @staticmethod
+    def _get_added_dates(cached):
+        (basic_max, _), (extra_max, _), _ = cached
+        return [date for date, in (Timeline
+                                   .select(Timeline.date)
+                                   .join(BasicRecord)
+                                   .join(ExtraRecord, JOIN.LEFT_OUTER)
+                                   .where((BasicRecord.id > (basic_max or 0)) | (ExtraRecord.id > (extra_max or 0)))
+                                   .distinct()
+                                   .tuples())]
+
+    @staticmethod
+    def _get_period_end(duration, period):
+        if duration is DurationType.DAILY:
+            return period + datetime.timedelta(days=1)
+        elif duration is DurationType.WEEKLY:
+            return period + datetime.timedelta(days=7)
+        elif duration is DurationType.MONTHLY:
+            return get_next_month_start(period + datetime.timedelta(days=1))
+        else:
+            raise KeyError
+
+    @staticmethod
+    def get_dir():
+        return config['summary_cache']['dir'] or get_cache_dir()
+
+    @classmethod
+    def get_path(cls, duration):
+        """ Named by the DB and the hash of its path, DBs of the same name in different dirs are not mixed. """
+        database = os.path.abspath(BasicRecord._meta.database.database)
+        return os.path.join(cls.get_dir(), "%s-%s.%s.summary" % (
+            os.path.splitext(os.path.basename(database))[0],
+            hashlib.sha1(database.encode('utf-8')).hexdigest()[:8], duration.value))
+
+    @classmethod
+    def clear(cls):
+        for duration in DurationType:
+            try:
+                os.remove(cls.get_path(duration))
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def _load(cls, path):
+        """ None if missing, unreadable or of another format. """
+        try:
+            with open(path, 'rb') as file:
+                cached = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as ex:
+            logging.getLogger(__name__).warning("Summary cache %s not loaded: %s", path, ex)
+            return None
+        return cached if isinstance(cached, dict) and cached.get('format') == cls.FORMAT else None
+
+    @staticmethod
+    def _save(path, cached):
+        """ Replaced at once, failures are logged and the cache is written again next time. """
+        temp_path = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as file:
+                pickle.dump(cached, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError as ex:
+            logging.getLogger(__name__).warning("Summary cache %s not saved: %s", path, ex)
+
+
+class _HierarchyTest(unittest.TestCase):
+    def setUp(self):
+        # 1 -> (2, 3), 3 -> 4, 4 -> 6, 5 alone
+        self.hierarchy = RecordUtility.Hierarchy([(1, 2), (1, 3), (3, 4), (4, 6)])
+
+    def test_parent_and_children(self):
+        self.assertEqual(None, self.hierarchy.get_parent_id(1))
+        self.assertEqual(3, self.hierarchy.get_parent_id(4))
+        self.assertEqual((2, 3), self.hierarchy.get_children_ids(1))
+        self.assertEqual((), self.hierarchy.get_children_ids(5))
+
+    def test_level(self):
+        self.assertEqual([0, 1, 1, 2, 0, 3], [self.hierarchy.get_level(id_) for id_ in range(1, 7)])
+
+    def test_ancestors_and_descendants(self):
+        self.assertEqual([4, 3, 1], self.hierarchy.get_ancestor_ids(6))
+        self.assertEqual([], self.hierarchy.get_ancestor_ids(5))
+        self.assertEqual([2, 3, 4, 6], self.hierarchy.get_descendant_ids(1))
+        self.assertEqual([], self.hierarchy.get_descendant_ids(2))
+
+
+class _RealiasTest(unittest.TestCase):
+    class Engine(object):
+        @staticmethod
+        def rephrase(group_id, description):
+            return description.replace('nick', 'Name') if group_id == 3 else description
+
+    def test_rephrase_rows(self):
+        rows = [(1, 3, 'nick and Name'), (2, 3, 'Name'), (3, 4, 'nick'), (5, 3, 'nicknick')]
+        self.assertEqual([(1, 'nick and Name', 'Name and Name'), (5, 'nicknick', 'NameName')],
+                         list(RecordUtility.Alias._rephrase_rows(self.Engine(), rows)))
+
+
+class _AliasReloadTest(unittest.TestCase):
+    def tearDown(self):
+        RecordUtility.Alias.update_cache()
+
+    def test_engine_reused(self):
+        """ Alias.json is checked by reload only, not by every rephrased description. """
+        with unittest.mock.patch.object(group_alias_rules, 'reload', return_value=False) as reload:
+            engine = RecordUtility.Alias.get_engine()
+            self.assertIs(engine, RecordUtility.Alias.get_engine())
+            reload.assert_not_called()
+
+            RecordUtility.Alias.reload()
+            self.assertIs(engine, RecordUtility.Alias.get_engine())
+            reload.return_value = True
+            RecordUtility.Alias.reload()
+            self.assertIsNot(engine, RecordUtility.Alias.get_engine())
+            self.assertEqual(2, reload.call_count)
+
+
+class _GroupByRecordTest(unittest.TestCase):
+    def test_group_rows(self):
+        day1, day2 = datetime.date(2018, 8, 14), datetime.date(2018, 8, 17)
+        rows = [
+            (day1, 1, 6, 'magnitude', '12'),
+            (day1, 1, 6, 'scale', '0.5'),
+            (day2, 2, 2, 'magnitude', '30'),
+            (day2, 3, 2, None, None),
+        ]
+        result = list(RecordDurationModel._group_by_record(rows))
+        self.assertEqual(3, len(result))
+        self.assertEqual(RecordRow(day1, 6, (('magnitude', '12'), ('scale', '0.5'))), result[0])
+        self.assertEqual(RecordRow(day2, 2, (('magnitude', '30'),)), result[1])
+        self.assertEqual(RecordRow(day2, 2, ()), result[2])
+
+
+class _ListenerTest(unittest.TestCase):
+    ROWS = [RecordRow(datetime.date(2018, 8, 14), 6, (('description', 'run'),))]
+
+    def setUp(self):
+        self.received = []
+
+    def on_committed(self, rows):
+        self.received.append(rows)
+
+    def test_notify(self):
+        RecordUtility.Basic.add_listener(self.on_committed)
+        try:
+            RecordUtility.Basic._notify(self.ROWS)
+        finally:
+            RecordUtility.Basic.remove_listener(self.on_committed)
+        RecordUtility.Basic._notify(self.ROWS)
+        self.assertEqual([self.ROWS], self.received)
+
+
+class _ParallelSummarizerTest(unittest.TestCase):
+    def test_split(self):
+        first, last = datetime.date(2017, 11, 5), datetime.date(2019, 1, 1)
+        self.assertEqual([(first, datetime.date(2018, 1, 1)), (datetime.date(2018, 1, 1), datetime.date(2019, 1, 1)),
+                          (datetime.date(2019, 1, 1), datetime.date(2020, 1, 1))],
+                         _ParallelSummarizer.split(first, last, 'year'))
+        shards = _ParallelSummarizer.split(first, last, 'month')
+        self.assertEqual(15, len(shards))
+        self.assertEqual((first, datetime.date(2017, 12, 1)), shards[0])
+        self.assertEqual((datetime.date(2018, 2, 1), datetime.date(2018, 3, 1)), shards[3])
+        self.assertEqual([(first, datetime.date(2017, 12, 1))], _ParallelSummarizer.split(first, first, 'month'))
+
+    def test_unknown_shard(self):
+        with self.assertRaises(ValueError):
+            _ParallelSummarizer.split(datetime.date(2018, 8, 14), datetime.date(2018, 8, 14), 'week')
+
+
+class _FixtureTest(unittest.TestCase):
+    """ Models are bound to a copy of the unittest DB, caches are loaded from it and from the DB again after. """
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.database = open_unittest_copy(self.dir.name)
+        self.binding = self.database.bind_ctx(MODELS)
+        self.binding.__enter__()
+        self.reset_caches()
+
+    def tearDown(self):
+        self.binding.__exit__(None, None, None)
+        self.database.close()
+        self.dir.cleanup()
+        self.reset_caches()
+
+    @staticmethod
+    def reset_caches():
+        Utility.date_id_cache.clear()
+        RecordUtility.Group.update_cache()
+        _NumpyAggregator.update_cache()
+
+    @staticmethod
+    def dump(records):
+        """ Comparable content of summaries. """
+        return [(record.date, sorted((group_id, repr(group)) for group_id, group in record.items()))
+                for record in records]
+
+    @staticmethod
+    def dump_ordered(records):
+        """ Content of summaries in the order of periods, groups and description sets. """
+        return [(record.date, [(group_id, repr(group)) for group_id, group in record.items()]) for record in records]
+
+    def summarize_python(self, duration):
+        return self.dump(_Summarizer.summarize(duration, RecordDurationModel._get_data_with_record(None)))
+
+
+class _SummaryCacheTest(_FixtureTest):
+    def setUp(self):
+        super().setUp()
+        self.config = dict(config.config)
+        config.config['summary_cache'] = {'enabled': True, 'dir': self.dir.name}
+        self.updates = []
+
+    def tearDown(self):
+        config.config = self.config
+        super().tearDown()
+
+    def summarize(self, duration):
+        """ Summaries of the cache, recording the ranges computed again. """
+        update = _SummaryCache._update
+
+        def record_update(periods, duration_, start, end):
+            self.updates.append((start, end))
+            return update(periods, duration_, start, end)
+        with unittest.mock.patch.object(_SummaryCache, '_update', record_update):
+            return self.dump(_SummaryCache.summarize(duration))
+
+    def test_added(self):
+        for duration in DurationType:
+            self.assertEqual(self.summarize_python(duration), self.summarize(duration))
+        version = RecordUtility.Basic.get_version()
+        RecordUtility.Basic.create_with_extras(datetime.date(2018, 9, 3), 2, [(ExtraRecordType.DESCRIPTION, 'new')])
+        self.assertTrue(_SummaryCache._is_added_only(version, RecordUtility.Basic.get_version()))
+
+        self.updates.clear()
+        for duration in DurationType:
+            self.assertEqual(self.summarize_python(duration), self.summarize(duration))
+        # Only the periods of the added record.
+        self.assertEqual([(datetime.date(2018, 9, 3), datetime.date(2018, 9, 4)),
+                          (datetime.date(2018, 9, 3), datetime.date(2018, 9, 10)),
+                          (datetime.date(2018, 9, 1), datetime.date(2018, 10, 1))], self.updates)
+
+        self.updates.clear()
+        self.summarize(DurationType.DAILY)
+        self.assertEqual([], self.updates)
+
+    def test_edited(self):
+        """ Edits keep max ids and counts, e.g. made by other programs. """
+        self.summarize(DurationType.DAILY)
+        version = RecordUtility.Basic.get_version()
+        self.database.execute_sql("UPDATE ExtraRecord SET value = 'edited' WHERE key = 'description'")
+        self.assertFalse(_SummaryCache._is_added_only(version, RecordUtility.Basic.get_version()))
+
+        self.updates.clear()
+        self.assertEqual(self.summarize_python(DurationType.DAILY), self.summarize(DurationType.DAILY))
+        self.assertEqual([(datetime.date.min, datetime.date.max)], self.updates)
+
+    def test_moved_and_deleted(self):
+        self.summarize(DurationType.WEEKLY)
+        self.database.execute_sql("UPDATE Timeline SET date = '2019-01-01' WHERE id = "
+                                  "(SELECT date_id FROM BasicRecord ORDER BY id LIMIT 1)")
+        self.assertEqual(self.summarize_python(DurationType.WEEKLY), self.summarize(DurationType.WEEKLY))
+
+        version = RecordUtility.Basic.get_version()
+        self.database.execute_sql('DELETE FROM ExtraRecord WHERE id = (SELECT MAX(id) FROM ExtraRecord)')
+        self.assertFalse(_SummaryCache._is_added_only(version, RecordUtility.Basic.get_version()))
+        self.assertEqual(self.summarize_python(DurationType.WEEKLY), self.summarize(DurationType.WEEKLY))
+
+    def test_get_period_end(self):
+        period = datetime.date(2018, 12, 1)
+        self.assertEqual(datetime.date(2018, 12, 2), _SummaryCache._get_period_end(DurationType.DAILY, period))
+        self.assertEqual(datetime.date(2018, 12, 8), _SummaryCache._get_period_end(DurationType.WEEKLY, period))
+        self.assertEqual(datetime.date(2019, 1, 1), _SummaryCache._get_period_end(DurationType.MONTHLY, period))
+
+    def test_get_path(self):
+        paths = {_SummaryCache.get_path(duration) for duration in DurationType}
+        self.assertEqual(len(DurationType), len(paths))
+        self.assertTrue(all(path.endswith('.summary') for path in paths))
+
+
+class _SqlAggregatorTest(_FixtureTest):
+    def assert_same_as_python(self):
+        for duration in DurationType:
+            expected = _Summarizer.summarize(duration, RecordDurationModel._get_data_with_record(None))
+            cells = list(_SqlAggregator.get_cells(duration))
+            self.assertEqual(self.dump_ordered(expected),
+                             self.dump_ordered(_Summarizer.summarize_cells(duration, cells)))
+            # Cells are not merged again in python.
+            self.assertEqual(sum(len(group.description_groups) for record in expected for group in record.values()),
+                             len(cells))
+
+    def test_same_as_python(self):
+        self.assert_same_as_python()
+
+    def test_repeated_descriptions(self):
+        """ Grouped by the number of descriptions and the set of them, keeping those of the first record. """
+        date = datetime.date(2018, 9, 3)
+        for descriptions in (['b', 'a', 'b'], ['a', 'a', 'b'], ['a', 'b'], ['b', 'a'], ['a', 'a'], ['a']):
+            RecordUtility.Basic.create_with_extras(
+                date, 2, [(ExtraRecordType.DESCRIPTION, description) for description in descriptions])
+        RecordUtility.Basic.create_with_extras(date, 2, [(ExtraRecordType.MAGNITUDE, '1'),
+                                                         (ExtraRecordType.MAGNITUDE, '3'),
+                                                         (ExtraRecordType.SCALE, '2')])
+        self.assert_same_as_python()
+
+
+class _ParallelSummarizerDbTest(_FixtureTest):
+    def setUp(self):
+        super().setUp()
+        self.config = dict(config.config)
+        config.config['record_summary'] = dict(config['record_summary'],
+                                               parallel={'workers': 2, 'shard': 'month', 'min_days': 0})
+
+    def tearDown(self):
+        config.config = self.config
+        super().tearDown()
+
+    def test_same_as_python(self):
+        # The week of 2018-08-27 is across two shards, records are in more shards than workers.
+        for date, group_id, extras in ((datetime.date(2018, 8, 31), 2, [(ExtraRecordType.DESCRIPTION, 'a')]),
+                                       (datetime.date(2018, 9, 1), 2, [(ExtraRecordType.DESCRIPTION, 'a'),
+                                                                       (ExtraRecordType.MAGNITUDE, '2')]),
+                                       (datetime.date(2018, 9, 2), 5, []),
+                                       (datetime.date(2019, 1, 2), 6, [(ExtraRecordType.TIME, '30')])):
+            RecordUtility.Basic.create_with_extras(date, group_id, extras)
+        self.assertGreater(len(_ParallelSummarizer.get_shards(None, 'month')), 2)
+
+        serial = unittest.mock.patch.object(_ParallelSummarizer, 'summarize_serial',
+                                            side_effect=AssertionError("Summarized serially"))
+        for duration in DurationType:
+            expected = _Summarizer.summarize(duration, RecordDurationModel._get_data_with_record(None))
+            with serial:
+                summary = _ParallelSummarizer.summarize(duration)
+            self.assertEqual(self.dump_ordered(expected), self.dump_ordered(summary))
+
+
+class _InstrumentedWriteTest(_FixtureTest):
+    """ Writes go through Database.execute_sql, in statements of chunks. """
+    def setUp(self):
+        super().setUp()
+        self.instrument = QueryInstrument()
+        self.instrument.install(self.database)
+
+    def tearDown(self):
+        self.instrument.uninstall()
+        super().tearDown()
+
+    def count(self, prefix):
+        """ (statements, rows) of queries starting with prefix. """
+        queries = [query for scope in self.instrument.get_report()['scopes'] for query in scope['queries']
+                   if query['sql'].startswith(prefix)]
+        return sum(query['count'] for query in queries), sum(query['rows'] for query in queries)
+
+    def test_create_many(self):
+        first_id = BasicRecord.select(fn.MAX(BasicRecord.id)).scalar() + 1
+        extras = [((ExtraRecordType.DESCRIPTION, 'a'), (ExtraRecordType.DESCRIPTION, 'b'),
+                   (ExtraRecordType.MAGNITUDE, '2')), (), ((ExtraRecordType.DESCRIPTION, 'c'),)]
+        with unittest.mock.patch.object(RecordUtility.Basic, 'BULK_CHUNK', 2), \
+                unittest.mock.patch.object(RecordUtility.Basic, 'EXTRA_CHUNK', 2):
+            RecordUtility.Basic.create_many(RecordRow(datetime.date(2018, 9, 3), 2, each) for each in extras)
+        self.assertEqual((2, 3), self.count('INSERT INTO "%s"' % BasicRecord._meta.table_name))
+        self.assertEqual((3, 4), self.count('INSERT INTO "%s"' % ExtraRecord._meta.table_name))
+        self.assertEqual([[(key.value, value) for key, value in each] for each in extras],
+                         [list(ExtraRecord
+                               .select(ExtraRecord.key, ExtraRecord.value)
+                               .where(ExtraRecord.basic_id == basic_id)
+                               .order_by(ExtraRecord.id)
+                               .tuples())
+                          for basic_id, in BasicRecord.select(BasicRecord.id).where(BasicRecord.id >= first_id)
+                          .order_by(BasicRecord.id).tuples()])
+
+    def test_realias(self):
+        RecordUtility.Basic.create_many(
+            RecordRow(datetime.date(2018, 9, 3), 3, ((ExtraRecordType.DESCRIPTION, description),))
+            for description in ('nick', 'other', 'nick', 'nick'))
+        engine = AliasEngine({3: {'Name': ['nick']}}, RecordUtility.Group.get_hierarchy())
+        with unittest.mock.patch.object(RecordUtility.Alias, 'get_engine', lambda: engine), \
+                unittest.mock.patch.object(RecordUtility.Alias, 'UPDATE_CHUNK', 2):
+            self.assertEqual(3, RecordUtility.Alias.realias().changed)
+        self.assertEqual((2, 3), self.count('UPDATE "%s"' % ExtraRecord._meta.table_name))
+        self.assertEqual(3, ExtraRecord.select().where(ExtraRecord.value == 'Name').count())
+
+
+class _RealiasDbTest(_FixtureTest):
+    RULES = {3: {'Name': ['nick']}}
+    # (group_id, description), group 4 is a child of group 3.
+    DESCRIPTIONS = [(4, 'nick'), (3, 'Name'), (5, 'nick'), (3, 'nick and nick'), (4, 'nickname'), (3, 'other')]
+
+    def setUp(self):
+        super().setUp()
+        RecordUtility.Basic.create_many(
+            RecordRow(datetime.date(2018, 9, 3), group_id, ((ExtraRecordType.DESCRIPTION, description),))
+            for group_id, description in self.DESCRIPTIONS)
+        self.engine = AliasEngine(self.RULES, RecordUtility.Group.get_hierarchy())
+        self.chunks = []
+        get_chunk = RecordUtility.Alias._get_description_chunk
+
+        def record_chunk(group_ids, last_id):
+            rows = get_chunk(group_ids, last_id)
+            self.chunks.append(len(rows))
+            return rows
+        self.patches = [
+            unittest.mock.patch.object(RecordUtility.Alias, 'get_engine', lambda: self.engine),
+            unittest.mock.patch.object(RecordUtility.Alias, 'REALIAS_CHUNK', 2),
+            unittest.mock.patch.object(RecordUtility.Alias, '_get_description_chunk', record_chunk),
+            unittest.mock.patch.object(RecordDurationModel, 'update_cache')]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        super().tearDown()
 
-class _DescriptionSummarizerTest(unittest.TestCase):
     @staticmethod
-    def create_description_summarizer(desc, magn=0, scal=1):
-        return _Summarizer.DescriptionSummarizer({
-            ExtraRecordType.DESCRIPTION: desc,
-            ExtraRecordType.MAGNITUDE: magn,
-            ExtraRecordType.SCALE: scal
-        })
-
-    def test_equality(self):
-        obj_99_1 = self.create_description_summarizer(['99'], scal=1)
-        self.assertTrue(obj_99_1 == obj_99_1)
-
-        obj_99_5 = self.create_description_summarizer(['99'], scal=5)
-        self.assertTrue(obj_99_1 == obj_99_5)
-
-        obj_99_k_2 = self.create_description_summarizer(['99', 'k'], magn=2)
-        self.assertFalse(obj_99_1 == obj_99_k_2)
-
-        obj_k_99_4 = self.create_description_summarizer(['k', '99'], magn=4)
-        self.assertFalse(obj_99_k_2 != obj_k_99_4)
-
-    def test_addition(self):
-        obj_99_v0 = self.create_description_summarizer(['99'])
-        self.assertEqual(0, obj_99_v0.volume)
-        self.assertEqual(1, obj_99_v0.times)
-        obj_99_k_v0 = self.create_description_summarizer(['99', 'k'])
-        self.assertEqual(0, obj_99_k_v0.volume)
-        self.assertEqual(1, obj_99_k_v0.times)
-
-        obj_99_v0 += obj_99_k_v0
-        self.assertEqual(0, obj_99_v0.volume)
-        self.assertEqual(2, obj_99_v0.times)
-
-        obj_99_k_v3 = self.create_description_summarizer(['99', 'k'], magn=3)
-        self.assertEqual(3, obj_99_k_v3.volume)
-        self.assertEqual(0, obj_99_k_v3.times)
-
-        obj_99_v0 += obj_99_k_v3
-        self.assertEqual(3, obj_99_v0.volume)
-        self.assertEqual(2, obj_99_v0.times)
+    def get_descriptions():
+        return list(ExtraRecord
+                    .select(ExtraRecord.value)
+                    .where(ExtraRecord.key == ExtraRecordType.DESCRIPTION.value)
+                    .order_by(ExtraRecord.id)
+                    .tuples())
+
+    def test_realias(self):
+        changes = []
+        report = RecordUtility.Alias.realias(on_change=lambda *change: changes.append(change[1:]))
+        # Descriptions of groups 3 and 4 in chunks of 2, until an empty one.
+        self.assertEqual([2, 2, 1, 0], self.chunks)
+        self.assertEqual((5, 3), report[:2])
+        self.assertEqual([('nick', 'Name'), ('nick and nick', 'Name and Name'), ('nickname', 'Namename')], changes)
+        self.assertEqual([('足球',), ('Name',), ('Name',), ('nick',), ('Name and Name',), ('Namename',), ('other',)],
+                         self.get_descriptions())
+        RecordDurationModel.update_cache.assert_called_once_with()
+
+    def test_dry_run(self):
+        descriptions = self.get_descriptions()
+        report = RecordUtility.Alias.realias(dry_run=True)
+        self.assertEqual((5, 3), report[:2])
+        self.assertEqual(descriptions, self.get_descriptions())
+        RecordDurationModel.update_cache.assert_not_called()
+
+    def test_one_transaction(self):
+        """ Chunks written are rolled back with a later failure. """
+        descriptions = self.get_descriptions()
+
+        def fail_on_last(extra_id, old, new):
+            if old == 'nickname':
+                raise ValueError
+        with self.assertRaises(ValueError):
+            RecordUtility.Alias.realias(on_change=fail_on_last)
+        self.assertEqual(descriptions, self.get_descriptions())
+        RecordDurationModel.update_cache.assert_not_called()
+
+
+class _PeriodTest(unittest.TestCase):
+    def test_get_period(self):
+        date = datetime.date(2018, 8, 16)
+        self.assertEqual(date, RecordDurationModel.get_period(DurationType.DAILY, date))
+        self.assertEqual(datetime.date(2018, 8, 13), RecordDurationModel.get_period(DurationType.WEEKLY, date))
+        self.assertEqual(datetime.date(2018, 8, 1), RecordDurationModel.get_period(DurationType.MONTHLY, date))
+
+
+class _DateSummarizerColumnTest(unittest.TestCase):
+    def test_group_id_key(self):
+        summarizer = _Summarizer.DateSummarizer(datetime.date(2018, 8, 14))
+        summarizer[6] = 'group 6'
+        self.assertEqual('group 6', RecordDurationModel.get_record_attr(summarizer, 6))
+        self.assertIsNone(RecordDurationModel.get_record_attr(summarizer, 2))
+        self.assertNotIn(2, summarizer)
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class _NumpyAggregatorDbTest(_FixtureTest):
+    def assert_same_as_python(self, date_start=None):
+        for duration in DurationType:
+            expected = _Summarizer.summarize(duration, RecordDurationModel._get_data_with_record(date_start))
+            self.assertEqual(self.dump_ordered(expected),
+                             self.dump_ordered(_NumpyAggregator.summarize(duration, date_start)))
+
+    def test_same_as_python(self):
+        self.assert_same_as_python()
+        self.assert_same_as_python(datetime.date(2018, 8, 16))
+        self.assert_same_as_python(datetime.date(2019, 1, 1))
+
+    def test_descendants_and_no_extras(self):
+        """ Groups 1 and 3 have descendants, records of them are not totaled into their parents. """
+        for date, group_id, extras in ((datetime.date(2018, 9, 3), 1, [(ExtraRecordType.DESCRIPTION, 'a')]),
+                                       (datetime.date(2018, 9, 3), 4, [(ExtraRecordType.DESCRIPTION, 'a')]),
+                                       (datetime.date(2018, 9, 4), 3, []),
+                                       (datetime.date(2018, 9, 4), 1, []),
+                                       (datetime.date(2018, 9, 5), 3, [(ExtraRecordType.MAGNITUDE, '2'),
+                                                                       (ExtraRecordType.SCALE, '1.5')])):
+            RecordUtility.Basic.create_with_extras(date, group_id, extras)
+        self.assert_same_as_python()
+        self.assert_same_as_python(datetime.date(2018, 9, 4))
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class _NumpyAggregatorTest(unittest.TestCase):
+    MONDAY = datetime.date(2018, 8, 13)
+
+    def get_columns(self):
+        day = self.MONDAY.toordinal()
+        timeline = [(1, day), (2, day + 1), (3, day + 7)]
+        # Record 5 is on a missing date, record 3 is on an earlier date than record 2.
+        records = [(1, 1, 6), (2, 3, 6), (3, 2, 6), (4, 1, 6), (5, 9, 6), (6, 1, 2)]
+        extras = [(1, 'description', 'run'), (1, 'description', 'swim'), (1, 'magnitude', '2'),
+                  (4, 'description', 'swim'), (4, 'description', 'run'), (4, 'magnitude', '1'), (4, 'magnitude', '3'),
+                  (3, 'description', 'run'), (3, 'time', '1.5'),
+                  (5, 'magnitude', '9'), (7, 'magnitude', '9'),
+                  (6, 'magnitude', '4'), (6, 'scale', '0.5')]
+        return _NumpyAggregator.build_columns(timeline, records, extras)
+
+    def get_totals(self, duration, date_start=None):
+        columns = self.get_columns()
+        return [(period, group_id, columns.description_lists[description_id], volume, times, time, distance)
+                for period, group_id, description_id, _, volume, times, time, distance
+                in _NumpyAggregator.get_totals(columns, duration, date_start)]
+
+    def test_daily(self):
+        self.assertEqual([
+            (self.MONDAY, 6, ['run', 'swim'], 5.0, 0, 0.0, 0.0),
+            (self.MONDAY, 2, [], 2.0, 0, 0.0, 0.0),
+            (self.MONDAY + datetime.timedelta(days=1), 6, ['run'], 0.0, 0, 1.5, 0.0),
+            (self.MONDAY + datetime.timedelta(days=7), 6, [], 0.0, 1, 0.0, 0.0),
+        ], self.get_totals(DurationType.DAILY))
+
+    def test_weekly(self):
+        self.assertEqual([
+            (self.MONDAY, 6, ['run', 'swim'], 5.0, 0, 0.0, 0.0),
+            (self.MONDAY, 2, [], 2.0, 0, 0.0, 0.0),
+            (self.MONDAY, 6, ['run'], 0.0, 0, 1.5, 0.0),
+            (self.MONDAY + datetime.timedelta(days=7), 6, [], 0.0, 1, 0.0, 0.0),
+        ], self.get_totals(DurationType.WEEKLY))
+
+    def test_date_start(self):
+        self.assertEqual([(datetime.date(2018, 8, 1), 6, ['run'], 0.0, 0, 1.5, 0.0),
+                          (datetime.date(2018, 8, 1), 6, [], 0.0, 1, 0.0, 0.0)],
+                         self.get_totals(DurationType.MONTHLY, self.MONDAY + datetime.timedelta(days=1)))
+        self.assertEqual([], self.get_totals(DurationType.MONTHLY, datetime.date(2019, 1, 1)))
+
+    def test_unknown_key(self):
+        with self.assertRaises(KeyError):
+            _NumpyAggregator.build_columns([(1, 1)], [(1, 1, 1)], [(1, 'colour', 'red')])
+
+    def test_get_period(self):
+        dates = [datetime.date(1999, 12, 25) + datetime.timedelta(days=days) for days in range(400)]
+        ordinals = np.array([date.toordinal() for date in dates])
+        for duration, get_period in ((DurationType.WEEKLY, get_week_start), (DurationType.MONTHLY, get_month_start)):
+            self.assertEqual([get_period(date).toordinal() for date in dates],
+                             _NumpyAggregator.get_period(duration, ordinals).tolist())
 
 
 if __name__ == "__main__":
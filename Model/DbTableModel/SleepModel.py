@@ -1,23 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import datetime
-from collections import OrderedDict
+import heapq
+import tempfile
+import unittest
 
-from Model.DbTableModel.BaseModel import BaseModel, DurationModel, DurationType, Func
+from Model.DbTableModel.BaseModel import BaseModel, DurationalColumnModel, DurationType
 from Model import Utility
-from Model.DataAccessor.DbTableAccessor import Sleep, SleepDateView, DoesNotExist, fn
+from Model.TimeUtility import str_timedelta
+from Model.DataAccessor.DbTableAccessor import Sleep, SleepRollup, MODELS, open_unittest_copy
+from Model.DataAccessor import Migration
 
 
 class SleepUtility(object):
+    INSERT_CHUNK = 100
+
     @staticmethod
     def _create_with_feedback(start, end):
         date_belonged = SleepUtility.get_date_belonged(end)
-        duration_before = SleepUtility.get_duration(date_belonged)
 
-        Utility.init_timeline_on_date(date_belonged)
-        SleepModel.create(start=start, end=end)
+        with Utility.atomic():
+            duration_before = SleepUtility.get_duration(date_belonged)
+            Utility.init_timeline_on_date(date_belonged)
+            SleepModel.create(start=start, end=end)
+            duration_after = SleepUtility.get_duration(date_belonged)
 
-        duration_after = SleepUtility.get_duration(date_belonged)
         duration_growth = duration_after - duration_before
         return {'date': date_belonged, 'after': duration_after, 'growth': duration_growth}
 
@@ -41,17 +48,113 @@ class SleepUtility(object):
 
         return SleepUtility._create_with_feedback(start=start, end=end)
 
+    @staticmethod
+    def create_many(intervals):
+        """
+        Insert (start, end) of sleeps in one transaction, raises ValueError if any is invalid.
+        Returns feedback of each date as create_by_datetime, ordered by date.
+        """
+        intervals = list(intervals)
+        errors = SleepUtility.validate_many(intervals)
+        if errors:
+            raise ValueError("; ".join("#%d %s" % error for error in errors))
+
+        dates = sorted({SleepUtility.get_date_belonged(end) for _, end in intervals})
+        if not dates:
+            return []
+        with Utility.atomic():
+            before = SleepUtility.get_durations(dates[0], dates[-1])
+            Utility.get_or_create_date_ids(dates)
+            for index in range(0, len(intervals), SleepUtility.INSERT_CHUNK):
+                chunk = intervals[index:index + SleepUtility.INSERT_CHUNK]
+                Sleep.insert_many(chunk, fields=[Sleep.start, Sleep.end]).execute()
+            after = SleepUtility.get_durations(dates[0], dates[-1])
+
+        zero = datetime.timedelta()
+        return [{'date': date, 'after': after.get(date, zero), 'growth': after.get(date, zero) - before.get(date, zero)}
+                for date in dates]
+
+    @staticmethod
+    def validate_many(intervals):
+        """
+        Check (start, end) of sleeps against each other and table Sleep.
+        Returns (index, reason) of invalid ones, each reported once: at least one of each overlapped pair of them,
+        and every one overlapping an existing sleep.
+        """
+        errors = []
+        valid = []
+        for index, (start, end) in enumerate(intervals):
+            if start >= end:
+                errors.append((index, "End should be later than start."))
+            elif (end - start) >= datetime.timedelta(days=1):
+                errors.append((index, "Sleep over 24 hours."))
+            else:
+                valid.append((start, end, index))
+        if not valid:
+            return errors
+
+        existing = (Sleep
+                    .select(Sleep.start, Sleep.end)
+                    .where((Sleep.start < max(end for _, end, _ in valid)) &
+                           (Sleep.end > min(start for start, _, _ in valid)))
+                    .tuples())
+        # Sweep by start, an interval overlaps a former one if it starts before the latest end so far.
+        # An existing one overlaps every former new one not ended before its start, kept in a heap by end.
+        latest = None
+        new_ends = []
+        reported = set()
+        for start, end, index in sorted(valid + [(start, end, None) for start, end in existing],
+                                        key=lambda interval: interval[:2]):
+            while new_ends and new_ends[0][0] <= start:
+                heapq.heappop(new_ends)
+            if index is not None and latest is not None and start < latest[1]:
+                errors.append((index, SleepUtility._get_conflict(start, end, latest)))
+                reported.add(index)
+            elif index is None:
+                for new_end, new_start, new_index in new_ends:
+                    if new_index not in reported:
+                        errors.append((new_index, SleepUtility._get_conflict(new_start, new_end, (start, end))))
+                        reported.add(new_index)
+
+            if latest is None or end > latest[1]:
+                latest = (start, end, index)
+            if index is not None:
+                heapq.heappush(new_ends, (end, start, index))
+        return sorted(errors)
+
+    @staticmethod
+    def _get_conflict(start, end, other):
+        reason = "Duplicated with" if (start, end) == tuple(other[:2]) else "Overlapped with"
+        return "%s %s ~ %s." % (reason, other[0], other[1])
+
     @staticmethod
     def get_date_belonged(the_datetime):
         return (the_datetime - datetime.timedelta(hours=17)).date()
 
     @staticmethod
     def get_duration(date):
-        try:
-            duration = SleepDateView.select().where(SleepDateView.date == date).get().duration
-            return datetime.timedelta(hours=duration.hour, minutes=duration.minute)
-        except DoesNotExist:
-            return datetime.timedelta()
+        return SleepUtility.get_durations(date, date).get(date, datetime.timedelta())
+
+    @staticmethod
+    def get_durations(first, last):
+        """ {date: total of its sleeps} from the daily rollup, only dates with sleeps. """
+        query = (SleepRollup
+                 .select(SleepRollup.date, SleepRollup.total)
+                 .where((SleepRollup.period == DurationType.DAILY.value) &
+                        (SleepRollup.date >= first) & (SleepRollup.date <= last))
+                 .tuples())
+        return {date: datetime.timedelta(seconds=total) for date, total in query}
+
+    @staticmethod
+    def rebuild_rollup():
+        """
+        Recompute every rollup row from table Sleep, returns the number of rows.
+        Triggers of table Sleep keep the rollup up to date, this only repairs a rollup changed otherwise.
+        """
+        with Sleep.atomic():
+            for sql in Migration.REBUILD_SLEEP_ROLLUP:
+                Sleep._meta.database.execute_sql(sql)
+        return SleepRollup.select().count()
 
 
 class SleepModel(BaseModel):
@@ -74,32 +177,119 @@ class SleepModel(BaseModel):
             return super().get_record_attr(record, attr)
 
 
-class SleepDurationModel(DurationModel):
-    ACCESSOR = SleepDateView
+class SleepDurationModel(DurationalColumnModel):
+    ACCESSOR = SleepRollup
 
     @classmethod
     def get_columns_definition(cls, duration):
-        avg_duration = Func.time(fn.AVG(fn.STRFTIME("%s", SleepDateView.duration))).alias('duration')
-
-        if duration is DurationType.WEEKLY:
-            return OrderedDict((
-                ('id', SleepDateView.id),
-                ('monday', Func.week_start(SleepDateView.date).alias('monday')),
-                ('sunday', Func.week_end(SleepDateView.date).alias('sunday')),
-                ('duration', avg_duration),
-                ('minimum', fn.MIN(SleepDateView.duration).alias('minimum')),
-            ))
+        if duration is DurationType.DAILY:
+            return ['id', 'date', 'duration', 'count']
+        elif duration is DurationType.WEEKLY:
+            return ['id', 'monday', 'sunday', 'duration', 'minimum']
         elif duration is DurationType.MONTHLY:
-            return OrderedDict((
-                ('id', SleepDateView.id),
-                ('month', Func.month_start(SleepDateView.date).alias('month')),
-                ('duration', avg_duration),
-            ))
+            return ['id', 'month', 'duration']
         else:
-            """ names for DurationType.Day: ['id', 'date', 'duration', 'count'] """
-            return super().get_columns_definition(duration)
+            raise KeyError
+
+    @classmethod
+    def get_data(cls, duration, date_start=None):
+        """ Only periods start on or after date_start are selected. """
+        query = cls._select().where(SleepRollup.period == duration.value).order_by(SleepRollup.date)
+        if date_start is not None:
+            query = query.where(SleepRollup.date >= date_start)
+        return query
+
+    @classmethod
+    def get_record_attr(cls, record, attr):
+        if attr == 'date' or attr == 'monday' or attr == 'month':
+            return record.date
+        elif attr == 'sunday':
+            return record.date + datetime.timedelta(days=6)
+        elif attr == 'duration':
+            # Daily shows the total, others show the average of days.
+            if record.period == DurationType.DAILY.value:
+                return str_timedelta(datetime.timedelta(seconds=record.total))
+            return str_timedelta(datetime.timedelta(seconds=record.total / record.count))
+        elif attr == 'minimum':
+            return str_timedelta(datetime.timedelta(seconds=record.minimum))
+        else:  # default
+            return super().get_record_attr(record, attr)
+
+
+class _CreateManyTest(unittest.TestCase):
+    """ On a copy of the unittest DB, which has sleeps from 2018-08-14 to 2018-08-20. """
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.database = open_unittest_copy(self.dir.name)
+        self.binding = self.database.bind_ctx(MODELS)
+        self.binding.__enter__()
+        Utility.date_id_cache.clear()
+
+    def tearDown(self):
+        self.binding.__exit__(None, None, None)
+        self.database.close()
+        self.dir.cleanup()
+        Utility.date_id_cache.clear()
+
+    @staticmethod
+    def at(day, hour, minute=0):
+        return datetime.datetime(2018, 9, day, hour, minute)
+
+    def assert_errors(self, expected, intervals):
+        """ expected: [(index, reason prefix)] """
+        errors = SleepUtility.validate_many(intervals)
+        self.assertEqual([index for index, _ in expected], [index for index, _ in errors])
+        for (_, prefix), (_, reason) in zip(expected, errors):
+            self.assertTrue(reason.startswith(prefix), reason)
+
+    def test_adjacent(self):
+        self.assert_errors([], [(self.at(1, 1), self.at(1, 3)), (self.at(1, 3), self.at(1, 5))])
+        # Adjacent to existing 2018-08-14 01:10 ~ 08:20.
+        self.assert_errors([], [(datetime.datetime(2018, 8, 14, 8, 20), datetime.datetime(2018, 8, 14, 9))])
+
+    def test_overlapped(self):
+        self.assert_errors([(1, "Overlapped with")], [(self.at(1, 1), self.at(1, 3)), (self.at(1, 2), self.at(1, 4))])
+        self.assert_errors([(1, "Duplicated with")], [(self.at(1, 1), self.at(1, 3)), (self.at(1, 1), self.at(1, 3))])
+        # Reported in any input order.
+        self.assert_errors([(0, "Overlapped with")], [(self.at(1, 2), self.at(1, 4)), (self.at(1, 1), self.at(1, 3))])
+
+    def test_contained(self):
+        self.assert_errors([(1, "Overlapped with"), (2, "Overlapped with")], [
+            (self.at(1, 1), self.at(1, 6)), (self.at(1, 2), self.at(1, 3)), (self.at(1, 4), self.at(1, 7))])
+
+    def test_existing(self):
+        self.assert_errors([(0, "Overlapped with 2018-08-14 01:10:00"), (1, "Overlapped with 2018-08-14 13:10:00"),
+                            (2, "Duplicated with 2018-08-15 01:15:00")], [
+            (datetime.datetime(2018, 8, 14, 8), datetime.datetime(2018, 8, 14, 9)),
+            # Contains 13:10 ~ 13:30.
+            (datetime.datetime(2018, 8, 14, 13), datetime.datetime(2018, 8, 14, 14)),
+            (datetime.datetime(2018, 8, 15, 1, 15), datetime.datetime(2018, 8, 15, 8, 15))])
+
+    def test_existing_within_former(self):
+        """ A new sleep overlapping an existing one is reported though a later new one ends after it. """
+        self.assert_errors([(0, "Overlapped with 2018-08-14 13:10:00"), (1, "Overlapped with 2018-08-14 13:00:00")], [
+            (datetime.datetime(2018, 8, 14, 13), datetime.datetime(2018, 8, 14, 13, 20)),
+            (datetime.datetime(2018, 8, 14, 13, 5), datetime.datetime(2018, 8, 14, 14))])
+
+    def test_invalid(self):
+        self.assert_errors([(0, "End should be later"), (1, "Sleep over 24 hours")], [
+            (self.at(1, 3), self.at(1, 3)), (self.at(1, 3), self.at(2, 3)), (self.at(3, 1), self.at(3, 2))])
+
+    def test_create_many(self):
+        count = Sleep.select().count()
+        with self.assertRaises(ValueError):
+            SleepUtility.create_many([(self.at(1, 1), self.at(1, 3)), (self.at(1, 2), self.at(1, 4))])
+        self.assertEqual(count, Sleep.select().count())
+
+        feedback = SleepUtility.create_many([
+            (self.at(2, 0), self.at(2, 7)), (self.at(1, 23), self.at(2, 0)), (self.at(2, 12), self.at(2, 13))])
+        self.assertEqual(count + 3, Sleep.select().count())
+        # Sleeps ending before 14:00 are of the day before.
+        self.assertEqual([{'date': datetime.date(2018, 9, 1), 'after': datetime.timedelta(hours=9),
+                           'growth': datetime.timedelta(hours=9)}], feedback)
 
 
 if __name__ == "__main__":
     import doctest
     doctest.testmod(report=True)
+    unittest.main()
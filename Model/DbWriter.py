@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import queue
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+
+from peewee import SqliteDatabase
+from PyQt5.QtCore import QCoreApplication, QThread, pyqtSignal
+
+from Model import Utility
+from Model.DataAccessor.DbTableAccessor import db, Timeline
+from Model.DataAccessor import QueryInstrument
+
+Operation = namedtuple('Operation', ['function', 'on_success', 'on_failure'])
+
+
+class DbWriter(QThread):
+    """
+    Runs submitted writes on its own thread and connection, so commits never block the GUI.
+    Writes submitted within COALESCE_SECONDS are committed together, each in its own savepoint.
+    Callbacks are called on the thread owning the writer, after the commit.
+    Writes should not change caches read by the GUI, but return what is needed for on_success to change them.
+    """
+    COALESCE_SECONDS = 0.05
+    MAX_BATCH = 50
+    _STOP = object()
+
+    reported = pyqtSignal(object, object)  # callback, result or exception
+
+    def __init__(self, parent=None, database=db):
+        super().__init__(parent)
+        self.database = database
+        self._queue = queue.Queue()
+        self.commits = 0
+        self.reported.connect(self._report)
+
+    def submit(self, function, on_success=None, on_failure=None):
+        """
+        :param function: called without arguments on the writer thread.
+        :param on_success: called with the return value of function.
+        :param on_failure: called with the exception raised by function or the commit.
+        """
+        # Statements are reported in the scope of the submitter.
+        self._queue.put(Operation(QueryInstrument.bind_scope(function), on_success, on_failure))
+
+    def stop(self):
+        """ Stop after all submitted writes are done. """
+        self._queue.put(self._STOP)
+        self.wait()
+
+    def run(self):
+        self.database.connect(reuse_if_open=True)
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._take_batch()
+                if batch:
+                    self._write(batch)
+        finally:
+            self.database.close()
+
+    def _take_batch(self):
+        """ Returns operations and whether it should stop. """
+        operation = self._queue.get()
+        if operation is self._STOP:
+            return [], True
+
+        batch = [operation]
+        deadline = time.monotonic() + self.COALESCE_SECONDS
+        while len(batch) < self.MAX_BATCH:
+            try:
+                operation = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if operation is self._STOP:
+                return batch, True
+            batch.append(operation)
+        return batch, False
+
+    def _write(self, batch):
+        results = []
+        try:
+            with Utility.atomic():
+                for operation in batch:
+                    try:
+                        with Utility.atomic():
+                            results.append((operation.on_success, operation.function()))
+                    except Exception as ex:
+                        results.append((operation.on_failure, ex))
+            self.commits += 1
+        except Exception as ex:  # failed to commit, all are rolled back
+            results = [(operation.on_failure, ex) for operation in batch]
+
+        for callback, argument in results:
+            if callback is not None:
+                self.reported.emit(callback, argument)
+
+    def _report(self, callback, argument):
+        callback(argument)
+
+
+_writer = None
+
+
+def submit(function, on_success=None, on_failure=None):
+    """ Submit to the shared writer, started on first use. """
+    global _writer
+    if _writer is None:
+        _writer = DbWriter()
+        _writer.start()
+    _writer.submit(function, on_success, on_failure)
+
+
+def shutdown():
+    """ Finish submitted writes and stop the shared writer. """
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+class _DbWriterTest(unittest.TestCase):
+    DATES = [datetime.date(2018, 8, day) for day in range(1, 6)]
+
+    def setUp(self):
+        self.application = QCoreApplication.instance() or QCoreApplication([])
+        self.dir = tempfile.TemporaryDirectory()
+        # A file, since the writer opens its own connection.
+        self.database = SqliteDatabase(os.path.join(self.dir.name, 'writer.db'))
+        self.binding = self.database.bind_ctx([Timeline])
+        self.binding.__enter__()
+        self.database.create_tables([Timeline])
+        Utility.date_id_cache.clear()
+        self.reports = []
+
+    def tearDown(self):
+        self.binding.__exit__(None, None, None)
+        self.database.close()
+        self.dir.cleanup()
+        Utility.date_id_cache.clear()
+
+    def write(self, functions, max_batch=DbWriter.MAX_BATCH):
+        """ All are submitted before the writer starts, so they are coalesced up to max_batch. """
+        writer = DbWriter(database=self.database)
+        writer.MAX_BATCH = max_batch
+        for function in functions:
+            writer.submit(function, on_success=lambda result: self.reports.append(result),
+                          on_failure=lambda ex: self.reports.append(type(ex)))
+        writer.start()
+        writer.stop()
+        self.application.processEvents()  # reports are queued to this thread
+        return writer
+
+    @staticmethod
+    def create_date(date):
+        def create():
+            Utility.init_timeline_on_date(date)
+            return date
+        return create
+
+    @staticmethod
+    def fail_after(function):
+        def fail():
+            function()
+            raise ValueError
+        return fail
+
+    def get_dates(self):
+        return [date for date, in Timeline.select(Timeline.date).order_by(Timeline.date).tuples()]
+
+    def test_coalesce(self):
+        writer = self.write([self.create_date(date) for date in self.DATES])
+        self.assertEqual(1, writer.commits)
+        self.assertEqual(self.DATES, self.reports)
+        self.assertEqual(self.DATES, self.get_dates())
+
+    def test_max_batch(self):
+        writer = self.write([self.create_date(date) for date in self.DATES], max_batch=2)
+        self.assertEqual(3, writer.commits)
+        self.assertEqual(self.DATES, self.get_dates())
+
+    def test_savepoint(self):
+        """ A failed write is rolled back alone, others of its batch are committed. """
+        writer = self.write([self.create_date(self.DATES[0]), self.fail_after(self.create_date(self.DATES[1])),
+                             self.create_date(self.DATES[2])])
+        self.assertEqual(1, writer.commits)
+        self.assertEqual([self.DATES[0], ValueError, self.DATES[2]], self.reports)
+        self.assertEqual([self.DATES[0], self.DATES[2]], self.get_dates())
+        # The id of the rolled-back date isn't served by the cache.
+        Utility.init_timeline_on_date(self.DATES[1])
+        self.assertEqual(self.DATES[:3], self.get_dates())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+import json
+import os
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+
+from Model.DbTableModel.RecordModel import RecordUtility, RecordRow, ExtraRecordType
+from Model.DataAccessor.DbTableAccessor import BasicRecord, ExtraRecord, Timeline, fn, MODELS, open_unittest_copy
+from Model.DbTableModel.SleepModel import SleepUtility
+from Model import Utility
+
+DATETIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M")
+
+ImportReport = namedtuple('ImportReport', ['imported', 'errors', 'seconds'])
+SleepImportReport = namedtuple('SleepImportReport', ImportReport._fields + ('feedback',))
+RowError = namedtuple('RowError', ['line', 'message'])
+
+
+def read_rows(path):
+    """ (line number, row) of a CSV file with header as dict, or of a JSON lines file as text. """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8', newline='') as file:
+        if extension == '.csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+        elif extension in ('.jsonl', '.json'):
+            for line_num, line in enumerate(file, 1):
+                if line.strip():
+                    yield line_num, line
+        else:
+            raise ValueError("Unsupported file: %s" % path)
+
+
+def parse_row(row, get_group_id):
+    """
+    Convert a row of date, group and extras into RecordRow, raises ValueError if invalid.
+    :param row: {'date': 'YYYY-MM-DD', 'group': description or id, ExtraRecordType value: value or list of values},
+        or the text of it in JSON.
+    :param get_group_id: get the id of a group description or id, raises KeyError if not found.
+    """
+    if isinstance(row, str):
+        row = json.loads(row)  # raises ValueError
+    if not isinstance(row, dict):
+        raise ValueError("Not a record: %s" % row)
+    elif 'date' not in row or 'group' not in row:
+        raise ValueError("Both date and group are required.")
+
+    row = dict(row)
+    date = datetime.datetime.strptime(str(row.pop('date')).strip(), "%Y-%m-%d").date()
+    group = str(row.pop('group')).strip()
+    try:
+        group_id = get_group_id(group)
+    except KeyError:
+        raise ValueError("Unknown group: %s" % group)
+
+    extras = []
+    for key, values in row.items():
+        try:
+            type_ = ExtraRecordType.from_value(key)
+        except KeyError:
+            raise ValueError("Unknown column: %s" % key)
+
+        for value in (values if isinstance(values, list) else [values]):
+            value = '' if value is None else str(value).strip()
+            if not value:
+                continue
+            if type_ is not ExtraRecordType.DESCRIPTION:
+                float(value)  # raises ValueError
+            extras.append((type_, value))
+    return RecordRow(date, group_id, tuple(extras))
+
+
+def get_group_id(group):
+    """ Id of a group by its description or id. """
+    try:
+        return RecordUtility.Group.get_id_by_description(group)
+    except KeyError:
+        if group.isdigit() and int(group) in RecordUtility.Group.get_ids():
+            return int(group)
+        raise
+
+
+def parse_sleep_row(row):
+    """ Convert a row of start and end, or the text of it in JSON, into (start, end), raises ValueError if invalid. """
+    if isinstance(row, str):
+        row = json.loads(row)  # raises ValueError
+    if not isinstance(row, dict) or 'start' not in row or 'end' not in row:
+        raise ValueError("Both start and end are required.")
+    return parse_datetime(row['start']), parse_datetime(row['end'])
+
+
+def parse_datetime(text):
+    text = str(text).strip()
+    for format_ in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, format_)
+        except ValueError:
+            pass
+    raise ValueError("Invalid datetime: %s" % text)
+
+
+def import_records(path, chunk_size=1000):
+    """ Import valid rows of the file chunk by chunk, invalid rows are reported in errors. """
+    started = time.perf_counter()
+    Utility.warm_date_ids()
+    RecordUtility.Alias.reload()
+    imported = 0
+    errors = []
+    records = []
+    for line, row in read_rows(path):
+        try:
+            records.append(parse_row(row, get_group_id))
+        except ValueError as ex:
+            errors.append(RowError(line, str(ex)))
+
+        if len(records) >= chunk_size:
+            imported += RecordUtility.Basic.create_many(records)
+            records = []
+    imported += RecordUtility.Basic.create_many(records)
+    return ImportReport(imported, errors, time.perf_counter() - started)
+
+
+def import_sleeps(path):
+    """ Import all sleeps of the file in one transaction, nothing is imported if any row is invalid. """
+    started = time.perf_counter()
+    lines = []
+    intervals = []
+    errors = []
+    for line, row in read_rows(path):
+        try:
+            intervals.append(parse_sleep_row(row))
+            lines.append(line)
+        except ValueError as ex:
+            errors.append(RowError(line, str(ex)))
+    errors.extend(RowError(lines[index], reason) for index, reason in SleepUtility.validate_many(intervals))
+
+    if errors or not intervals:
+        return SleepImportReport(0, sorted(errors), time.perf_counter() - started, [])
+    Utility.warm_date_ids()
+    feedback = SleepUtility.create_many(intervals)
+    return SleepImportReport(len(intervals), [], time.perf_counter() - started, feedback)
+
+
+class _ParseRowTest(unittest.TestCase):
+    GROUPS = {'運動': 5, '5': 5}
+
+    def parse(self, row):
+        return parse_row(row, self.GROUPS.__getitem__)
+
+    def test_parse(self):
+        row = {'date': '2018-08-14', 'group': '運動', 'description': ['跑步 ', '游泳'], 'magnitude': 30, 'scale': ''}
+        self.assertEqual(
+            RecordRow(datetime.date(2018, 8, 14), 5, ((ExtraRecordType.DESCRIPTION, '跑步'),
+                                                      (ExtraRecordType.DESCRIPTION, '游泳'),
+                                                      (ExtraRecordType.MAGNITUDE, '30'))),
+            self.parse(row))
+
+    def test_parse_json(self):
+        self.assertEqual(RecordRow(datetime.date(2018, 8, 14), 5, ()),
+                         self.parse('{"date": "2018-08-14", "group": 5}'))
+
+    def test_invalid(self):
+        for row in ({'group': '5'},
+                    {'date': '2018/08/14', 'group': '5'},
+                    {'date': '2018-08-14', 'group': '讀書'},
+                    {'date': '2018-08-14', 'group': '5', 'note': 'a'},
+                    {'date': '2018-08-14', 'group': '5', 'scale': 'half'},
+                    ['2018-08-14', '5'],
+                    '{"date": "2018-08-14", "group": "5"'):
+            with self.assertRaises(ValueError):
+                self.parse(row)
+
+
+class _ParseSleepRowTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual((datetime.datetime(2018, 8, 14, 1, 10), datetime.datetime(2018, 8, 14, 8, 20, 30)),
+                         parse_sleep_row({'start': '2018-08-14 01:10', 'end': '2018-08-14T08:20:30'}))
+
+    def test_invalid(self):
+        for row in ({'start': '2018-08-14 01:10'}, {'start': '2018-08-14', 'end': '2018-08-14 08:20'}, '{"start"'):
+            with self.assertRaises(ValueError):
+                parse_sleep_row(row)
+
+
+class _ImportRecordsTest(unittest.TestCase):
+    ROWS = [
+        'date,group,description,magnitude',
+        '2018-09-01,運動,跑步,30',
+        '2018-09-01,5,游泳,',
+        '2018-09-02,讀書,,',
+        '2018-09-02,未知,,',
+        '2018-09-03,運動,跑步,fast',
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.database = open_unittest_copy(self.dir.name)
+        self.binding = self.database.bind_ctx(MODELS)
+        self.binding.__enter__()
+        self.reset_caches()
+        self.path = os.path.join(self.dir.name, 'records.csv')
+        with open(self.path, 'w', encoding='utf-8', newline='') as file:
+            file.write('\n'.join(self.ROWS) + '\n')
+
+    def tearDown(self):
+        self.binding.__exit__(None, None, None)
+        self.database.close()
+        self.dir.cleanup()
+        self.reset_caches()
+
+    @staticmethod
+    def reset_caches():
+        Utility.date_id_cache.clear()
+        RecordUtility.Group.update_cache()
+
+    @staticmethod
+    def get_imported(first_id):
+        """ (date, group_id, descriptions and magnitudes) of records with ids from first_id, ordered by id. """
+        records = (BasicRecord
+                   .select(BasicRecord.id, Timeline.date, BasicRecord.group_id)
+                   .join(Timeline)
+                   .where(BasicRecord.id >= first_id)
+                   .order_by(BasicRecord.id)
+                   .tuples())
+        extras = ExtraRecord.select(ExtraRecord.key, ExtraRecord.value).order_by(ExtraRecord.id).tuples()
+        return [(date, group_id, list(extras.where(ExtraRecord.basic_id == basic_id)))
+                for basic_id, date, group_id in records]
+
+    def test_import_csv(self):
+        first_id = BasicRecord.select(fn.MAX(BasicRecord.id)).scalar() + 1
+        report = import_records(self.path, chunk_size=2)
+        self.assertEqual(3, report.imported)
+        self.assertEqual([5, 6], [error.line for error in report.errors])
+        self.assertEqual([
+            (datetime.date(2018, 9, 1), 5, [('description', '跑步'), ('magnitude', '30')]),
+            (datetime.date(2018, 9, 1), 5, [('description', '游泳')]),
+            (datetime.date(2018, 9, 2), 1, []),
+        ], self.get_imported(first_id))
+
+    def test_import_after_max_rowid(self):
+        """ Rowids are random after the max one is used, extras are still kept with their records. """
+        BasicRecord.insert(id=2 ** 63 - 1, date_id=Timeline.select(Timeline.id).limit(1), group_id=1).execute()
+        report = import_records(self.path)
+        self.assertEqual(3, report.imported)
+        imported = [record for record in self.get_imported(0) if record[0] >= datetime.date(2018, 9, 1)]
+        self.assertEqual([[('description', '跑步'), ('magnitude', '30')], [('description', '游泳')], []],
+                         sorted((extras for _, _, extras in imported), key=len, reverse=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Totals of records by period, group and descriptions, without the DB models.
+Importing it doesn't open the DB, so summarize_shard is run by worker processes of RecordModel._ParallelSummarizer.
+"""
+from collections import namedtuple
+from enum import Enum
+from itertools import groupby
+from urllib.request import pathname2url
+import datetime
+import os
+import pickle
+import sqlite3
+import sys
+import unittest
+
+from Model.TimeUtility import get_week_start, get_month_start
+
+
+SummaryCell = namedtuple('SummaryCell', ['period', 'group_id', 'descriptions', 'volume', 'times', 'time', 'distance'])
+
+# Period of a date by DurationType.value
+PERIODS = {
+    'Daily': lambda date: date,
+    'Weekly': get_week_start,
+    'Monthly': get_month_start,
+}
+
+
+class ExtraRecordType(Enum):
+    DESCRIPTION = 'description'
+    MAGNITUDE = 'magnitude'
+    SCALE = 'scale'
+    TIME = 'time'
+    DISTANCE = 'distance'
+
+    @staticmethod
+    def from_value(value):
+        for type_ in ExtraRecordType:
+            if value == type_.value:
+                return type_
+        raise KeyError
+
+
+class DescriptionSummarizer(object):
+    # Hundreds of thousands are created by daily summaries, numeric extras are kept in slots.
+    __slots__ = ('times', 'descriptions', 'volume', '_time', '_distance')
+
+    def __init__(self, extra_dict):
+        super().__init__()
+        self._init(extra_dict[ExtraRecordType.DESCRIPTION],
+                   extra_dict.get(ExtraRecordType.MAGNITUDE, 0), extra_dict.get(ExtraRecordType.SCALE, 1),
+                   extra_dict.get(ExtraRecordType.TIME, 0), extra_dict.get(ExtraRecordType.DISTANCE, 0))
+
+    def _init(self, descriptions, magnitude, scale, time, distance):
+        self.times = 0
+        self.descriptions = descriptions
+        self.volume = float(magnitude) * float(scale)
+        self._time = float(time)
+        self._distance = float(distance)
+        self.time()
+
+    @classmethod
+    def from_extras(cls, extras):
+        """ From (key, value) of ExtraRecord, the last value of each numeric key is taken. """
+        descriptions = []
+        numbers = {ExtraRecordType.MAGNITUDE.value: 0, ExtraRecordType.SCALE.value: 1,
+                   ExtraRecordType.TIME.value: 0, ExtraRecordType.DISTANCE.value: 0}
+        for key, value in extras:
+            if key == ExtraRecordType.DESCRIPTION.value:
+                descriptions.append(value)
+            elif key in numbers:
+                numbers[key] = value
+            else:
+                raise KeyError(key)
+
+        summarizer = cls.__new__(cls)
+        summarizer._init(descriptions, numbers[ExtraRecordType.MAGNITUDE.value],
+                         numbers[ExtraRecordType.SCALE.value], numbers[ExtraRecordType.TIME.value],
+                         numbers[ExtraRecordType.DISTANCE.value])
+        return summarizer
+
+    @classmethod
+    def from_totals(cls, descriptions, volume, times, time, distance):
+        summarizer = cls.__new__(cls)
+        summarizer.times = times
+        summarizer.descriptions = descriptions
+        summarizer.volume = volume
+        summarizer._time = time
+        summarizer._distance = distance
+        return summarizer
+
+    @staticmethod
+    def get_key(descriptions):
+        """
+        Equal for the same descriptions in any order.
+        Most records have at most one description, their keys are the smaller tuple of it.
+        """
+        if len(descriptions) < 2:
+            return tuple(descriptions)
+        return len(descriptions), frozenset(descriptions)
+
+    @property
+    def key(self):
+        return self.get_key(self.descriptions)
+
+    @property
+    def others(self):
+        return {ExtraRecordType.DISTANCE: self._distance, ExtraRecordType.TIME: self._time}
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __iadd__(self, other):
+        self.volume += other.volume
+        self.times += other.times
+        self._time += other._time
+        self._distance += other._distance
+        return self
+
+    def time(self):
+        if self.volume == 0 and not self._time and not self._distance:
+            self.times += 1
+
+    def __str__(self):
+        if self.volume > 0 and self.times > 0:
+            count = "(%.1f+%d)" % (self.volume, self.times)
+        elif self.volume > 0:
+            count = "%.1f" % self.volume
+        elif self._time or self._distance:
+            count = ", ".join(["{0}{1}".format(type_.value[0:3], value)
+                              for type_, value in self.others.items() if value > 0])
+        else:  # self.times > 0
+            count = "%d" % self.times
+
+        if self.descriptions:
+            return count + "*" + repr(self.descriptions)
+        else:
+            return count
+
+
+def summarize_shard(path, duration, query):
+    """
+    Summarize records of the (sql, params) of RecordModel._ParallelSummarizer._get_shard_query
+    on a read-only connection of path, the same as RecordModel._Summarizer does.
+    :param duration: DurationType.value
+    :return: ((Timeline.id, BasicRecord.id) of the first record, [SummaryCell, ...]) of each period.
+    """
+    connection = sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(path)), uri=True)
+    try:
+        rows = connection.execute(*query).fetchall()
+    finally:
+        connection.close()
+
+    get_period = PERIODS[duration]
+    dates = {}  # ISO date: date
+    # period: (order of its first record, {group_id: {DescriptionSummarizer.key: DescriptionSummarizer}})
+    periods = {}
+    for (timeline_id, iso_date, basic_id, group_id), record_rows in groupby(rows, key=lambda row: row[0:4]):
+        date = dates.get(iso_date)
+        if date is None:
+            date = dates[iso_date] = datetime.datetime.strptime(iso_date[:10], '%Y-%m-%d').date()
+        period = get_period(date)
+        if period not in periods:
+            periods[period] = ((timeline_id, basic_id), {})
+        summarizer = DescriptionSummarizer.from_extras(
+            (key, value) for _, _, _, _, key, value in record_rows if key is not None)
+        groups = periods[period][1].setdefault(group_id, {})
+        matched = groups.get(summarizer.key)
+        if matched is None:
+            groups[summarizer.key] = summarizer
+        else:
+            matched += summarizer
+
+    return [(first, [SummaryCell(period, group_id, each.descriptions, each.volume, each.times,
+                                 each._time, each._distance)
+                     for group_id, groups in group_summarizers.items() for each in groups.values()])
+            for period, (first, group_summarizers) in periods.items()]
+
+
+def run_worker():
+    """ Summarize pickled (path, duration, [query, ...]) from stdin, results of the queries are pickled to stdout. """
+    path, duration, queries = pickle.load(sys.stdin.buffer)
+    pickle.dump([summarize_shard(path, duration, query) for query in queries], sys.stdout.buffer,
+                pickle.HIGHEST_PROTOCOL)
+
+
+class _DescriptionSummarizerTest(unittest.TestCase):
+    @staticmethod
+    def create_description_summarizer(desc, magn=0, scal=1):
+        return DescriptionSummarizer({
+            ExtraRecordType.DESCRIPTION: desc,
+            ExtraRecordType.MAGNITUDE: magn,
+            ExtraRecordType.SCALE: scal
+        })
+
+    def test_equality(self):
+        obj_99_1 = self.create_description_summarizer(['99'], scal=1)
+        self.assertTrue(obj_99_1 == obj_99_1)
+
+        obj_99_5 = self.create_description_summarizer(['99'], scal=5)
+        self.assertTrue(obj_99_1 == obj_99_5)
+
+        obj_99_k_2 = self.create_description_summarizer(['99', 'k'], magn=2)
+        self.assertFalse(obj_99_1 == obj_99_k_2)
+
+        obj_k_99_4 = self.create_description_summarizer(['k', '99'], magn=4)
+        self.assertFalse(obj_99_k_2 != obj_k_99_4)
+
+    def test_addition(self):
+        obj_99_v0 = self.create_description_summarizer(['99'])
+        self.assertEqual(0, obj_99_v0.volume)
+        self.assertEqual(1, obj_99_v0.times)
+        obj_99_k_v0 = self.create_description_summarizer(['99', 'k'])
+        self.assertEqual(0, obj_99_k_v0.volume)
+        self.assertEqual(1, obj_99_k_v0.times)
+
+        obj_99_v0 += obj_99_k_v0
+        self.assertEqual(0, obj_99_v0.volume)
+        self.assertEqual(2, obj_99_v0.times)
+
+        obj_99_k_v3 = self.create_description_summarizer(['99', 'k'], magn=3)
+        self.assertEqual(3, obj_99_k_v3.volume)
+        self.assertEqual(0, obj_99_k_v3.times)
+
+        obj_99_v0 += obj_99_k_v3
+        self.assertEqual(3, obj_99_v0.volume)
+        self.assertEqual(2, obj_99_v0.times)
+
+    def test_from_extras(self):
+        obj = DescriptionSummarizer.from_extras(
+            [('description', 'k'), ('magnitude', '2'), ('scale', '1.5'), ('description', '99'), ('time', '1')])
+        self.assertEqual(['k', '99'], obj.descriptions)
+        self.assertEqual(3, obj.volume)
+        self.assertEqual({ExtraRecordType.DISTANCE: 0, ExtraRecordType.TIME: 1}, obj.others)
+        self.assertEqual(self.create_description_summarizer(['99', 'k']), obj)
+        self.assertFalse(hasattr(obj, '__dict__'))
+        with self.assertRaises(KeyError):
+            DescriptionSummarizer.from_extras([('note', 'a')])
+
+    def test_key(self):
+        self.assertEqual(DescriptionSummarizer.get_key(['99', 'k']),
+                         DescriptionSummarizer.get_key(['k', '99']))
+        self.assertNotEqual(DescriptionSummarizer.get_key(['99']),
+                            DescriptionSummarizer.get_key(['99', '99']))
+        self.assertNotEqual(DescriptionSummarizer.get_key([]),
+                            DescriptionSummarizer.get_key(['']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,59 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import datetime
+import tempfile
+import unittest
+import unittest.mock
+
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
 from Model.DbTableModel.BaseModel import DurationType
 from Model.DbTableModel.SleepModel import SleepModel, SleepDurationModel
-from Model.DbTableModel.RecordModel import RecordGroupModel, RecordDurationModel
+from Model.DbTableModel.RecordModel import RecordGroupModel, RecordDurationModel, RecordUtility, RecordRow
+from Model.DataAccessor.DbTableAccessor import Timeline, BasicRecord, Sleep, fn, MODELS, open_unittest_copy
 from Model.Utility import DateFilter
+from Model import Utility
+from Model.DataAccessor import QueryInstrument
 
 
 class ProxyModel(QSortFilterProxyModel):
+    """
+    Sorting a source fetching rows in chunks covers all of its rows:
+    by the id column the rows are kept in the order the source fetches them, by other columns all rows are fetched.
+    """
     def __init__(self, source=None):
         super().__init__()
+        # (column, order) of the last sort, also applied to the source set afterwards.
+        self.sorted_by = None
         self.setSourceModel(SleepTableModel() if source is None else source)
 
+    def setSourceModel(self, source):
+        super().setSourceModel(source)
+        if self.sorted_by is not None:
+            self.sort(*self.sorted_by)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sorted_by = (column, order)
+        source = self.sourceModel()
+        if column >= 0 and source.FETCH_SIZE is not None:
+            if source.column_keys[column] == 'id':
+                # Ids are compared as numbers by the source, not as the text shown.
+                source.set_fetch_order(order == Qt.DescendingOrder)
+                column = -1
+            else:
+                source.fetch_all()
+        super().sort(column, order)
+
 
 class FilterProxyModel(QSortFilterProxyModel):
+    """ Filters are passed to the source model, which only fetches the rows accepted. """
     def __init__(self, duration=DurationType.DAILY, date_filter=DateFilter.Type.NO):
         super().__init__()
         self.duration = duration
         self.date_filter = date_filter
-        self.date_started_cache = DateFilter.get_date(date_filter)
 
+    @QueryInstrument.scoped
     def set_duration(self, duration):
         self.duration = duration
 
@@ -29,17 +61,14 @@ class FilterProxyModel(QSortFilterProxyModel):
         self.sourceModel().set_duration(duration)
         self.endResetModel()
 
+    @QueryInstrument.scoped
     def set_date_filter(self, date_filter):
         self.date_filter = date_filter
-        self.date_started_cache = DateFilter.get_date(date_filter)
 
         self.beginResetModel()
+        self.sourceModel().set_date_filter(date_filter)
         self.endResetModel()
 
-    def filterAcceptsRow(self, row, model_index):
-        date = self.sourceModel().get_record_date(self.sourceModel().model_data[row])
-        return self.date_started_cache <= date
-
     def filterAcceptsColumn(self, column, model_index):
         return not (column in self.sourceModel().HIDDEN_COLUMNS)
 
@@ -47,25 +76,90 @@ class FilterProxyModel(QSortFilterProxyModel):
 class BaseTableModel(QAbstractTableModel):
     DB_MODEL = None
     HIDDEN_COLUMN_0 = True
+    # Rows fetched on first paint and on each fetchMore, None to fetch all at once.
+    FETCH_SIZE = None
 
     @classmethod
     def get_column_headers(cls, *args):
         return list(cls.DB_MODEL.get_column_names(*args))
 
+    @classmethod
+    def get_column_keys(cls, *args):
+        return list(cls.DB_MODEL.get_column_keys(*args))
+
     @classmethod
     def get_model_data(cls, *args):
         return list(cls.DB_MODEL.get_data(*args))
 
+    @classmethod
+    def get_model_data_chunk(cls, last_record, *args, descending=False):
+        last_id = None if last_record is None else last_record.id
+        return list(cls.DB_MODEL.get_data_chunk(last_id, cls.FETCH_SIZE, *args, descending=descending))
+
     def __init__(self):
         if not self.DB_MODEL:
             raise NotImplementedError
 
         super().__init__()
+        # Rows are fetched by id in descending order if True, only used with FETCH_SIZE.
+        self.fetch_descending = False
         self._init_data()
+        self.dataChanged.connect(self._on_data_changed)
+        self.rowsInserted.connect(self._on_rows_shifted)
+        self.rowsRemoved.connect(self._on_rows_shifted)
 
     def _init_data(self, *args):
         self.column_headers = self.get_column_headers(*args)
-        self.model_data = self.get_model_data(*args)
+        self.column_keys = self.get_column_keys(*args)
+        if self.FETCH_SIZE is None:
+            self.model_data = self.get_model_data(*args)
+            self.fetched_all = True
+        else:
+            self.model_data = self.get_model_data_chunk(None, *args, descending=self.fetch_descending)
+            self.fetched_all = len(self.model_data) < self.FETCH_SIZE
+        self.fetch_args = args
+        # Text of the cells shown, {(row, column): str}, since str of summaries is costly on every paint.
+        # Cleared with the data, cells are dropped on dataChanged and rows after those inserted or removed.
+        self.display_cache = {}
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            for column in range(top_left.column(), bottom_right.column() + 1):
+                self.display_cache.pop((row, column), None)
+
+    def _on_rows_shifted(self, parent, first, last):
+        """ Cells from row first are dropped, which are none when rows are appended. """
+        self.display_cache = {(row, column): text for (row, column), text in self.display_cache.items()
+                              if row < first}
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.fetched_all
+
+    @QueryInstrument.scoped
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+
+        chunk = self.get_model_data_chunk(self.model_data[-1] if self.model_data else None, *self.fetch_args,
+                                          descending=self.fetch_descending)
+        self.fetched_all = len(chunk) < self.FETCH_SIZE
+        if chunk:
+            self.beginInsertRows(QModelIndex(), len(self.model_data), len(self.model_data) + len(chunk) - 1)
+            self.model_data.extend(chunk)
+            self.endInsertRows()
+
+    def fetch_all(self):
+        while self.canFetchMore():
+            self.fetchMore()
+
+    def set_fetch_order(self, descending):
+        """ Fetch rows by id in the order again from the first chunk, if the order is changed. """
+        if descending == self.fetch_descending:
+            return
+        self.beginResetModel()
+        self.fetch_descending = descending
+        self._init_data(*self.fetch_args)
+        self.endResetModel()
 
     def rowCount(self, *args):
         return len(self.model_data)
@@ -75,10 +169,12 @@ class BaseTableModel(QAbstractTableModel):
 
     def data(self, q_index, role=None):
         if role == Qt.DisplayRole:
-            record = self.model_data[q_index.row()]
-            c_index = q_index.column()
-            value = self.get_record_data(record, c_index)
-            return '-' if value is None else str(value)
+            key = (q_index.row(), q_index.column())
+            text = self.display_cache.get(key)
+            if text is None:
+                value = self.get_record_data(self.model_data[key[0]], key[1])
+                text = self.display_cache[key] = '-' if value is None else str(value)
+            return text
         if role == Qt.BackgroundRole:
             return QBrush(Qt.darkGray)
         if role == Qt.TextColorRole:
@@ -92,17 +188,22 @@ class BaseTableModel(QAbstractTableModel):
                 return index
 
     def get_record_data(self, record, index):
-        attr = self.column_headers[index]
+        attr = self.column_keys[index]
         return self.DB_MODEL.get_record_attr(record, attr)
 
 
 class BaseRawTableModel(BaseTableModel):
     DB_MODEL = None
+    FETCH_SIZE = 200
 
     @classmethod
     def get_column_headers(cls):
         return super().get_column_headers()
 
+    @classmethod
+    def get_column_keys(cls):
+        return super().get_column_keys()
+
     @classmethod
     def get_model_data(cls):
         return super().get_model_data()
@@ -127,20 +228,32 @@ class BaseDurationTableModel(BaseTableModel):
     HIDDEN_COLUMNS = [0]
 
     @classmethod
-    def get_column_headers(cls, duration):
+    def get_column_headers(cls, duration, date_filter=None):
         return super().get_column_headers(duration)
 
     @classmethod
-    def get_model_data(cls, duration):
-        return super().get_model_data(duration)
+    def get_column_keys(cls, duration, date_filter=None):
+        return super().get_column_keys(duration)
 
-    def _init_data(self, duration=None):
+    @classmethod
+    def get_model_data(cls, duration, date_filter=None):
+        date_start = None if date_filter is None else DateFilter.get_date(date_filter)
+        return super().get_model_data(duration, date_start)
+
+    def _init_data(self, duration=None, date_filter=None):
         if duration is None:
             duration = self.DEFAULT_DURATION
-        super()._init_data(duration)
+        if date_filter is None:
+            date_filter = self.DEFAULT_DATE_FILTER
+        self.duration = duration
+        self.date_filter = date_filter
+        super()._init_data(duration, date_filter)
 
     def set_duration(self, duration):
-        self._init_data(duration)
+        self._init_data(duration, self.date_filter)
+
+    def set_date_filter(self, date_filter):
+        self._init_data(self.duration, date_filter)
 
     def get_record_date(self, record):
         # Assuming date will always be index 1.
@@ -154,10 +267,198 @@ class SleepDurationTableModel(BaseDurationTableModel):
 
 
 class RecordDurationTableModel(BaseDurationTableModel):
+    """ Records committed afterwards are summarized into the shown periods, without summarizing all again. """
     DB_MODEL = RecordDurationModel
     DEFAULT_DURATION = DurationType.DAILY
     DEFAULT_DATE_FILTER = DateFilter.Type.ONE_MONTH
     HIDDEN_COLUMNS = []
+    # More committed records at once are shown by summarizing all again, e.g. imported ones.
+    MAX_ADDED_RECORDS = 1000
+
+    # Emitted on the committing thread, add_records is queued to the thread of the model.
+    records_committed = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.records_committed.connect(self.add_records)
+        RecordUtility.Basic.add_listener(self._on_records_committed)
+
+    def _init_data(self, duration=None, date_filter=None):
+        super()._init_data(duration, date_filter)
+        # Summaries are in the order of Timeline ids, which is not the order of dates if dates are added back.
+        self.model_data.sort(key=lambda record: record.date)
+        self.cutoff = self.DB_MODEL.get_period_cutoff(self.duration, DateFilter.get_date(self.date_filter))
+        self.rows = {record.date: row for row, record in enumerate(self.model_data)}
+        self.group_columns = {key: column for column, key in enumerate(self.column_keys) if isinstance(key, int)}
+
+    def _on_records_committed(self, rows):
+        self.records_committed.emit(rows)
+
+    def add_records(self, rows):
+        """ Add RecordRow to their period, changing only their cells or inserting the row of a new period. """
+        if len(rows) > self.MAX_ADDED_RECORDS or any(row.group_id not in self.group_columns for row in rows):
+            self.beginResetModel()
+            self._init_data(self.duration, self.date_filter)
+            self.endResetModel()
+            return
+
+        for row in rows:
+            if row.date < self.cutoff:
+                continue
+            period = self.DB_MODEL.get_period(self.duration, row.date)
+            if period in self.rows:
+                self.model_data[self.rows[period]].add(row)
+                index = self.index(self.rows[period], self.group_columns[row.group_id])
+                self.dataChanged.emit(index, index)
+            else:
+                record = self.DB_MODEL.create_record(period)
+                record.add(row)
+                self._insert_record(record)
+
+    def _insert_record(self, record):
+        """ Insert before the records of later periods, which are usually none. """
+        position = len(self.model_data)
+        while position and self.model_data[position - 1].date > record.date:
+            position -= 1
+
+        self.beginInsertRows(QModelIndex(), position, position)
+        self.model_data.insert(position, record)
+        if position == len(self.model_data) - 1:
+            self.rows[record.date] = position
+        else:
+            self.rows = {other.date: row for row, other in enumerate(self.model_data)}
+        self.endInsertRows()
 
     def get_record_date(self, record):
         return self.get_record_data(record, 0)
+
+
+class _FixtureTest(unittest.TestCase):
+    """ Models are bound to a copy of the unittest DB. """
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.database = open_unittest_copy(self.dir.name)
+        self.binding = self.database.bind_ctx(MODELS)
+        self.binding.__enter__()
+        self.reset_caches()
+
+    def tearDown(self):
+        self.binding.__exit__(None, None, None)
+        self.database.close()
+        self.dir.cleanup()
+        self.reset_caches()
+
+    @staticmethod
+    def reset_caches():
+        Utility.date_id_cache.clear()
+        RecordUtility.Group.update_cache()
+        RecordDurationModel.update_cache()
+
+
+class _SleepTableModelTest(_FixtureTest):
+    """ The unittest DB has 11 sleeps, fetched 4 at a time. """
+    def setUp(self):
+        super().setUp()
+        self.patch = unittest.mock.patch.object(SleepTableModel, 'FETCH_SIZE', 4)
+        self.patch.start()
+        self.model = SleepTableModel()
+
+    def tearDown(self):
+        self.patch.stop()
+        super().tearDown()
+
+    def get_ids(self, model=None):
+        model = self.model if model is None else model
+        return [model.data(model.index(row, 0), Qt.DisplayRole) for row in range(model.rowCount())]
+
+    def test_fetch_more(self):
+        self.assertEqual(4, self.model.rowCount())
+        self.assertTrue(self.model.canFetchMore())
+        self.model.fetchMore()
+        self.assertEqual(8, self.model.rowCount())
+        self.model.fetch_all()
+        self.assertEqual(11, self.model.rowCount())
+        self.assertFalse(self.model.canFetchMore())
+        ids = [record.id for record in self.model.model_data]
+        self.assertEqual(sorted(ids), ids)
+
+    def test_sort_by_id(self):
+        """ Rows are fetched in the order sorted, the latest ones first if descending. """
+        proxy = ProxyModel(self.model)
+        proxy.sort(0, Qt.DescendingOrder)
+        self.assertEqual(4, proxy.rowCount())
+        self.assertEqual(['10', '9', '8', '7'], self.get_ids(proxy))
+        self.model.fetch_all()
+        self.assertEqual([str(id_) for id_ in range(10, -1, -1)], self.get_ids(proxy))
+
+    def test_sort_by_other_column(self):
+        proxy = ProxyModel(self.model)
+        proxy.sort(2, Qt.DescendingOrder)
+        self.assertEqual(11, proxy.rowCount())
+        self.assertEqual(str(Sleep.select(fn.MAX(Sleep.end)).scalar()), proxy.data(proxy.index(0, 2), Qt.DisplayRole))
+
+        proxy.sort(0, Qt.AscendingOrder)
+        self.assertEqual([str(id_) for id_ in range(11)], self.get_ids(proxy))
+
+    def test_sorted_before_set(self):
+        proxy = ProxyModel()
+        proxy.sort(0, Qt.DescendingOrder)
+        proxy.setSourceModel(self.model)
+        self.assertEqual(['10', '9', '8', '7'], self.get_ids(proxy))
+
+    def test_display_cache(self):
+        self.get_ids()
+        self.model.data(self.model.index(2, 1), Qt.DisplayRole)
+        self.assertEqual({(0, 0), (1, 0), (2, 0), (3, 0), (2, 1)}, set(self.model.display_cache))
+
+        self.model.dataChanged.emit(self.model.index(2, 0), self.model.index(2, 1))
+        self.assertEqual({(0, 0), (1, 0), (3, 0)}, set(self.model.display_cache))
+        self.model.fetchMore()  # appended, no cell is dropped
+        self.assertEqual({(0, 0), (1, 0), (3, 0)}, set(self.model.display_cache))
+
+        self.model.beginRemoveRows(QModelIndex(), 1, 1)
+        removed = self.model.model_data.pop(1)
+        self.model.endRemoveRows()
+        self.assertEqual({(0, 0)}, set(self.model.display_cache))
+        self.assertEqual([str(self.model.model_data[row].id) for row in range(2)], self.get_ids()[:2])
+
+        self.model.beginInsertRows(QModelIndex(), 1, 1)
+        self.model.model_data.insert(1, removed)
+        self.model.endInsertRows()
+        self.assertEqual({(0, 0)}, set(self.model.display_cache))
+        self.assertEqual(str(removed.id), self.get_ids()[1])
+
+
+class _RecordDurationTableModelTest(_FixtureTest):
+    def setUp(self):
+        super().setUp()
+        # Added after later dates, so its Timeline id is the largest.
+        date_id = Timeline.create(date=datetime.date(2018, 8, 1)).id
+        BasicRecord.create(date_id=date_id, group_id=1)
+        self.model = RecordDurationTableModel()
+        self.model.set_date_filter(DateFilter.Type.NO)
+
+    def tearDown(self):
+        RecordUtility.Basic.remove_listener(self.model._on_records_committed)
+        super().tearDown()
+
+    def get_dates(self):
+        return [record.date for record in self.model.model_data]
+
+    def test_sorted_by_date(self):
+        dates = self.get_dates()
+        self.assertEqual(datetime.date(2018, 8, 1), dates[0])
+        self.assertEqual(sorted(dates), dates)
+        self.assertEqual({date: row for row, date in enumerate(dates)}, self.model.rows)
+
+    def test_insert_by_date(self):
+        date = datetime.date(2018, 8, 2)
+        self.model.add_records([RecordRow(date, 1, ())])
+        dates = self.get_dates()
+        self.assertEqual(date, dates[1])
+        self.assertEqual(sorted(dates), dates)
+        self.assertEqual(1, self.model.rows[date])
+
+
+if __name__ == "__main__":
+    unittest.main()
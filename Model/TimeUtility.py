@@ -26,6 +26,19 @@ def get_month_start(date):
     return date.replace(day=1)
 
 
+def get_next_week_start(date):
+    """ The first monday on or after date. """
+    start = get_week_start(date)
+    return start if start == date else start + datetime.timedelta(days=7)
+
+
+def get_next_month_start(date):
+    """ The first day of month on or after date. """
+    if date.day == 1:
+        return date
+    return (date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
 class _GetWeekStartAndEndTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -58,5 +71,18 @@ class _GetWeekStartAndEndTest(unittest.TestCase):
             self.assertEqual(end, self.days_in_one_week[6])
 
 
+class _GetNextPeriodStartTest(unittest.TestCase):
+    def test_next_week_start(self):
+        self.assertEqual(datetime.date(2018, 10, 15), get_next_week_start(datetime.date(2018, 10, 15)))
+        self.assertEqual(datetime.date(2018, 10, 22), get_next_week_start(datetime.date(2018, 10, 16)))
+        self.assertEqual(datetime.date(2018, 10, 22), get_next_week_start(datetime.date(2018, 10, 21)))
+
+    def test_next_month_start(self):
+        self.assertEqual(datetime.date(2018, 10, 1), get_next_month_start(datetime.date(2018, 10, 1)))
+        self.assertEqual(datetime.date(2018, 11, 1), get_next_month_start(datetime.date(2018, 10, 2)))
+        self.assertEqual(datetime.date(2018, 3, 1), get_next_month_start(datetime.date(2018, 2, 28)))
+        self.assertEqual(datetime.date(2019, 1, 1), get_next_month_start(datetime.date(2018, 12, 31)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,23 +2,34 @@
 # -*- coding: utf-8 -*-
 from types import SimpleNamespace
 
-from Model.DataAccessor.DbTableAccessor import RecordGroup
+from Model.DbTableModel.RecordModel import RecordUtility
 
 
 class RecordGroupTreeModel(object):
     @staticmethod
     def get_tree():
-        raw_data = RecordGroup.select()
-        return RecordGroupTreeModel.create_root(raw_data)
+        return RecordGroupTreeModel.create_root(
+            RecordUtility.Group.get_groups(), RecordUtility.Group.get_hierarchy())
 
     @staticmethod
-    def create_root(record_group_data):
-        root = SimpleNamespace()
-        root.id = -1
-        root.description = "root"
-        root.children = list(filter(lambda datum: datum.parent is None, record_group_data))
+    def create_root(record_group_data, hierarchy):
+        nodes = {datum.id: RecordGroupTreeModel.create_node(datum.id, datum.description)
+                 for datum in record_group_data}
+        for id_, node in nodes.items():
+            node.children = [nodes[child_id] for child_id in hierarchy.get_children_ids(id_) if child_id in nodes]
+
+        root = RecordGroupTreeModel.create_node(-1, "root")
+        root.children = [node for id_, node in nodes.items() if hierarchy.get_parent_id(id_) is None]
         return root
 
+    @staticmethod
+    def create_node(id_, description):
+        node = SimpleNamespace()
+        node.id = id_
+        node.description = description
+        node.children = []
+        return node
+
 
 if __name__ == "__main__":
     pass
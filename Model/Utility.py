@@ -1,21 +1,227 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import datetime
+import os
+import tempfile
+import threading
+import unittest
 from enum import Enum
 
+from peewee import SqliteDatabase
+
 from Model.DataAccessor.DbTableAccessor import Timeline
 
 
 def init_timeline_on_date(date):
-    """ Make sure the given date is on table Timeline. """
-    return Timeline.get_or_create(date=date)
+    """ Make sure the given date is on table Timeline, returns its id. """
+    return date_id_cache.get_or_create(date)
 
 
 def get_or_create_date_id(date):
     if isinstance(date, Timeline):
-        return date[0]
+        return date.id
     else:
-        return Timeline.get_or_create(date=date)[0]
+        return date_id_cache.get_or_create(date)
+
+
+def get_or_create_date_ids(dates):
+    """ Ids of the given dates on table Timeline as {date: id}, missing dates are inserted. """
+    return date_id_cache.get_or_create_many(dates)
+
+
+def warm_date_ids():
+    """ Load all dates of table Timeline into date_id_cache, before looking up many dates such as imports. """
+    date_id_cache.warm()
+
+
+def atomic():
+    """ Same as Model.atomic(), should be used for transactions creating dates to keep date_id_cache correct. """
+    return date_id_cache.atomic()
+
+
+def on_commit(callback):
+    """
+    Call callback after the outermost transaction of atomic() on this thread commits, or at once outside of it.
+    Dropped if its transaction or savepoint is rolled back.
+    """
+    if _commit_callbacks.levels:
+        _commit_callbacks.levels[-1].append(callback)
+    else:
+        callback()
+
+
+def _chunk(items, size):
+    return (items[index:index + size] for index in range(0, len(items), size))
+
+
+class DateIdCache(object):
+    """
+    Process-wide cache of date -> Timeline id.
+    Ids got in a transaction are pending, which are served in the same transaction until any rollback.
+    Others pending are checked by one query on next use, and dropped if rolled back.
+    Used by the writer thread and the GUI or CLI, mutations are made under a lock and queries outside of it.
+    """
+    CHUNK = 300
+    # Transaction of pending ids which may be rolled back.
+    UNSURE = object()
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._ids = {}
+        # {date: (id, transaction got in)}
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, date):
+        date_id = self._get(date)
+        if date_id is None:
+            date_id = Timeline.get_or_create(date=date)[0].id
+            self._add({date: date_id})
+        return date_id
+
+    def get_or_create_many(self, dates):
+        date_ids = {}
+        missing = []
+        for date in sorted(set(dates)):
+            date_id = self._get(date)
+            if date_id is None:
+                missing.append(date)
+            else:
+                date_ids[date] = date_id
+
+        if missing:
+            with self.atomic():
+                for chunk in _chunk(missing, self.CHUNK):
+                    found = dict(self._select(Timeline.date.in_(chunk)))
+                    created = [{'date': date} for date in chunk if date not in found]
+                    if created:
+                        Timeline.insert_many(created).execute()
+                        found = dict(self._select(Timeline.date.in_(chunk)))
+                    date_ids.update(found)
+            self._add({date: date_ids[date] for date in missing})
+        return date_ids
+
+    def warm(self):
+        """ Load all dates at once. """
+        self._add(dict(self._select()))
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._pending.clear()
+            self.hits = self.misses = 0
+
+    def rollback(self):
+        """ Should be called on rolling back, including savepoints. """
+        with self._lock:
+            self._pending = {date: (id_, self.UNSURE) for date, (id_, _) in self._pending.items()}
+
+    def atomic(self):
+        return _CachedAtomic(self)
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._ids), 'pending': len(self._pending)}
+
+    def _get(self, date):
+        """ The cached id, None if missed. """
+        self._check_pending(self._get_transaction())
+        with self._lock:
+            try:
+                date_id = self._ids[date]
+            except KeyError:
+                try:
+                    date_id = self._pending[date][0]
+                except KeyError:
+                    self.misses += 1
+                    return None
+            self.hits += 1
+            return date_id
+
+    def _add(self, date_ids):
+        transaction = self._get_transaction()
+        with self._lock:
+            if transaction is None:
+                self._ids.update(date_ids)
+            else:
+                self._pending.update((date, (id_, transaction)) for date, id_ in date_ids.items())
+
+    def _check_pending(self, transaction):
+        """ Confirm or drop pending ids not got in the current transaction. """
+        with self._lock:
+            checking = {date: pending for date, pending in self._pending.items() if pending[1] is not transaction}
+        if not checking:
+            return
+
+        existing = set()
+        for chunk in _chunk([id_ for id_, _ in checking.values()], self.CHUNK):
+            existing.update(self._select(Timeline.id.in_(chunk)))
+        with self._lock:
+            for date, (id_, got_in) in checking.items():
+                # Skipped if changed by another thread while querying.
+                if self._pending.get(date) != (id_, got_in):
+                    continue
+                del self._pending[date]
+                if (date, id_) not in existing:
+                    continue
+                if got_in is not self.UNSURE or transaction is None:  # committed
+                    self._ids[date] = id_
+                else:  # still in the transaction
+                    self._pending[date] = (id_, transaction)
+
+    @staticmethod
+    def _get_transaction():
+        return Timeline._meta.database.top_transaction()
+
+    @staticmethod
+    def _select(*conditions):
+        query = Timeline.select(Timeline.date, Timeline.id).tuples()
+        return query.where(*conditions) if conditions else query
+
+
+class _CommitCallbacks(threading.local):
+    def __init__(self):
+        super().__init__()
+        # Callbacks of each open atomic(), the outermost first.
+        self.levels = []
+
+
+class _CachedAtomic(object):
+    """ Wrapper of Model.atomic(), which reports rollbacks to DateIdCache and runs on_commit callbacks. """
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+        self.atomic = Timeline._meta.database.atomic()
+        self.context = None
+
+    def __enter__(self):
+        self.context = self.atomic.__enter__()
+        _commit_callbacks.levels.append([])
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        callbacks = _commit_callbacks.levels.pop()
+        if exc_type is not None:
+            self.cache.rollback()
+        result = self.atomic.__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is None:
+            if _commit_callbacks.levels:  # savepoint released, still up to the outer transaction
+                _commit_callbacks.levels[-1].extend(callbacks)
+            else:
+                for callback in callbacks:
+                    callback()
+        return result
+
+    def rollback(self):
+        self.cache.rollback()
+        _commit_callbacks.levels[-1].clear()
+        self.context.rollback()
+
+
+date_id_cache = DateIdCache()
+_commit_callbacks = _CommitCallbacks()
 
 
 class DateFilter(object):
@@ -37,3 +243,138 @@ class DateFilter(object):
             return datetime.date.today() - datetime.timedelta(days=730)
         else:
             raise KeyError
+
+
+class _DateIdCacheTest(unittest.TestCase):
+    DATES = [datetime.date(2018, 8, day) for day in range(1, 6)]
+
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.binding = self.database.bind_ctx([Timeline])
+        self.binding.__enter__()
+        self.database.create_tables([Timeline])
+        self.cache = DateIdCache()
+
+    def tearDown(self):
+        self.binding.__exit__(None, None, None)
+        self.database.close()
+
+    def test_hit_and_miss(self):
+        date_id = self.cache.get_or_create(self.DATES[0])
+        self.assertEqual(date_id, self.cache.get_or_create(self.DATES[0]))
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1, 'pending': 0}, self.cache.get_stats())
+        self.assertEqual(1, Timeline.select().count())
+
+    def test_many(self):
+        self.cache.get_or_create(self.DATES[1])
+        date_ids = self.cache.get_or_create_many(self.DATES)
+        self.assertEqual(dict(Timeline.select(Timeline.date, Timeline.id).tuples()), date_ids)
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(5, self.cache.get_stats()['size'])
+
+    def test_rollback(self):
+        with self.cache.atomic():
+            committed = self.cache.get_or_create(self.DATES[0])
+            self.assertEqual(committed, self.cache.get_or_create(self.DATES[0]))
+        with self.cache.atomic() as transaction:
+            self.cache.get_or_create(self.DATES[1])
+            self.cache.get_or_create_many(self.DATES[2:4])
+            self.assertEqual({'hits': 1, 'misses': 4, 'size': 1, 'pending': 3}, self.cache.get_stats())
+            transaction.rollback()
+
+        self.assertEqual(committed, self.cache.get_or_create(self.DATES[0]))
+        self.assertEqual({'hits': 2, 'misses': 4, 'size': 1, 'pending': 0}, self.cache.get_stats())
+        date_id = self.cache.get_or_create(self.DATES[1])
+        self.assertEqual(Timeline.get(Timeline.date == self.DATES[1]).id, date_id)
+
+    def test_savepoint(self):
+        with self.cache.atomic():
+            with self.cache.atomic():
+                released = self.cache.get_or_create(self.DATES[0])
+            with self.assertRaises(ValueError):
+                with self.cache.atomic():
+                    self.cache.get_or_create(self.DATES[1])
+                    raise ValueError
+            self.assertEqual(released, self.cache.get_or_create(self.DATES[0]))
+            self.assertEqual(1, self.cache.get_stats()['pending'])
+        self.cache.get_or_create(self.DATES[2])
+        self.assertEqual({'hits': 1, 'misses': 3, 'size': 2, 'pending': 0}, self.cache.get_stats())
+        self.assertEqual(2, Timeline.select().count())
+
+    def test_warm(self):
+        Timeline.insert_many([{'date': date} for date in self.DATES]).execute()
+        self.cache.warm()
+        self.cache.get_or_create_many(self.DATES)
+        self.assertEqual(5, self.cache.hits)
+        self.assertEqual(0, self.cache.misses)
+
+    def test_threads(self):
+        """ Dates created in transactions of the writer thread are looked up by other threads meanwhile. """
+        directory = tempfile.TemporaryDirectory()
+        database = SqliteDatabase(os.path.join(directory.name, 'threads.db'))
+        dates = [datetime.date(2018, 1, 1) + datetime.timedelta(days=days) for days in range(400)]
+        committed = []
+        found = []
+        errors = []
+
+        def write():
+            try:
+                for index in range(0, len(dates), 10):
+                    with self.cache.atomic():
+                        self.cache.get_or_create_many(dates[index:index + 10])
+                    committed.extend(dates[index:index + 10])
+            except Exception as ex:
+                errors.append(ex)
+            finally:
+                database.close()
+
+        def read():
+            try:
+                while writer.is_alive():
+                    found.append(self.cache.get_or_create_many(committed[-50:]))
+                    self.cache.get_stats()
+            except Exception as ex:
+                errors.append(ex)
+            finally:
+                database.close()
+        try:
+            with database.bind_ctx([Timeline]):
+                database.create_tables([Timeline])
+                writer = threading.Thread(target=write)
+                readers = [threading.Thread(target=read) for _ in range(3)]
+                for thread in [writer] + readers:
+                    thread.start()
+                for thread in [writer] + readers:
+                    thread.join()
+                self.assertEqual([], errors)
+                expected = dict(Timeline.select(Timeline.date, Timeline.id).tuples())
+                self.assertEqual(len(dates), len(expected))
+                self.assertTrue(all(date_ids.items() <= expected.items() for date_ids in found))
+                self.assertEqual(expected, self.cache.get_or_create_many(dates))
+                self.assertEqual(len(dates), self.cache.get_stats()['size'])
+        finally:
+            database.close()
+            directory.cleanup()
+
+    def test_on_commit(self):
+        called = []
+        with self.cache.atomic():
+            with self.cache.atomic():
+                on_commit(lambda: called.append('released'))
+            with self.assertRaises(ValueError):
+                with self.cache.atomic():
+                    on_commit(lambda: called.append('rolled back'))
+                    raise ValueError
+            self.assertEqual([], called)
+        self.assertEqual(['released'], called)
+
+        with self.cache.atomic() as transaction:
+            on_commit(lambda: called.append('rolled back'))
+            transaction.rollback()
+            on_commit(lambda: called.append('after rollback'))
+        on_commit(lambda: called.append('outside'))
+        self.assertEqual(['released', 'after rollback', 'outside'], called)
+
+
+if __name__ == "__main__":
+    unittest.main()
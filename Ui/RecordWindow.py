@@ -7,6 +7,8 @@ from PyQt5.QtCore import QDate
 from Ui.Utility.Window import SimpleAdderWindow
 from Ui.Utility.Widget import DateEdit, MapComboBox, RecordGroupComboBox
 from Model.DbTableModel.RecordModel import RecordUtility, ExtraRecordType
+from Model import DbWriter
+from Model.DataAccessor import QueryInstrument
 
 
 class RecordAdderWindow(SimpleAdderWindow):
@@ -52,19 +54,25 @@ class RecordAdderPanel(QWidget):
     def reset_extra(self):
         self.extra.reset_values()
 
+    @QueryInstrument.scoped
     def add(self):
         date = self.date.get_date()
         group_id = self.group.currentData()
-        extras = self.extra.get_values()
+        extras = list(self.extra.get_values())
 
-        try:
-            basic = RecordUtility.Basic.create_with_extras(date, group_id, extras)
-        except ValueError as ex:
-            self.owner.message_box.setText("Failed. (ValueError: %s)" % str(ex))
-        else:
-            self.owner.message_box.setText("{0}, {1}:  {2}".format(
-                date, basic.group_id.description, basic.joined_extra))
-            self.reset_extra()
+        # Extras are joined on the writer thread, the GUI thread doesn't query.
+        DbWriter.submit(lambda: RecordUtility.Basic.create_with_extras(date, group_id, extras).joined_extra,
+                        on_success=lambda joined_extra: self.on_added(date, group_id, joined_extra),
+                        on_failure=self.on_failed)
+        self.owner.message_box.setText("Saving...")
+
+    def on_added(self, date, group_id, joined_extra):
+        self.reset_extra()
+        self.owner.message_box.setText("{0}, {1}:  {2}".format(
+            date, RecordUtility.Group.get_group(group_id).description, joined_extra))
+
+    def on_failed(self, ex):
+        self.owner.message_box.setText("Failed. (%s: %s)" % (type(ex).__name__, str(ex)))
 
 
 class ExtraRecordList(QWidget):
@@ -161,25 +169,33 @@ class RecordGroupAdderPanel(QWidget):
     def reset_properties(self):
         self.description.setText("")
 
+    @QueryInstrument.scoped
     def add(self):
         description = self.description.text()
         parent_id = self.parent_group.currentData()
+        parent_text = self.parent_group.currentText()
 
-        try:
-            group = RecordUtility.Group.add(description, parent_id)
-        except ValueError as ex:
-            self.owner.message_box.setText("Failed. (ValueError: %s)" % str(ex))
-        else:
-            self.owner.message_box.setText(
-                "{0} has been created under {1}.".format(
-                    group, self.parent_group.currentText()))
+        def create():
+            # Caches are loaded on the writer thread and set on the GUI thread, which reads them.
+            return RecordUtility.Group.create(description, parent_id), RecordUtility.Group.load_cache()
+
+        DbWriter.submit(create, on_success=lambda result: self.on_added(*result, parent_text),
+                        on_failure=self.on_failed)
+        self.owner.message_box.setText("Saving...")
+
+    def on_added(self, group, cache, parent_text):
+        RecordUtility.Group.update_cache(cache)
+        self.reset_properties()
+        self.owner.message_box.setText("{0} has been created under {1}.".format(group, parent_text))
+        self.parent_group.insert_item_by_group(group)
 
-            self.reset_properties()
-            self.parent_group.insert_item_by_group(group)
+    def on_failed(self, ex):
+        self.owner.message_box.setText("Failed. (%s: %s)" % (type(ex).__name__, str(ex)))
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(DbWriter.shutdown)
 
     window = RecordGroupAdderWindow()
     window.show()
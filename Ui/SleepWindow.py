@@ -8,6 +8,8 @@ from Ui.Utility.Window import *
 from Ui.Utility.Widget import AlignHCLabel, DateEdit
 from Model import TimeUtility
 from Model.DbTableModel.SleepModel import SleepUtility
+from Model import DbWriter
+from Model.DataAccessor import QueryInstrument
 from Model.DataAccessor.Configure import config
 
 
@@ -65,18 +67,23 @@ class SleepAdderPanel(QWidget):
         self.end_hour.setValue(times[2])
         self.end_minute.setValue(times[3])
 
+    @QueryInstrument.scoped
     def add(self):
         date = self.date.get_date()
         delta_start = datetime.timedelta(hours=self.start_hour.value(), minutes=self.start_minute.value())
         delta_end = datetime.timedelta(hours=self.end_hour.value(), minutes=self.end_minute.value())
 
-        try:
-            feedback = SleepUtility.create_by_date(date, delta_start, delta_end)
-            self.owner.message_box.setText("{0}:  +{1}  -->  {2}".format(
-                feedback['date'], TimeUtility.str_timedelta(feedback['growth']),
-                TimeUtility.str_timedelta(feedback['after'])))
-        except ValueError as ex:
-            self.owner.message_box.setText("Failed. (ValueError: %s)" % str(ex))
+        DbWriter.submit(lambda: SleepUtility.create_by_date(date, delta_start, delta_end),
+                        on_success=self.on_added, on_failure=self.on_failed)
+        self.owner.message_box.setText("Saving...")
+
+    def on_added(self, feedback):
+        self.owner.message_box.setText("{0}:  +{1}  -->  {2}".format(
+            feedback['date'], TimeUtility.str_timedelta(feedback['growth']),
+            TimeUtility.str_timedelta(feedback['after'])))
+
+    def on_failed(self, ex):
+        self.owner.message_box.setText("Failed. (%s: %s)" % (type(ex).__name__, str(ex)))
 
     @staticmethod
     def get_default_time_config(current):
@@ -92,6 +99,7 @@ class SleepAdderPanel(QWidget):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(DbWriter.shutdown)
 
     window = SleepAdderWindow()
     window.show()
@@ -2,6 +2,7 @@ from PyQt5.QtGui import QCursor
 from PyQt5.QtWidgets import *
 
 from Ui.Utility.Widget import HBoxMenu
+from Model.DataAccessor import QueryInstrument
 
 
 class PanelChangeable(object):
@@ -21,6 +22,7 @@ class PanelChangeable(object):
     def _create_panels(self):
         raise NotImplementedError
 
+    @QueryInstrument.scoped
     def change_panel(self, index):
         if self.current_panel:
             self.current_panel.hide()
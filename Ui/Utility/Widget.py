@@ -8,6 +8,7 @@ from PyQt5.QtGui import *
 
 from Model.DbTableModel.BaseModel import DurationType
 from Model.TreeViewModel import RecordGroupTreeModel
+from Model.DbTableModel.RecordModel import RecordUtility
 from Model.Utility import DateFilter
 
 
@@ -272,12 +273,21 @@ class RecordGroupComboBox(BaseComboBox):
             self._add_item_by_node(level0, 0)
 
     def insert_item_by_group(self, group):
-        # Find last sibling's position, +1 to insert after
-        children = group.parent.children
-        node_appended = group.parent if len(children) <= 1 else children[-2]
-        index = self.findData(node_appended.id) + 1
+        hierarchy = RecordUtility.Group.get_hierarchy()
+        parent_id = hierarchy.get_parent_id(group.id)
+        if parent_id is None:
+            self.addItem(*self.text_and_data(group, 0))
+            return
+
+        # Find the last item under previous sibling, +1 to insert after
+        siblings = hierarchy.get_children_ids(parent_id)
+        if len(siblings) <= 1:
+            id_appended = parent_id
+        else:
+            id_appended = ([siblings[-2]] + hierarchy.get_descendant_ids(siblings[-2]))[-1]
+        index = self.findData(id_appended) + 1
 
-        self.insertItem(index, *self.text_and_data(group, group.level))
+        self.insertItem(index, *self.text_and_data(group, hierarchy.get_level(group.id)))
 
     def _add_item_by_node(self, node, level):
         self.addItem(*self.text_and_data(node, level))